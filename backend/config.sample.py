@@ -5,3 +5,49 @@ class Configuration(object):
     SECRET_KEY = os.environ.get('SECRET_KEY', 'secret_key')
     ALLOWED_USER_EMAIL = os.environ.get('ALLOWED_USER_EMAIL', 'user@example.com')
     DEV_USER_EMAIL = os.environ.get('DEV_USER_EMAIL', 'user@example.com')
+    # Number of gRPC channels the shared ndb client spreads Datastore calls over.
+    NDB_CHANNEL_POOL_SIZE = int(os.environ.get('NDB_CHANNEL_POOL_SIZE', '1'))
+    # ndb global cache for entity lookups: '' (disabled, the default), 'redis'
+    # or 'lru'. 'redis' requires the server at REDIS_CACHE_URL: writes fail
+    # while it is unreachable. 'lru' lives in the process and is only safe
+    # with a single process, one worker on one instance: the others would
+    # serve entities written elsewhere until the TTL. Only WEB_CONCURRENCY
+    # is checked, not --workers or the number of instances.
+    GLOBAL_CACHE = os.environ.get('GLOBAL_CACHE', '')
+    GLOBAL_CACHE_TTL = int(os.environ.get('GLOBAL_CACHE_TTL', '300'))
+    GLOBAL_CACHE_MAX_ENTRIES = int(os.environ.get('GLOBAL_CACHE_MAX_ENTRIES', '10000'))
+    # Per-kind entry limits for the 'lru' backend, e.g. "Run=5000,Weight=2000".
+    GLOBAL_CACHE_KIND_LIMITS = os.environ.get('GLOBAL_CACHE_KIND_LIMITS', '')
+    REDIS_CACHE_URL = os.environ.get('REDIS_CACHE_URL', '')
+    # Number of items on a page of the list views and the API.
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', '50'))
+    # CSV import: rows saved per put_multi and batches saved at the same time.
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '400'))
+    IMPORT_CONCURRENCY = int(os.environ.get('IMPORT_CONCURRENCY', '4'))
+    # Reads the import files below this directory instead of the bucket.
+    IMPORT_LOCAL_DIR = os.environ.get('IMPORT_LOCAL_DIR', '')
+    # Seconds between two saves of the progress of an import.
+    IMPORT_CHECKPOINT_SECONDS = int(os.environ.get('IMPORT_CHECKPOINT_SECONDS', '5'))
+    # Data migrations: entities read per page and write throttle (0 for none).
+    MIGRATION_PAGE_SIZE = int(os.environ.get('MIGRATION_PAGE_SIZE', '200'))
+    MIGRATION_MAX_WRITES_PER_SECOND = int(os.environ.get('MIGRATION_MAX_WRITES_PER_SECOND', '0'))
+    # Background jobs: threads per process, seconds between progress saves.
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+    JOB_PROGRESS_SECONDS = int(os.environ.get('JOB_PROGRESS_SECONDS', '2'))
+    # Seconds between two saves of the jobs a process holds, and without a
+    # save after which a queued or running job is reported failed.
+    JOB_HEARTBEAT_SECONDS = int(os.environ.get('JOB_HEARTBEAT_SECONDS', '60'))
+    JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '300'))
+    # Request tracing (1 to enable): Server-Timing header and spans on the
+    # request log line. TRACING_EXPORTER also exports the spans as OTLP
+    # JSON: 'file' (to TRACING_FILE), 'otlp' (to a collector) or '' (none).
+    TRACING = int(os.environ.get('TRACING', '0'))
+    TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', '')
+    TRACING_FILE = os.environ.get('TRACING_FILE', 'traces.jsonl')
+    TRACING_OTLP_ENDPOINT = os.environ.get('TRACING_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACING_SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'eridanus')
+    # Metrics at /admin/metrics. With gunicorn workers, a directory shared
+    # by them (emptied before the start) where each writes its counters
+    # every METRICS_FLUSH_SECONDS; empty for the current process only.
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+    METRICS_FLUSH_SECONDS = int(os.environ.get('METRICS_FLUSH_SECONDS', '1'))
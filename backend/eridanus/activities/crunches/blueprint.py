@@ -17,12 +17,12 @@ service = CrunchesService()
 @login_required
 def index():
     username = session['nickname']
-    items = service.fetch_all(username)
-    logger.debug(f'Received the following items: {items}')
+    page = service.fetch_all(username, cursor=request.args.get('cursor'))
+    logger.debug('Received the following items: %s', page['items'])
 
     return render_template(
         'activities/crunches/index.html',
-        viewmodel={'items': items})
+        viewmodel=page)
 
 
 @crunches.route('/create/', methods=['GET', 'POST'])
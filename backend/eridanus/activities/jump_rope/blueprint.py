@@ -23,9 +23,9 @@ service = JumpRopeService()
 @login_required
 def index():
     username = session['nickname']
-    items = service.fetch_all(username)
+    page = service.fetch_all(username, cursor=request.args.get('cursor'))
     return render_template(
-        'activities/jump_rope/index.html', viewmodel={'items': items})
+        'activities/jump_rope/index.html', viewmodel=page)
 
 
 
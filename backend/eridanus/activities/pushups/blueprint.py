@@ -21,9 +21,9 @@ service = PushupsService()
 @login_required
 def index():
     username = session['nickname']
-    items = service.fetch_all(username)
+    page = service.fetch_all(username, cursor=request.args.get('cursor'))
     return render_template(
-        'activities/pushups/index.html', viewmodel={'items': items})
+        'activities/pushups/index.html', viewmodel=page)
 
 
 @pushup_activities.route("/create/", methods=['GET', 'POST'])
@@ -24,7 +24,7 @@ running_activities = Blueprint(
 def index():
     ''' create the viewmodel and return the view '''
     username = session['nickname']
-    items = service.fetch_all(username)
+    items = service.fetch_all(username, cursor=request.args.get('cursor'))
     return render_template('activities/running/index.html', vm=items)
 
 
@@ -2,20 +2,44 @@ import logging
 
 from eridanus.utils.format import format_date, format_time
 from eridanus.services import CrudService
-from eridanus.repository import CrunchesRepository, JumpRopeRepository, PushUpsRepository, RunRepository
+from eridanus.repository import CrunchesRepository, JumpRopeRepository, PushUpsRepository, RunRepository, \
+    StatisticsRepository
 from eridanus.models import Activity, Run # Import models for ordering
+from eridanus.singleflight import single_flight
+from eridanus.tracing import traced
+from eridanus.statistics.user_stats import kind_of, run_speed
 
 logger = logging.getLogger(__name__)
 
+# Properties shown by the list pages, read with projection queries. Each
+# set needs its composite index in index.yaml. Runs are read whole, for
+# their stored speed.
+ACTIVITY_LIST_FIELDS = ('activity_date', 'activity_time', 'calories', 'count', 'duration')
+
 class BaseActivityService(CrudService):
 
     def __init__(self, repository):
         self.repository = repository
-
-    def fetch_all(self, username):
+        self.statistics = StatisticsRepository()
+
+    @traced()
+    def fetch_all(self, username, cursor=None, page_size=None):
+        page_size = self.page_size(page_size)
+        # Requests arriving together for the same page of the same data
+        # share one read.
+        key = (username, kind_of(self.repository.model_class), self.statistics.data_version(username),
+               cursor, page_size)
+        return single_flight(key, self._fetch_all, username, cursor, page_size)
+
+    def _fetch_all(self, username, cursor, page_size):
         items = []
         # Use NDB properties for ordering
-        models = self.repository.fetch_by_username(username, order=[-Activity.activity_date, -Activity.activity_time])
+        models, next_cursor = self.repository.fetch_page(
+            username,
+            page_size,
+            cursor=cursor,
+            order=[-Activity.activity_date, -Activity.activity_time],
+            projection=ACTIVITY_LIST_FIELDS)
         if models is not None:
             for model in models:
                 # Use attribute access on the model object
@@ -24,21 +48,35 @@ class BaseActivityService(CrudService):
                         'count': model.count,
                         'calories': model.calories,
                         'duration': model.duration,
-                        'notes': model.notes,
                         'id': model.key.id() # Use id() method
                         }
                 items.append(item)
-        return items
-
+        return {'items': items, 'records': self._records(username), 'next_cursor': next_cursor}
+
+    def _records(self, username):
+        '''
+        Records over the whole history, from the user's records index.
+        '''
+        kind = kind_of(self.repository.model_class)
+        records = self.statistics.records(username)
+        return {'max_count': records.best(kind, 'repetitions'),
+                'max_time': records.best(kind, 'duration'),
+                'max_rate': records.best(kind, 'rate', 0.0),
+                'max_calories': records.best(kind, 'calories')}
+
+    @traced()
     def create(self, activity):
         return self.repository.create(activity)
 
+    @traced()
     def read(self, activity_id):
         return self.repository.read(activity_id)
 
+    @traced()
     def update(self, activity):
         return self.repository.update(activity)
 
+    @traced()
     def delete(self, activity_id):
         return self.repository.delete(activity_id)
 
@@ -62,25 +100,29 @@ class RunningService(CrudService):
 
     def __init__(self, repository=None):
         self.repository = RunRepository()
-
-    def fetch_all(self, username):
-        items = self._fetch_all(username)
-        records = self._compute_records(items)
-        return {'items': items, 'records': records}
-
-    def _fetch_all(self, username):
+        self.statistics = StatisticsRepository()
+
+    @traced()
+    def fetch_all(self, username, cursor=None, page_size=None):
+        page_size = self.page_size(page_size)
+        # Requests arriving together for the same page of the same data
+        # share one read.
+        key = (username, 'running', self.statistics.data_version(username), cursor, page_size)
+        return single_flight(key, self._fetch_all, username, cursor, page_size)
+
+    def _fetch_all(self, username, cursor, page_size):
+        items, next_cursor = self._fetch_page(username, cursor, page_size)
+        records = self._records(username)
+        return {'items': items, 'records': records, 'next_cursor': next_cursor}
+
+    def _fetch_page(self, username, cursor, page_size):
         items = []
         # Use NDB properties for ordering
-        models = self.repository.fetch_by_username(username, order=[-Run.activity_date, -Run.activity_time])
+        models, next_cursor = self.repository.fetch_page(
+            username, page_size, cursor=cursor, order=[-Run.activity_date, -Run.activity_time])
         for model in models:
             duration = model.duration
-            speed = 'N/A'
-            
-            # Check for attribute and its value, then calculate if needed
-            if hasattr(model, 'speed') and model.speed:
-                speed = model.speed
-            elif model.distance and duration and duration > 0:
-                speed = model.distance / (duration / 60.0)
+            speed = run_speed(model) or 'N/A'
 
             # Use attribute access on the model object
             item = {'duration': duration,
@@ -92,37 +134,32 @@ class RunningService(CrudService):
                     'id': model.key.id() # Use id() method
                     }
             items.append(item)
-        return items
-
-    def _compute_records(self, items):
-        records = {'max_distance': 0,
-                   'max_time': 0,
-                   'max_speed': 0.0,
-                   'max_calories': 0}
-        for item in items:
-            if records['max_distance'] < item['distance']:
-                records['max_distance'] = item['distance']
-            if records['max_time'] < item['duration']:
-                records['max_time'] = item['duration']
-            
-            # Ensure speed is a number before comparing
-            current_speed = item.get('speed', 0.0)
-            if isinstance(current_speed, (int, float)) and records['max_speed'] < current_speed:
-                records['max_speed'] = current_speed
-                
-            if item.get('calories') and records['max_calories'] < item['calories']:
-                records['max_calories'] = item['calories']
-        return records
-
+        return items, next_cursor
+
+    def _records(self, username):
+        '''
+        Records over the whole history, not just the current page. They come
+        from the user's records index.
+        '''
+        records = self.statistics.records(username)
+        return {'max_distance': records.best('running', 'distance'),
+                'max_time': records.best('running', 'duration'),
+                'max_speed': records.best('running', 'speed', 0.0),
+                'max_calories': records.best('running', 'calories')}
+
+    @traced()
     def create(self, activity):
         self.repository.create(activity)
 
+    @traced()
     def read(self, activity_id):
         logging.info(f'Read running entity having id {activity_id}')
         return self.repository.read(activity_id)
 
+    @traced()
     def update(self, activity):
         self.repository.update(activity)
 
+    @traced()
     def delete(self, activity_id):
         self.repository.delete(activity_id)
\ No newline at end of file
@@ -1,32 +1,17 @@
-from flask import Blueprint, make_response, render_template, session, abort, jsonify
+from flask import Blueprint, Response, render_template, session, abort, jsonify, \
+    request, stream_with_context, url_for
 from flask_login import login_required, current_user
-from io import BytesIO
-from zipfile import ZipFile
-from eridanus.admin.services import ExportDataService, ImportDataServices
-from eridanus.admin.migration_add_speed import migrate_runs
+from eridanus.admin import jobs as admin_jobs # Registers the job handlers
+from eridanus.admin.services import ExportDataService, default_storage
+from eridanus.migrations import MIGRATIONS
+from eridanus import cache, datastore, jobs, metrics, singleflight
+from eridanus.repository import JobRepository, StatisticsRepository
 from google.cloud import ndb
 from config import Configuration # Assuming Configuration is accessible here, or import from main if not.
 
 admin = Blueprint('admin', __name__, template_folder='templates')
 
 
-def _zip(file, data_streams):
-    zip = ZipFile(file, 'a')
-    for key in data_streams:
-        filename = key + '.csv'
-        zip.writestr(filename, data_streams[key])
-    for f in zip.filelist:
-        f.create_system = 0
-    zip.close()
-    file.seek(0)
-    return file
-
-
-def _zip_in_memory(data_streams):
-    file = BytesIO()
-    return _zip(file, data_streams)
-
-
 @admin.route('/', methods=['GET'])
 @login_required
 def index():
@@ -38,42 +23,133 @@ def index():
 def export(format):
     service = ExportDataService()
     username = session['nickname']
-    data = {}
-    data['run'] = service.get_run_data(username, format)
-    data['weight'] = service.get_weight_data(username, format)
-    zip_stream = _zip_in_memory(data)
-    response = make_response(zip_stream.getvalue())
+    # The archive is generated while it is sent: rows are compressed as
+    # the query batches arrive and the request's ndb context is kept open
+    # until the last chunk.
+    response = Response(stream_with_context(service.export_zip(username, format)))
     response.headers["Content-Disposition"] = 'attachment;' \
         + 'filename=eridanus_data.zip'
     response.headers['Cache-Control'] = 'no-cache'
     response.headers['Content-Type'] = 'application/zip'
-    # in_memory.seek(0)    
-    # response.write(in_memory.read()) #?
     return response
 
 
-@admin.route('/import/<folder>', methods=['GET'])
+def _submitted(job):
+    """
+    The response to a job submission: its status and where to poll it.
+    """
+    data = jobs.status(job)
+    data['url'] = url_for('admin.job_status', job_id=job.key.id())
+    response = jsonify(data)
+    response.status_code = 202
+    response.headers['Location'] = data['url']
+    return response
+
+
+@admin.route('/export/<format>/job', methods=['POST'])
+@login_required
+def export_job(format):
+    """
+    Exports in the background to the default storage; the archive is
+    downloaded from the job once it succeeded.
+    """
+    return _submitted(jobs.submit('export', session['nickname'], {'format': format}))
+
+
+@admin.route('/import/<folder>', methods=['POST'])
 @login_required
 def import_index(folder):
-    service = ImportDataServices()
-    username = session['nickname']
-    data = service.import_from_csv(folder, username)
-    response = make_response()
-    response.headers['Content-Type'] = 'text/plain'
-    response.set_data(str(data))
+    return _submitted(jobs.submit('import', session['nickname'], {'folder': folder}))
+
+
+@admin.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = JobRepository().read(job_id)
+    if job is None or job.username != session['nickname']:
+        abort(404)
+    return jsonify(jobs.status(job))
+
+
+@admin.route('/jobs/<job_id>/download', methods=['GET'])
+@login_required
+def job_download(job_id):
+    job = JobRepository().read(job_id)
+    if job is None or job.username != session['nickname'] or job.kind != 'export':
+        abort(404)
+    if job.status != jobs.SUCCEEDED:
+        abort(409)
+    source = default_storage()
+    if source is None:
+        abort(404)
+
+    def chunks():
+        with source.open(job.result['filename']) as stream:
+            for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                yield chunk
+
+    response = Response(chunks())
+    response.headers["Content-Disposition"] = 'attachment;' \
+        + 'filename=eridanus_data.zip'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Content-Type'] = 'application/zip'
     return response
 
 @admin.route('/run_speed_migration', methods=['POST']) # Changed to POST to prevent accidental GET
 @login_required
 def run_speed_migration():
+    return run_migration('add_run_speed')
+
+
+@admin.route('/migrations/<name>', methods=['POST'])
+@login_required
+def run_migration(name):
+    """
+    Runs a migration from where it stopped, as a background job. Query
+    arguments: ``pages`` to stop after that many pages (and submit again to
+    go on), ``dry_run=1`` to only count the changes and ``restart=1`` to
+    start from the beginning.
+    """
     # Ensure only the allowed admin user can trigger this
     if current_user.email != Configuration.ALLOWED_USER_EMAIL:
         abort(403) # Forbidden
-    
-    # The ndb.Client context should be managed by the Flask app's before/teardown request hooks
-    # So we just need to call the migration function.
-    try:
-        migrate_runs()
-        return jsonify({"status": "success", "message": "Migrarea speed-ului a fost rulată cu succes!"})
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Eroare la rularea migrării: {str(e)}"}), 500
+    if name not in MIGRATIONS:
+        abort(404)
+
+    return _submitted(jobs.submit('migration', session['nickname'], {
+        'name': name,
+        'pages': request.args.get('pages', type=int),
+        'dry_run': request.args.get('dry_run') == '1',
+        'restart': request.args.get('restart') == '1',
+    }))
+
+
+@admin.route('/rebuild_stats', methods=['POST'])
+@login_required
+def rebuild_stats():
+    if current_user.email != Configuration.ALLOWED_USER_EMAIL:
+        abort(403)
+    username = session['nickname']
+    StatisticsRepository().rebuild_user_stats(username)
+    return jsonify({"status": "success", "username": username})
+
+
+@admin.route('/datastore/', methods=['GET'])
+@login_required
+def datastore_metrics():
+    if current_user.email != Configuration.ALLOWED_USER_EMAIL:
+        abort(403)
+    metrics = datastore.client_metrics()
+    metrics['global_cache'] = cache.cache_metrics()
+    metrics['single_flight'] = singleflight.single_flight_metrics()
+    return jsonify(metrics)
+
+
+@admin.route('/metrics', methods=['GET'])
+@login_required
+def openmetrics():
+    if current_user.email != Configuration.ALLOWED_USER_EMAIL:
+        abort(403)
+    response = Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
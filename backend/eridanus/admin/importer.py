@@ -0,0 +1,238 @@
+import collections
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from eridanus.repository import BATCH_SIZE
+from eridanus.settings import int_setting
+
+logger = logging.getLogger(__name__)
+
+# Invalid rows reported with their line number, the others are only counted.
+MAX_REPORTED_ERRORS = 20
+
+# Bytes read from Cloud Storage per request while streaming a file.
+STORAGE_CHUNK_SIZE = 1024 * 1024
+
+
+class LocalStorage(object):
+    """
+    Stand-in for a Cloud Storage bucket which reads the files below a local
+    directory, for development and tests.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.name = 'file://' + os.path.abspath(root)
+
+    def open(self, filename):
+        return open(os.path.join(self.root, filename), 'rb')
+
+    def create(self, filename, content_type=None):
+        path = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, 'wb')
+
+    def fingerprint(self, filename):
+        stat = os.stat(os.path.join(self.root, filename))
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class CloudStorage(object):
+    """
+    Reads files from a Cloud Storage bucket one chunk at a time instead of
+    downloading them whole.
+    """
+
+    def __init__(self, bucket, chunk_size=STORAGE_CHUNK_SIZE):
+        self.bucket = bucket
+        self.name = bucket.name
+        self.chunk_size = chunk_size
+
+    def open(self, filename):
+        return self.bucket.blob(filename).open('rb', chunk_size=self.chunk_size)
+
+    def create(self, filename, content_type=None):
+        blob = self.bucket.blob(filename)
+        blob.content_type = content_type
+        return blob.open('wb', chunk_size=self.chunk_size)
+
+    def fingerprint(self, filename):
+        blob = self.bucket.get_blob(filename)
+        return str(blob.generation) if blob else None
+
+
+class _Progress(object):
+    """
+    Tracks how many data rows at the start of a file are known to be saved
+    and stores it in an ImportCheckpoint, at most once per ``interval``
+    seconds. Resuming from a slightly older checkpoint only saves a few
+    rows again, which the natural ids make harmless.
+    """
+
+    def __init__(self, checkpoints, name, filename, fingerprint, position, interval):
+        self.checkpoints = checkpoints
+        self.name = name
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.position = position
+        self.interval = interval
+        self.saved_at = time.monotonic()
+
+    def advance(self, position):
+        self.position = position
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.save()
+
+    def save(self, completed=False):
+        if self.checkpoints is None:
+            return
+        self.checkpoints.save_checkpoint(self.name, self.filename, self.fingerprint,
+                                         self.position, completed=completed)
+        self.saved_at = time.monotonic()
+
+
+class CsvImport(object):
+    """
+    Streams a CSV file into Datastore. Rows are parsed and validated as
+    they are read and saved in batches by a small pool of threads, so
+    reading the next batch overlaps with writing the previous ones.
+
+    The entities are saved with ``load_many``, bypassing the write
+    listeners, and the derived data of the users found in the file is
+    invalidated once every batch is saved. Since ``load_many`` derives the
+    ids from the records, importing a file again overwrites the entities
+    instead of duplicating them.
+
+    With ``checkpoints`` the progress through a file is saved as the
+    batches complete, and an interrupted import of the same file resumes
+    after the rows already saved.
+    """
+
+    def __init__(self, repository, parse, batch_size=None, concurrency=None, checkpoints=None):
+        """
+        :param repository: The CrudRepository of the imported kind.
+        :param parse: Turns a CSV row into a record for the repository,
+            raising ValueError, KeyError, TypeError or ArithmeticError for
+            invalid rows.
+        :param checkpoints: An ImportRepository, None to always start over.
+        """
+        self.repository = repository
+        self.parse = parse
+        self.batch_size = batch_size or int_setting('IMPORT_BATCH_SIZE', BATCH_SIZE)
+        self.concurrency = max(1, concurrency or int_setting('IMPORT_CONCURRENCY', 4))
+        self.checkpoints = checkpoints
+        self.checkpoint_interval = int_setting('IMPORT_CHECKPOINT_SECONDS', 5)
+
+    def run(self, stream, filename=None, fingerprint=None, progress=None):
+        """
+        Imports the rows of a binary, UTF-8 encoded CSV stream.
+        :param filename: Names the checkpoint of the file.
+        :param fingerprint: Identifies the version of the file; a checkpoint
+            taken on another version is ignored.
+        :param progress: Called with the report so far as batches complete.
+        :return: A report with the number of rows read, skipped because an
+            earlier run saved them, imported and invalid, the first invalid
+            rows and the throughput.
+        """
+        checkpoint = self._progress(filename, fingerprint)
+        report = {'rows': 0, 'skipped': checkpoint.position, 'imported': 0, 'invalid': 0, 'errors': []}
+        usernames = set()
+        started = time.monotonic()
+        # Bounds the batches held in memory: those being written plus the
+        # one being read.
+        slots = threading.BoundedSemaphore(self.concurrency)
+        # Batches in file order, with the position after their last row.
+        pending = collections.deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency,
+                                    thread_name_prefix='csv-import') as executor:
+                records = self._records(stream, report, usernames, checkpoint.position)
+                for position, batch in self._batches(records):
+                    slots.acquire()
+                    future = executor.submit(self._save, batch)
+                    future.add_done_callback(lambda _: slots.release())
+                    pending.append((future, position))
+                    self._collect(pending, checkpoint, report, progress)
+            self._collect(pending, checkpoint, report, progress)
+            checkpoint.position = report['skipped'] + report['rows']
+            checkpoint.save(completed=True)
+        except Exception:
+            checkpoint.save()
+            raise
+        finally:
+            # Also after a failed batch, since the others were saved.
+            if usernames:
+                self.repository.invalidate_derived(sorted(usernames))
+
+        report['seconds'] = time.monotonic() - started
+        report['rows_per_second'] = report['rows'] / report['seconds'] if report['seconds'] else 0.0
+        logger.info(f"Imported {report['imported']} of {report['rows']} rows of kind "
+                    f"{self.repository.model_class.__name__} in {report['seconds']:.2f}s "
+                    f"({report['rows_per_second']:.0f} rows/s), {report['invalid']} invalid, "
+                    f"{report['skipped']} skipped.")
+        return report
+
+    def _progress(self, filename, fingerprint):
+        name = f'{self.repository.model_class.__name__}:{filename}'
+        position = 0
+        if self.checkpoints is not None and filename:
+            checkpoint = self.checkpoints.checkpoint(name)
+            if checkpoint and not checkpoint.completed and checkpoint.fingerprint == fingerprint:
+                position = checkpoint.rows_done
+                logger.info(f'Resuming the import of {filename} after row {position}.')
+        checkpoints = self.checkpoints if filename else None
+        return _Progress(checkpoints, name, filename, fingerprint, position, self.checkpoint_interval)
+
+    def _collect(self, pending, checkpoint, report, progress):
+        # Only a run of completed batches from the start of the file moves
+        # the checkpoint; a failed batch stops it where it is.
+        collected = False
+        while pending and pending[0][0].done():
+            future, position = pending.popleft()
+            report['imported'] += future.result()
+            checkpoint.advance(position)
+            collected = True
+        if collected and progress is not None:
+            progress(report)
+
+    def _save(self, batch):
+        self.repository.load_many(batch)
+        return len(batch)
+
+    def _records(self, stream, report, usernames, skip):
+        """
+        Yields (position, record) pairs, position being the number of data
+        rows read from the start of the file.
+        """
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        reader = csv.DictReader(text, dialect='excel')
+        position = 0
+        for row in reader:
+            position += 1
+            if position <= skip:
+                continue
+            report['rows'] += 1
+            try:
+                record = self.parse(row)
+            except (ArithmeticError, KeyError, TypeError, ValueError) as e:
+                report['invalid'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'line': reader.line_num, 'error': str(e)})
+                continue
+            usernames.add(record['usernickname'])
+            yield position, record
+
+    def _batches(self, records):
+        batch = []
+        for position, record in records:
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                yield position, batch
+                batch = []
+        if batch:
+            yield position, batch
@@ -0,0 +1,24 @@
+from eridanus import jobs
+from eridanus.admin.services import ExportDataService, ImportDataServices
+from eridanus.migrations import MIGRATIONS
+from eridanus.migrations.runner import MigrationRunner
+
+
+@jobs.handler('export')
+def run_export(job, progress):
+    filename = f'export/{job.username}/eridanus_data_{job.key.id()}.zip'
+    return ExportDataService().export_to_storage(
+        job.username, job.params.get('format', 'csv'), filename, progress=progress)
+
+
+@jobs.handler('import')
+def run_import(job, progress):
+    return ImportDataServices().import_from_csv(job.params['folder'], job.username, progress=progress)
+
+
+@jobs.handler('migration')
+def run_migration(job, progress):
+    params = job.params
+    runner = MigrationRunner(MIGRATIONS[params['name']](), dry_run=params.get('dry_run', False))
+    return runner.run(max_pages=params.get('pages'), restart=params.get('restart', False),
+                      progress=progress)
@@ -1,4 +1,7 @@
+from eridanus.admin.importer import CloudStorage, CsvImport, LocalStorage
+from eridanus.settings import setting
 from eridanus.utils.format import to_date, to_time, to_datetime
+from eridanus.utils.zipstream import stream_zip
 from google.cloud import storage
 from io import StringIO
 
@@ -11,22 +14,73 @@ IMPORT_TIME_FORMAT = '%H:%M:%S'
 IMPORT_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
 
+def default_storage():
+    """
+    Returns the storage of the import and export files: the local directory
+    set with IMPORT_LOCAL_DIR, else the default bucket, else None.
+    """
+    local_dir = setting('IMPORT_LOCAL_DIR')
+    if local_dir:
+        return LocalStorage(local_dir)
+    bucket_name = os.environ.get('BUCKET_NAME')
+    if not bucket_name:
+        project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
+        if project_id:
+            bucket_name = project_id + '.appspot.com'
+    if not bucket_name:
+        return None
+    client = storage.Client()
+    return CloudStorage(client.bucket(bucket_name))
+
+# Entities read per Datastore RPC, and CSV rows handed to the ZIP stream
+# at a time, by the export.
+EXPORT_BATCH_SIZE = 500
+
+
 class ExportDataService(object):
+    """
+    Exports the data of a user as CSV files. The files are generated row
+    by row while the entities are read, so the export never holds more
+    than a batch of them.
+    """
+
+    def export_zip(self, username, format):
+        """
+        Returns a generator of the bytes of a ZIP archive holding one CSV
+        file per kind.
+        """
+        return stream_zip([
+            ('run.csv', self.get_run_data(username, format)),
+            ('weight.csv', self.get_weight_data(username, format)),
+        ])
+
+    def export_to_storage(self, username, format, filename, progress=None):
+        """
+        Writes the ZIP archive of ``export_zip`` to ``filename`` in the
+        default storage, for exports run as background jobs.
+        """
+        target = default_storage()
+        if target is None:
+            raise ValueError('No storage is configured for exports.')
+        size = 0
+        with target.create(filename, content_type='application/zip') as stream:
+            for chunk in self.export_zip(username, format):
+                stream.write(chunk)
+                size += len(chunk)
+                if progress is not None:
+                    progress({'bytes': size})
+        return {'storage': target.name, 'filename': filename, 'bytes': size}
 
     def get_run_data(self, username, format):
+        """
+        Returns a generator of the UTF-8 encoded CSV of the user's runs.
+        """
         repo = repository.RunRepository()
-        items = repo.fetch_by_username(username)
-        stream = StringIO()
+        items = repo.iter_by_username(username, batch_size=EXPORT_BATCH_SIZE)
         fieldnames = ['usernickname', 'activity_date', 'activity_time',
                       'duration', 'distance', 'speed', 'calories', 
                       'notes', 'creation_datetime']
-        csvwriter = csv.DictWriter(
-                        stream,
-                        fieldnames=fieldnames,
-                        dialect='excel')
-        csvwriter.writeheader()
-        for model in items:
-            csvwriter.writerow({
+        rows = ({
                 'usernickname': model.usernickname, 
                 'activity_date': model.activity_date,
                 'activity_time': model.activity_time,
@@ -36,100 +90,108 @@ class ExportDataService(object):
                 'calories': model.calories,
                 'notes': model.notes,
                 'creation_datetime': model.creation_datetime
-                })
-        return stream.getvalue()
+                } for model in items)
+        return self._csv_chunks(fieldnames, rows)
 
     def get_weight_data(self, username, format):
+        """
+        Returns a generator of the UTF-8 encoded CSV of the user's weighings.
+        """
         repo = repository.WeightRepository()
-        items = repo.fetch_by_username(username)
-        stream = StringIO()
-        csvwriter = csv.writer(stream, dialect='excel')
+        items = repo.iter_by_username(username, batch_size=EXPORT_BATCH_SIZE)
         fieldnames = ['usernickname', 'weight', 'creation_datetime']
+        rows = ({
+                'usernickname': item.usernickname,
+                'weight': item.weight,
+                'creation_datetime': item.creation_datetime
+                } for item in items)
+        return self._csv_chunks(fieldnames, rows)
+
+    def _csv_chunks(self, fieldnames, rows):
+        stream = StringIO()
         csvwriter = csv.DictWriter(
             stream,
             fieldnames=fieldnames,
             dialect='excel')
         csvwriter.writeheader()
-        for item in items:
-            csvwriter.writerow({
-                'usernickname': item.get('usernickname'),
-                'weight': item.get('weight'),
-                'creation_datetime': item.get('creation_datetime')
-                })
-        return stream.getvalue()
+        for count, row in enumerate(rows, 1):
+            csvwriter.writerow(row)
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield self._drain(stream)
+        yield self._drain(stream)
+
+    def _drain(self, stream):
+        data = stream.getvalue().encode('utf-8')
+        stream.seek(0)
+        stream.truncate()
+        return data
 
 
 class ImportDataServices(object):
+    """
+    Imports CSV files from the import folder of the default bucket, or of
+    the local directory set with IMPORT_LOCAL_DIR.
+    """
 
-    def import_from_csv(self, folder, username):
+    def import_from_csv(self, folder, username, progress=None):
+        """
+        :param progress: Called with the report of the file being imported
+            as its batches complete.
+        """
         audit = {}
-        bucket = self._get_default_bucket()
-        audit['default_bucket'] = bucket.name if bucket else None
-        if bucket:
+        source = default_storage()
+        audit['default_bucket'] = source.name if source else None
+        if source:
             import_folder = 'import/' + folder
-            # self._import_run_csv(bucket, import_folder)
-            self._import_weight_csv(bucket, import_folder)
+            # audit['run'] = self._import_run_csv(source, import_folder, progress)
+            audit['weight'] = self._import_weight_csv(source, import_folder, progress)
         return audit
 
-    def _get_default_bucket(self):
-        bucket_name = os.environ.get('BUCKET_NAME')
-        if not bucket_name:
-            project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
-            if project_id:
-                bucket_name = project_id + '.appspot.com'
-        if not bucket_name:
-            return None
-        client = storage.Client()
-        return client.bucket(bucket_name)
-
-    def _read_file(self, bucket, filename):
-        blob = bucket.blob(filename)
-        return blob.download_as_bytes()
-
-    def _import_run_csv(self, bucket, import_folder):
-        audit = {}
-        filename = import_folder + '/run.csv'
-        content = self._read_file(bucket, filename)
-        stream = StringIO(content.decode('utf-8'))
-        csvReader = csv.DictReader(stream, dialect='excel')
-        for row in csvReader:
-            repo = repository.RunRepository()
-            duration = int(row['duration'])
-            distance = float(row['distance'])
-            speed = None
-            if row['speed']:
-                speed = float(row['speed'])
-            else:
-                speed = distance / (duration / 60.0)
-            repo.create({
-                'usernickname': row['usernickname'],
-                'activity_date': to_date(
-                    row['activity_date'], IMPORT_DATE_FORMAT),
-                'activity_time': to_time(
-                    row['activity_time'], IMPORT_TIME_FORMAT),
-                'duration': duration,
-                'distance': distance,
-                'speed': speed,
-                'calories': int(row['calories']),
-                'notes': row['notes'],
-                'creation_datetime': to_datetime(
-                    row['creation_datetime'], IMPORT_DATETIME_FORMAT)
-            })
+    def _import_csv(self, source, filename, repo, parse, progress=None):
+        fingerprint = source.fingerprint(filename)
+        importer = CsvImport(repo, parse, checkpoints=repository.ImportRepository())
+        with source.open(filename) as stream:
+            audit = importer.run(stream, filename=filename, fingerprint=fingerprint, progress=progress)
         audit['filename'] = filename
         return audit
 
-    def _import_weight_csv(self, bucket, import_folder):
-        filename = import_folder + '/weight.csv'
-        content = self._read_file(bucket, filename)
-        stream = StringIO(content.decode('utf-8'))
-        csvReader = csv.DictReader(stream, dialect='excel')
-        for row in csvReader:
-            repo = repository.WeightRepository()
-            repo.create({
-                'usernickname': row['usernickname'],
-                'weight': float(row['weight']),
-                'weighing_date': to_date(
-                    row['creation_datetime'], IMPORT_DATETIME_FORMAT),
-                'creation_datetime': to_datetime(
-                    row['creation_datetime'], IMPORT_DATETIME_FORMAT)
-            })
+    def _import_run_csv(self, source, import_folder, progress=None):
+        return self._import_csv(source, import_folder + '/run.csv',
+                                repository.RunRepository(), self._parse_run_row, progress)
+
+    def _import_weight_csv(self, source, import_folder, progress=None):
+        return self._import_csv(source, import_folder + '/weight.csv',
+                                repository.WeightRepository(), self._parse_weight_row, progress)
+
+    def _parse_run_row(self, row):
+        duration = int(row['duration'])
+        distance = float(row['distance'])
+        speed = None
+        if row['speed']:
+            speed = float(row['speed'])
+        else:
+            speed = distance / (duration / 60.0)
+        return {
+            'usernickname': row['usernickname'],
+            'activity_date': to_date(
+                row['activity_date'], IMPORT_DATE_FORMAT),
+            'activity_time': to_time(
+                row['activity_time'], IMPORT_TIME_FORMAT),
+            'duration': duration,
+            'distance': distance,
+            'speed': speed,
+            'calories': int(row['calories']),
+            'notes': row['notes'],
+            'creation_datetime': to_datetime(
+                row['creation_datetime'], IMPORT_DATETIME_FORMAT)
+        }
+
+    def _parse_weight_row(self, row):
+        return {
+            'usernickname': row['usernickname'],
+            'weight': float(row['weight']),
+            'weighing_date': to_date(
+                row['creation_datetime'], IMPORT_DATETIME_FORMAT),
+            'creation_datetime': to_datetime(
+                row['creation_datetime'], IMPORT_DATETIME_FORMAT)
+        }
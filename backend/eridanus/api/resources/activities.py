@@ -1,4 +1,4 @@
-from flask import jsonify, session
+from flask import jsonify, request, session
 from flask_restful import Resource
 from eridanus.activities.services import RunningService
 
@@ -8,7 +8,10 @@ class Running(Resource):
     def get(self):
         username = session['nickname']
         if username:
-            data = RunningService().fetch_all(username)
+            data = RunningService().fetch_all(
+                username,
+                cursor=request.args.get('cursor'),
+                page_size=request.args.get('page_size', type=int))
             return jsonify(data)
 
     def post(self):
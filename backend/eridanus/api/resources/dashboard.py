@@ -1,7 +1,10 @@
 from flask import jsonify
+from flask import request
 from flask import session
+from flask_restful import abort
 from flask_restful import fields
 from flask_restful import Resource
+from eridanus.dashboard.caching import etag, not_modified, tagged
 from eridanus.dashboard.services import DashboardService
 
 
@@ -10,9 +13,39 @@ class Dashboard(Resource):
     def get(self):
         username = session['nickname']
         if username:
-            stats = DashboardService().home_stats(username)
-            return jsonify(stats)
+            service = DashboardService()
+            version = service.data_version(username)
+            tag = etag(username, version, 'json')
+            response = not_modified(tag)
+            if response is not None:
+                return response
+            stats = service.cached_home_stats(username, version)
+            return tagged(jsonify(stats), tag)
 
     def post(self):
         pass
 
+
+class PeriodStats(Resource):
+    ''' Weekly, monthly and yearly totals of an activity '''
+    def get(self, kind, period):
+        username = session['nickname']
+        if username:
+            try:
+                stats = DashboardService().period_stats(
+                    username, kind, period, count=request.args.get('count', type=int))
+            except ValueError as exc:
+                abort(404, message=str(exc))
+            return jsonify(stats)
+
+
+class Calendar(Resource):
+    ''' Activity heatmap and streaks '''
+    def get(self):
+        username = session['nickname']
+        if username:
+            try:
+                stats = DashboardService().heatmap(username, request.args.get('year', type=int))
+            except ValueError as exc:
+                abort(404, message=str(exc))
+            return jsonify(stats)
@@ -1,12 +1,14 @@
 from flask import Blueprint
 from flask_restful import Api
-from .resources.dashboard import Dashboard
+from .resources.dashboard import Calendar, Dashboard, PeriodStats
 from .resources.activities import Running
 
 
 api_blueprint = Blueprint('api', __name__)
 api = Api(api_blueprint)
 api.add_resource(Dashboard, '/stats/')
+api.add_resource(Calendar, '/stats/calendar/')
+api.add_resource(PeriodStats, '/stats/<kind>/<period>/')
 api.add_resource(Running, '/activities/running/')
 
 # @api.route('/stats/', methods=['GET'])
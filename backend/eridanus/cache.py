@@ -0,0 +1,386 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from google.cloud import ndb
+from google.cloud.datastore_v1.types import entity as entity_pb2
+
+from eridanus.settings import int_setting, setting
+
+logger = logging.getLogger(__name__)
+
+# ndb prefixes the serialized Datastore key with this marker when it builds
+# global cache keys, and stores these markers as values while a key is
+# locked by a read or a write in progress.
+_KEY_PREFIX = b'NDB30'
+_LOCK_PREFIXES = (b'0-', b'00')
+
+DEFAULT_MAX_ENTRIES = 10000
+# ndb clears the entries of a written entity in the cache of the process
+# which wrote it only: the TTL bounds how long an in-process cache of
+# another process serves the old value.
+DEFAULT_TTL = 300
+
+
+def kind_of(cache_key):
+    """
+    Returns the entity kind encoded in an ndb global cache key.
+    """
+    if not cache_key.startswith(_KEY_PREFIX):
+        return ''
+    try:
+        key_pb = entity_pb2.Key.pb().FromString(cache_key[len(_KEY_PREFIX):])
+        return key_pb.path[-1].kind
+    except Exception:
+        return ''
+
+
+def cache_key(key):
+    """
+    Returns the global cache key ndb uses for an ndb.Key.
+    """
+    return _KEY_PREFIX + entity_pb2.Key.serialize(key._key.to_protobuf())
+
+
+def _is_lock(value):
+    return value is not None and value.startswith(_LOCK_PREFIXES)
+
+
+class CacheStats(object):
+    """
+    Thread safe hit/miss/eviction counters, kept per entity kind.
+    """
+
+    FIELDS = ('hits', 'misses', 'sets', 'deletes', 'evictions', 'expirations')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+
+    def incr(self, field, kind, amount=1):
+        with self._lock:
+            self._counters[kind][field] += amount
+
+    def record_get(self, keys, values):
+        with self._lock:
+            for key, value in zip(keys, values):
+                field = 'misses' if value is None or _is_lock(value) else 'hits'
+                self._counters[kind_of(key)][field] += 1
+
+    def snapshot(self):
+        with self._lock:
+            kinds = {kind: dict(counters) for kind, counters in self._counters.items()}
+        totals = dict.fromkeys(self.FIELDS, 0)
+        for counters in kinds.values():
+            for field in self.FIELDS:
+                totals[field] += counters[field]
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_ratio'] = float(totals['hits']) / lookups if lookups else 0.0
+        return {'totals': totals, 'kinds': kinds}
+
+
+class LruGlobalCache(ndb.GlobalCache):
+    """
+    Bounded in-process global cache for ndb, for a single process only:
+    a write clears the entries of this process, the caches of other
+    workers or instances keep serving the old entity until it expires.
+
+    Entries expire after ``ttl`` seconds (unless ndb asks for a shorter
+    expiry), at most ``max_entries`` are kept overall and at most
+    ``kind_limits[kind]`` for a given kind. The least recently used entry
+    is evicted first. The cache is shared by every thread of the process;
+    watched values, like in ndb's own caches, belong to the thread which
+    set them.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, kind_limits=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.kind_limits = dict(kind_limits or {})
+        self.stats = CacheStats()
+        self._entries = {}
+        self._size = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._watches = threading.local()
+
+    @property
+    def _watched(self):
+        local = self._watches
+        if not hasattr(local, 'items'):
+            local.items = {}
+        return local.items
+
+    def _expiry(self, expires):
+        seconds = expires or self.ttl
+        return time.monotonic() + seconds if seconds else None
+
+    def _lookup(self, key, kind, now):
+        entries = self._entries.get(kind)
+        if entries is None or key not in entries:
+            return None
+        value, expires, _ = entries[key]
+        if expires is not None and expires < now:
+            del entries[key]
+            self._size -= 1
+            self.stats.incr('expirations', kind)
+            return None
+        self._tick += 1
+        entries[key] = (value, expires, self._tick)
+        entries.move_to_end(key)
+        return value
+
+    def _store(self, key, kind, value, expires):
+        entries = self._entries.setdefault(kind, OrderedDict())
+        if key not in entries:
+            self._size += 1
+        self._tick += 1
+        entries[key] = (value, expires, self._tick)
+        entries.move_to_end(key)
+        self.stats.incr('sets', kind)
+        limit = self.kind_limits.get(kind)
+        while limit is not None and len(entries) > limit:
+            self._evict(kind)
+        while self._size > self.max_entries:
+            self._evict(self._oldest_kind())
+
+    def _oldest_kind(self):
+        oldest = None
+        for kind, entries in self._entries.items():
+            if entries:
+                tick = next(iter(entries.values()))[2]
+                if oldest is None or tick < oldest[0]:
+                    oldest = (tick, kind)
+        return oldest[1]
+
+    def _evict(self, kind):
+        self._entries[kind].popitem(last=False)
+        self._size -= 1
+        self.stats.incr('evictions', kind)
+
+    def _remove(self, key, kind):
+        entries = self._entries.get(kind)
+        if entries is not None and entries.pop(key, None) is not None:
+            self._size -= 1
+            return True
+        return False
+
+    def __len__(self):
+        return self._size
+
+    def get(self, keys):
+        """Implements :meth:`GlobalCache.get`."""
+        now = time.monotonic()
+        with self._lock:
+            values = [self._lookup(key, kind_of(key), now) for key in keys]
+        self.stats.record_get(keys, values)
+        return values
+
+    def set(self, items, expires=None):
+        """Implements :meth:`GlobalCache.set`."""
+        expires = self._expiry(expires)
+        with self._lock:
+            for key, value in items.items():
+                self._store(key, kind_of(key), value, expires)
+
+    def set_if_not_exists(self, items, expires=None):
+        """Implements :meth:`GlobalCache.set_if_not_exists`."""
+        now = time.monotonic()
+        expires = self._expiry(expires)
+        results = {}
+        with self._lock:
+            for key, value in items.items():
+                kind = kind_of(key)
+                results[key] = self._lookup(key, kind, now) is None
+                if results[key]:
+                    self._store(key, kind, value, expires)
+        return results
+
+    def delete(self, keys):
+        """Implements :meth:`GlobalCache.delete`."""
+        with self._lock:
+            for key in keys:
+                kind = kind_of(key)
+                if self._remove(key, kind):
+                    self.stats.incr('deletes', kind)
+
+    def watch(self, items):
+        """Implements :meth:`GlobalCache.watch`."""
+        self._watched.update(items)
+
+    def unwatch(self, keys):
+        """Implements :meth:`GlobalCache.unwatch`."""
+        for key in keys:
+            self._watched.pop(key, None)
+
+    def compare_and_swap(self, items, expires=None):
+        """Implements :meth:`GlobalCache.compare_and_swap`."""
+        now = time.monotonic()
+        expires = self._expiry(expires)
+        watched = self._watched
+        results = {}
+        with self._lock:
+            for key, value in items.items():
+                results[key] = False
+                if key not in watched:
+                    continue
+                kind = kind_of(key)
+                if watched.pop(key) == self._lookup(key, kind, now):
+                    self._store(key, kind, value, expires)
+                    results[key] = True
+        return results
+
+    def clear(self):
+        """Implements :meth:`GlobalCache.clear`."""
+        with self._lock:
+            self._entries = {}
+            self._size = 0
+
+    def timeout_policy(self, key):
+        return self.ttl or None
+
+    def info(self):
+        with self._lock:
+            sizes = {kind: len(entries) for kind, entries in self._entries.items()}
+        return {'backend': 'lru', 'entries': self._size, 'max_entries': self.max_entries,
+                'kind_entries': sizes, 'kind_limits': self.kind_limits,
+                'stats': self.stats.snapshot()}
+
+
+class RedisGlobalCache(ndb.RedisCache):
+    """
+    ndb's Redis global cache with hit/miss counters. Works with anything
+    speaking the Redis protocol (Redis, Memorystore, Valkey, ...).
+    """
+
+    def __init__(self, redis, ttl=DEFAULT_TTL, strict_read=False, strict_write=True):
+        super(RedisGlobalCache, self).__init__(
+            redis, strict_read=strict_read, strict_write=strict_write)
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    @classmethod
+    def from_url(cls, url, ttl=DEFAULT_TTL):
+        import redis
+        return cls(redis.Redis.from_url(url), ttl=ttl)
+
+    def timeout_policy(self, key):
+        return self.ttl or None
+
+    def get(self, keys):
+        values = super(RedisGlobalCache, self).get(keys)
+        self.stats.record_get(keys, values)
+        return values
+
+    def set(self, items, expires=None):
+        super(RedisGlobalCache, self).set(items, expires=expires)
+        for key in items:
+            self.stats.incr('sets', kind_of(key))
+
+    def delete(self, keys):
+        super(RedisGlobalCache, self).delete(keys)
+        for key in keys:
+            self.stats.incr('deletes', kind_of(key))
+
+    def info(self):
+        info = {'backend': 'redis', 'stats': self.stats.snapshot()}
+        try:
+            server = self.redis.info('stats')
+            info['evicted_keys'] = server.get('evicted_keys')
+            info['expired_keys'] = server.get('expired_keys')
+        except Exception as exc:
+            logger.warning(f'Could not read redis stats: {exc}')
+        return info
+
+
+def _parse_kind_limits(value):
+    """
+    Parses "Run=5000,Weight=2000" into {'Run': 5000, 'Weight': 2000}.
+    """
+    if isinstance(value, dict):
+        return value
+    limits = {}
+    for part in (value or '').split(','):
+        if '=' in part:
+            kind, limit = part.split('=', 1)
+            limits[kind.strip()] = int(limit)
+    return limits
+
+
+def create_global_cache():
+    """
+    Builds the global cache selected by the GLOBAL_CACHE setting: empty
+    (the default) for no global cache, 'redis' or 'lru'.
+
+    'redis' requires the server at REDIS_CACHE_URL to be running, writes
+    fail while it is unreachable. 'lru' is only safe in a single process;
+    a WEB_CONCURRENCY above 1 is refused, but gunicorn's --workers and
+    several instances go unnoticed.
+    """
+    backend = (setting('GLOBAL_CACHE', '') or '').lower()
+    if backend == 'lru':
+        # A partial check: only the worker count given by WEB_CONCURRENCY.
+        if int_setting('WEB_CONCURRENCY', 1) > 1:
+            raise ValueError('GLOBAL_CACHE=lru is for a single process, use redis with several workers '
+                             '(WEB_CONCURRENCY).')
+        return LruGlobalCache(
+            max_entries=int_setting('GLOBAL_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+            ttl=int_setting('GLOBAL_CACHE_TTL', DEFAULT_TTL),
+            kind_limits=_parse_kind_limits(setting('GLOBAL_CACHE_KIND_LIMITS', '')))
+    if backend == 'redis':
+        url = setting('REDIS_CACHE_URL')
+        if not url:
+            raise ValueError('GLOBAL_CACHE=redis needs REDIS_CACHE_URL to be set.')
+        return RedisGlobalCache.from_url(url, ttl=int_setting('GLOBAL_CACHE_TTL', DEFAULT_TTL))
+    if backend:
+        raise ValueError(f'Unknown GLOBAL_CACHE backend {backend!r}.')
+    return None
+
+
+_global_cache = None
+_global_cache_pid = None
+_global_cache_lock = threading.Lock()
+
+
+def get_global_cache():
+    """
+    Returns the global cache of the current process, or None when it is
+    disabled.
+    """
+    global _global_cache, _global_cache_pid
+    pid = os.getpid()
+    if _global_cache_pid == pid:
+        return _global_cache
+    with _global_cache_lock:
+        if _global_cache_pid != pid:
+            _global_cache = create_global_cache()
+            _global_cache_pid = pid
+            if _global_cache is not None:
+                logger.info('ndb global cache enabled', extra={'backend': type(_global_cache).__name__})
+        return _global_cache
+
+
+def reset_global_cache():
+    global _global_cache, _global_cache_pid
+    with _global_cache_lock:
+        _global_cache = None
+        _global_cache_pid = None
+
+
+def forget(keys):
+    """
+    Drops the global cache entries of ``keys`` with one call, for entities
+    written with ``use_global_cache=False``.
+    """
+    global_cache = get_global_cache()
+    if global_cache is not None and keys:
+        global_cache.delete([cache_key(key) for key in keys])
+
+
+def cache_metrics():
+    cache = get_global_cache()
+    if cache is None:
+        return {'backend': None}
+    return cache.info()
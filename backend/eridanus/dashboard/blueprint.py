@@ -1,5 +1,6 @@
-from flask import Blueprint, render_template, session
+from flask import Blueprint, abort, make_response, render_template, request, session
 from flask_login import login_required
+from eridanus.dashboard.caching import etag, not_modified, tagged
 from eridanus.dashboard.services import DashboardService
 
 import logging
@@ -15,14 +16,48 @@ dashboard = Blueprint('dashboard', __name__, template_folder='templates')
 def index():
     error_message = None
     stats = None
+    tag = None
     try:
         username = session.get('nickname')
         service = DashboardService()
-        stats = service.home_stats(username)
+        # A single small lookup answers a browser which has the page.
+        version = service.data_version(username)
+        tag = etag(username, version, 'html')
+        response = not_modified(tag)
+        if response is not None:
+            return response
+        stats = service.cached_home_stats(username, version)
     except ValueError as exc:
         logger.exception(exc)
         error_message = str(exc)
+        tag = None
     except Exception:
         logger.exception("Eroare neasteptata la incarcarea dashboard-ului")
         error_message = "A aparut o eroare interna. Te rugam sa incerci din nou mai tarziu."
-    return render_template('dashboard/index.html', stats=stats, error_message=error_message)
+        tag = None
+    response = make_response(render_template('dashboard/index.html', stats=stats, error_message=error_message))
+    return tagged(response, tag) if tag else response
+
+
+@dashboard.route('/calendar/', methods=['GET'])
+@login_required
+def calendar():
+    year = request.args.get('year', type=int)
+    try:
+        stats = DashboardService().heatmap(session.get('nickname'), year)
+    except ValueError as exc:
+        logger.warning(exc)
+        abort(404)
+    return render_template('dashboard/calendar.html', stats=stats)
+
+
+@dashboard.route('/<kind>/<period>/', methods=['GET'])
+@login_required
+def periods(kind, period):
+    try:
+        stats = DashboardService().period_stats(
+            session.get('nickname'), kind, period, count=request.args.get('count', type=int))
+    except ValueError as exc:
+        logger.warning(exc)
+        abort(404)
+    return render_template('dashboard/periods.html', stats=stats)
@@ -0,0 +1,35 @@
+import hashlib
+import os
+from datetime import date
+
+from flask import make_response, request, session
+
+
+def etag(username, version, representation, today=None):
+    """
+    A strong entity tag for one representation ('html', 'json') of a view
+    of the data of a user. It changes with the data version, the day and
+    the deployed version of the application.
+    """
+    today = today or date.today()
+    parts = [username or '', str(version), today.isoformat(), representation, os.environ.get('GAE_VERSION', '')]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def tagged(response, tag):
+    response.set_etag(tag)
+    # The browser keeps the response but asks whether it is current on
+    # every view.
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(tag):
+    """
+    Returns a 304 response when the request holds ``tag`` in If-None-Match,
+    otherwise None. Pending flash messages need a rendered page, so they
+    always get None.
+    """
+    if '_flashes' in session or not request.if_none_match.contains(tag):
+        return None
+    return tagged(make_response('', 304), tag)
@@ -1,5 +1,17 @@
+from datetime import date
+
+from google.cloud import ndb
+
+from eridanus.datastore import datastore_context
 from eridanus.repository import StatisticsRepository
 from eridanus.services import BmiCalculatorService
+from eridanus.singleflight import single_flight
+from eridanus.tracing import span, traced
+from eridanus.statistics import records, rollups, user_stats
+
+# Buckets shown by default by the per-period views, and the most allowed.
+PERIOD_BUCKETS = 12
+MAX_PERIOD_BUCKETS = 120
 
 
 class DashboardService:
@@ -8,9 +20,73 @@ class DashboardService:
     def __init__(self, repository=None):
         self.repository = repository or StatisticsRepository()
 
+    @traced()
+    def data_version(self, username):
+        return self.repository.data_version(username)
+
+    @traced()
+    def cached_home_stats(self, username, version, today=None):
+        """
+        Returns ``home_stats`` from the snapshot of the user when it was
+        taken today at ``version`` of their data, otherwise computes them
+        and saves a new snapshot.
+        :param version: The current data version, see ``data_version``.
+        """
+        today = today or date.today()
+        snapshot = self.repository.dashboard_snapshot(username)
+        # The stats count the days since the last activities, so they
+        # also expire at midnight.
+        # A snapshot pickled by an earlier version reads as bytes.
+        if (snapshot is not None and isinstance(snapshot.stats, dict)
+                and snapshot.version == version and snapshot.day == today):
+            return snapshot.stats
+        # Requests arriving together for the same data wait for one
+        # computation instead of repeating it.
+        return single_flight((username, 'home_stats', version, today), self._snapshot, username, version, today)
+
+    def _snapshot(self, username, version, today):
+        stats = self.home_stats(username)
+        # A write made meanwhile has bumped the version past this one, so
+        # such a snapshot is never served.
+        self.repository.save_dashboard_snapshot(username, version, today, stats)
+        return stats
+
+    @traced()
     def home_stats(self, username):
-        running_stats = self.repository.running_stats(username)
-        weighing_stats = self.repository.weighing_stats(username)
+        with datastore_context():
+            # Every lookup is started before waiting, so the page costs the
+            # slowest one rather than the sum of them.
+            futures = {
+                'user_stats': self.repository.user_stats_async(username),
+                'records': self.repository.records_async(username),
+                'calendar': self.repository.calendar_async(username),
+            }
+            with span('DashboardService.wait_lookups', 'repository'):
+                ndb.wait_all(futures.values())
+            results = {name: future.result() for name, future in futures.items()}
+
+        # Every summary comes from the same UserStats entity, whose rebuild
+        # queries all the kinds at once.
+        stats = results['user_stats']
+        running_stats = self.repository.running_summary(stats)
+        weighing_stats = self.repository.weighing_summary(stats)
+        activities = {'running': running_stats}
+        for kind in user_stats.COUNTABLE:
+            activities[kind] = self.repository.activity_summary(stats, kind)
+
+        # The bests come from the records index, which also names the
+        # activities holding them.
+        best = results['records']
+        if running_stats:
+            running_stats.update(max_distance=best.best('running', 'distance'),
+                                 max_time=best.best('running', 'duration'),
+                                 max_speed=best.best('running', 'speed', 0.0),
+                                 max_calories=best.best('running', 'calories'))
+        for kind in user_stats.COUNTABLE:
+            if activities[kind]:
+                activities[kind].update(max_repetitions=best.best(kind, 'repetitions'),
+                                        max_rate=best.best(kind, 'rate', 0.0),
+                                        max_time=best.best(kind, 'duration'))
 
         # TODO: Height is currently hardcoded to 1.82m.
         # It should be fetched from the user profile in the database.
@@ -18,23 +94,77 @@ class DashboardService:
         user_height = 1.82
 
         bmi_calculator = BmiCalculatorService(
-            weighing_stats['last_weight'],
+            weighing_stats.get('last_weight'),
             user_height)
         desired_weight = bmi_calculator.calculate_desired_weight(BmiCalculatorService.TARGET_BMI_NORMAL)
+        desired_weight_date = self.repository.weight_target_date(stats, desired_weight)
         return {
             'bmi': {
                 'bmi': bmi_calculator.bmi,
                 'status': bmi_calculator.status,
             },
-            'activities': {
-                'running': running_stats
-            },
+            'activities': activities,
             'weighing': weighing_stats,
+            'records': {kind: {metric: best.top(kind, metric) for metric in metrics}
+                        for kind, metrics in records.METRICS.items()},
+            'calendar': self._calendar_summary(results['calendar']),
             'objectives': {
-                'weight': desired_weight
+                'weight': desired_weight,
+                'weight_date': desired_weight_date
             }
         }
 
+    def _calendar_summary(self, calendar, today=None):
+        today = today or date.today()
+        return {
+            'current_streak': calendar.current_streak(today),
+            'longest_streak': calendar.longest_streak(),
+            'days_since_last': calendar.days_since_last(today),
+            'active_days': calendar.active_days(today.year),
+        }
+
+    @traced()
+    def heatmap(self, username, year=None):
+        """
+        The activity heatmap of a year, the current one by default, with
+        the streaks of the user.
+        """
+        today = date.today()
+        calendar = self.repository.calendar(username, today)
+        year = year or today.year
+        return dict(calendar.heatmap(year), **self._calendar_summary(calendar, today),
+                    year_active_days=calendar.active_days(year))
+
+    @traced()
+    def period_stats(self, username, kind, period, count=None, today=None):
+        """
+        Returns the totals of one kind of activity for the last ``count``
+        weeks, months or years, oldest first, and the current bucket
+        compared with the previous one.
+        """
+        if kind not in user_stats.KINDS:
+            raise ValueError(f"Unknown activity '{kind}'.")
+        if period not in rollups.PERIODS:
+            raise ValueError(f"Unknown period '{period}'.")
+        count = min(max(count or PERIOD_BUCKETS, 2), MAX_PERIOD_BUCKETS)
+        labels = rollups.last_buckets(period, count, today or date.today())
+        totals = self.repository.rollups(username, kind, labels)
+        buckets = [dict(totals[label], bucket=label, start=rollups.bucket_start(label).isoformat())
+                   for label in labels]
+        current, previous = buckets[-1], buckets[-2]
+        return {
+            'kind': kind,
+            'period': period,
+            'buckets': buckets,
+            'current': current,
+            'previous': previous,
+            'change': {field: self._change(current[field], previous[field]) for field in rollups.FIELDS},
+        }
+
+    def _change(self, current, previous):
+        if not previous:
+            return None
+        return ((float(current) / float(previous)) - 1.0) * 100.0
 
     # def get_day_from_last_run_class(self):
     #     if self.days_past_from_last_run is None:
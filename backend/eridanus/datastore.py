@@ -0,0 +1,320 @@
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import grpc
+from flask import g, has_request_context
+from google.cloud import environment_vars, ndb
+from google.cloud._helpers import make_secure_channel
+from google.cloud.datastore_v1.services.datastore.transports import grpc as datastore_grpc
+
+from eridanus import metrics, rpc_usage, tracing
+from eridanus.cache import get_global_cache
+from eridanus.settings import int_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL_POOL_SIZE = 1
+
+
+def _channel_pool_size():
+    return max(1, int_setting('NDB_CHANNEL_POOL_SIZE', DEFAULT_CHANNEL_POOL_SIZE))
+
+
+class _PooledMultiCallable(grpc.UnaryUnaryMultiCallable):
+    """
+    Unary-unary callable that sends every call over the next channel
+    of a ChannelPool, and records it in the current RpcUsage, if any.
+    """
+
+    def __init__(self, pool, method, request_serializer, response_deserializer):
+        self._pool = pool
+        self._method = method
+        # The bare RPC name, e.g. 'Lookup'.
+        self._name = (method.decode('ascii') if isinstance(method, bytes) else method).rsplit('/', 1)[-1]
+        self._request_serializer = request_serializer
+        self._response_deserializer = response_deserializer
+        self._callables = {}
+        self._lock = threading.Lock()
+
+    def _next(self):
+        index = self._pool._next_index()
+        callable_ = self._callables.get(index)
+        if callable_ is None:
+            with self._lock:
+                callable_ = self._callables.get(index)
+                if callable_ is None:
+                    callable_ = self._pool.channels[index].unary_unary(
+                        self._method,
+                        request_serializer=self._request_serializer,
+                        response_deserializer=self._response_deserializer)
+                    self._callables[index] = callable_
+        return callable_
+
+    def __call__(self, request, *args, **kwargs):
+        usage = rpc_usage.current()
+        if usage is None:
+            return self._next()(request, *args, **kwargs)
+        usage.record_call(self._name, request)
+        response = self._next()(request, *args, **kwargs)
+        usage.record_response(self._name, response)
+        return response
+
+    def with_call(self, request, *args, **kwargs):
+        usage = rpc_usage.current()
+        if usage is None:
+            return self._next().with_call(request, *args, **kwargs)
+        usage.record_call(self._name, request)
+        response, call = self._next().with_call(request, *args, **kwargs)
+        usage.record_response(self._name, response)
+        return response, call
+
+    def future(self, request, *args, **kwargs):
+        usage = rpc_usage.current()
+        future = self._next().future(request, *args, **kwargs)
+        if usage is not None:
+            usage.record_call(self._name, request, future)
+        return future
+
+
+class ChannelPool(grpc.Channel):
+    """
+    A fixed set of gRPC channels used round robin. Datastore only issues
+    unary-unary calls, so that is the only kind of call which is pooled.
+    """
+
+    def __init__(self, channels):
+        if not channels:
+            raise ValueError('A channel pool needs at least one channel.')
+        self.channels = list(channels)
+        self.calls = [0] * len(self.channels)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _next_index(self):
+        with self._lock:
+            index = next(self._counter) % len(self.channels)
+            self.calls[index] += 1
+        return index
+
+    def unary_unary(self, method, request_serializer=None, response_deserializer=None,
+                    _registered_method=False):
+        return _PooledMultiCallable(self, method, request_serializer, response_deserializer)
+
+    def unary_stream(self, method, *args, **kwargs):
+        return self.channels[0].unary_stream(method, *args, **kwargs)
+
+    def stream_unary(self, method, *args, **kwargs):
+        return self.channels[0].stream_unary(method, *args, **kwargs)
+
+    def stream_stream(self, method, *args, **kwargs):
+        return self.channels[0].stream_stream(method, *args, **kwargs)
+
+    def subscribe(self, callback, try_to_connect=False):
+        for channel in self.channels:
+            channel.subscribe(callback, try_to_connect=try_to_connect)
+
+    def unsubscribe(self, callback):
+        for channel in self.channels:
+            channel.unsubscribe(callback)
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+
+
+class SharedClient(ndb.Client):
+    """
+    ndb.Client whose Datastore stub runs over a ChannelPool. One instance
+    is shared by all the requests and threads of a worker process.
+    """
+
+    def __init__(self, pool_size=DEFAULT_CHANNEL_POOL_SIZE, **kwargs):
+        super(SharedClient, self).__init__(**kwargs)
+        # ndb.Client already opened a channel; gRPC connects lazily, so
+        # dropping it before the first call costs nothing.
+        self.stub.close()
+        self.pool = ChannelPool([self._make_channel() for _ in range(pool_size)])
+        self.stub = datastore_grpc.DatastoreGrpcTransport(
+            host=self.host,
+            credentials=self._credentials,
+            client_info=self.client_info,
+            channel=self.pool)
+
+    def _make_channel(self):
+        if not self.secure:
+            return grpc.insecure_channel(
+                self.host,
+                options=[
+                    ('grpc.max_send_message_length', -1),
+                    ('grpc.max_receive_message_length', -1),
+                ])
+        return make_secure_channel(
+            self._credentials, self.client_info.to_user_agent(), self.host)
+
+    def close(self):
+        self.stub.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_metrics = {'clients_created': 0, 'contexts_opened': 0}
+
+
+def get_client():
+    """
+    Returns the ndb client of the current process, creating it on first use.
+    A client inherited from a parent process (gunicorn forks its workers
+    after importing the app) is never reused, since gRPC channels cannot
+    be shared across a fork.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    client = _client
+    if client is not None and _client_pid == pid:
+        return client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            pool_size = _channel_pool_size()
+            _client = SharedClient(pool_size=pool_size)
+            _client_pid = pid
+            _metrics['clients_created'] += 1
+            logger.info(
+                'ndb client created',
+                extra={'pid': pid, 'channel_pool_size': pool_size,
+                       'emulator': bool(os.environ.get(environment_vars.GCD_HOST))})
+        return _client
+
+
+def open_context(client=None):
+    """
+    Opens an ndb context on the shared client. The caller is responsible
+    for closing it.
+    """
+    client = client or get_client()
+    global_cache = get_global_cache()
+    if global_cache is not None:
+        ctx = client.context(
+            global_cache=global_cache,
+            global_cache_timeout_policy=global_cache.timeout_policy)
+    else:
+        ctx = client.context()
+    ctx.__enter__()
+    with _client_lock:
+        _metrics['contexts_opened'] += 1
+    return ctx
+
+
+def close_context(ctx):
+    ctx.__exit__(None, None, None)
+
+
+@contextmanager
+def datastore_context():
+    """
+    Makes sure an ndb context is active for the enclosed block.
+
+    Inside a Flask request the context is opened on first use, kept on
+    ``g`` and closed by ``end_request_context`` during teardown, so requests
+    that never reach a repository never pay for one. Outside a request
+    (scripts, background work, tests) the context only lives for the block.
+    """
+    if ndb.get_context(False) is not None:
+        yield
+    elif has_request_context():
+        if g.get('ndb_context') is None:
+            g.ndb_context = open_context()
+        yield
+    else:
+        ctx = open_context()
+        try:
+            yield
+        finally:
+            close_context(ctx)
+
+
+def end_request_context():
+    """
+    Closes the context of the current request, if one was opened.
+    """
+    ctx = g.pop('ndb_context', None)
+    if ctx is not None:
+        close_context(ctx)
+
+
+def uses_datastore(method):
+    """
+    Decorator for repository methods which talk to Datastore. Each call is
+    timed in the repository metrics and, in a traced request, as a span.
+    A method returning a future, like the ``_async`` ones, is timed until
+    the future resolves rather than until it returns.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        span = None
+
+        def done(error=None):
+            metrics.REPOSITORY_SECONDS.observe(
+                time.perf_counter() - started, kind=_kind(args[0]), operation=method.__name__)
+            if span is not None and span.end is None:
+                tracing.end_span(span, error)
+
+        try:
+            if tracing.active():
+                name = f'{type(args[0]).__name__}.{method.__name__}'
+                with tracing.deferred_span(name, 'repository') as span, datastore_context():
+                    result = method(*args, **kwargs)
+            else:
+                with datastore_context():
+                    result = method(*args, **kwargs)
+        except BaseException:
+            done()
+            raise
+        if isinstance(result, ndb.Future):
+            result.add_done_callback(lambda future: done(future.exception()))
+        else:
+            done()
+        return result
+    return wrapper
+
+
+def _kind(repository):
+    # The entity kind of a CrudRepository, the class of the others.
+    model_class = getattr(repository, 'model_class', None)
+    return model_class.__name__ if model_class is not None else type(repository).__name__
+
+
+def reset_client():
+    """
+    Drops the shared client, closing its channels. Mostly useful in tests
+    and benchmarks.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def client_metrics():
+    """
+    Returns counters about the shared client and its channels.
+    """
+    with _client_lock:
+        metrics = dict(_metrics)
+        client = _client if _client_pid == os.getpid() else None
+        metrics['pid'] = os.getpid()
+        if client is not None:
+            metrics['channel_pool_size'] = len(client.pool.channels)
+            metrics['channel_calls'] = list(client.pool.calls)
+        else:
+            metrics['channel_pool_size'] = 0
+            metrics['channel_calls'] = []
+    return metrics
@@ -0,0 +1,182 @@
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from eridanus.datastore import datastore_context
+from eridanus.repository import JobRepository
+from eridanus.settings import int_setting
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# Each process saves the jobs it holds at least this often; a queued or
+# running job saved longer ago than the stale delay is reported failed,
+# the process which held it stopped (a restart, a deploy).
+DEFAULT_HEARTBEAT_SECONDS = 60
+DEFAULT_STALE_SECONDS = 300
+
+_handlers = {}
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# The queued and running jobs of this process, by id. Their saves are
+# serialized so that a heartbeat never writes over a newer status.
+_held = {}
+_saving = threading.Lock()
+
+
+def handler(kind):
+    """
+    Registers the function which runs the jobs of a kind. It is called as
+    ``function(job, progress)`` and returns the JSON-serializable result;
+    ``progress(values)`` publishes a dict of progress values.
+    """
+    def register(function):
+        _handlers[kind] = function
+        return function
+    return register
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # Threads are not inherited across fork, a forked worker
+            # starts its own pool.
+            _pool = ThreadPoolExecutor(max_workers=max(1, int_setting('JOB_WORKERS', 2)),
+                                       thread_name_prefix='job')
+            _pool_pid = pid
+            _held.clear()
+            threading.Thread(target=_heartbeat, name='job-heartbeat', daemon=True).start()
+        return _pool
+
+
+def _save(repository, job):
+    with _saving:
+        repository.save(job)
+
+
+def _save_held():
+    """
+    Saves the jobs held by this process, which refreshes their ``updated``
+    time even while a step reports no progress.
+    """
+    with _saving:
+        held = list(_held.values())
+    for job in held:
+        try:
+            _save(JobRepository(), job)
+        except Exception:
+            logger.exception(f'Could not save the heartbeat of job {job.key.id()}.')
+
+
+def _heartbeat():
+    while True:
+        time.sleep(max(1, int_setting('JOB_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS)))
+        _save_held()
+
+
+def submit(kind, username, params=None):
+    """
+    Saves a queued job and hands it to the worker pool of this process.
+    :return: The Job entity, whose id is used to poll its status.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No handler for jobs of kind '{kind}'.")
+    job = JobRepository().create(kind, username, params or {})
+    pool = _get_pool()
+    with _saving:
+        _held[job.key.id()] = job
+    pool.submit(_run, job.key.id())
+    logger.info(f'Submitted {kind} job {job.key.id()} for {username}.')
+    return job
+
+
+def status(job):
+    """
+    Returns the JSON view of a job. A queued or running job which was not
+    saved for the stale delay is reported failed.
+    """
+    data = {
+        'id': job.key.id(),
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress or {},
+        'result': job.result,
+        'error': job.error,
+        'created': job.created.isoformat() if job.created else None,
+        'started': job.started.isoformat() if job.started else None,
+        'finished': job.finished.isoformat() if job.finished else None,
+    }
+    if job.status in (QUEUED, RUNNING) and _stale(job):
+        data['status'] = FAILED
+        data['error'] = 'The process running the job stopped before it finished.'
+    return data
+
+
+def _stale(job):
+    # ndb stores the auto_now times in UTC.
+    delay = timedelta(seconds=int_setting('JOB_STALE_SECONDS', DEFAULT_STALE_SECONDS))
+    return job.updated is not None and datetime.utcnow() - job.updated > delay
+
+
+class _Progress(object):
+    """
+    Stores the progress of a running job, at most once per ``interval``
+    seconds.
+    """
+
+    def __init__(self, repository, job, interval):
+        self.repository = repository
+        self.job = job
+        self.interval = interval
+        self.saved_at = time.monotonic()
+
+    def __call__(self, values):
+        self.job.progress = dict(values)
+        if time.monotonic() - self.saved_at >= self.interval:
+            _save(self.repository, self.job)
+            self.saved_at = time.monotonic()
+
+
+def _run(job_id):
+    # Pool threads have no request, the job keeps one ndb context open
+    # for its whole run.
+    with datastore_context():
+        repository = JobRepository()
+        # The entity the heartbeat saves, so both write the same state.
+        job = _held.get(job_id) or repository.read(job_id)
+        if job is None:
+            logger.error(f'Job {job_id} disappeared before it ran.')
+            return
+        try:
+            job.status = RUNNING
+            job.started = datetime.now()
+            job.worker = f'{socket.gethostname()}:{os.getpid()}'
+            _save(repository, job)
+            progress = _Progress(repository, job, int_setting('JOB_PROGRESS_SECONDS', 2))
+            started = time.monotonic()
+            try:
+                job.result = _handlers[job.kind](job, progress)
+                job.status = SUCCEEDED
+            except Exception as e:
+                logger.exception(f'{job.kind} job {job_id} failed.')
+                job.status = FAILED
+                job.error = str(e)
+            job.finished = datetime.now()
+            _save(repository, job)
+        finally:
+            with _saving:
+                _held.pop(job_id, None)
+        logger.info(f'{job.kind} job {job_id} {job.status} in {time.monotonic() - started:.2f}s.')
@@ -0,0 +1,72 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteListener(object):
+    """
+    Keeps data derived from activities and weighings in step with the
+    writes made through CrudRepository.
+
+    ``apply`` runs inside the transaction of the write, so the derived data
+    is committed together with the entities or not at all.
+    """
+
+    # Model classes whose writes are of interest to the listener.
+    kinds = ()
+
+    def handles(self, model_class):
+        return issubclass(model_class, self.kinds) if self.kinds else False
+
+    def keys(self, changes):
+        """
+        Returns the keys of the entities ``apply`` reads. The write looks
+        them up for all its listeners at once, in one round trip.
+        """
+        return []
+
+    def apply(self, changes, entities):
+        """
+        :param changes: A list of (before, after) entity pairs. ``before`` is
+            None for created entities and ``after`` is None for deleted ones.
+        :param entities: The entities of ``keys(changes)`` by key, None for
+            those which do not exist.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, username):
+        """
+        Marks the derived data of a user as out of date, for writes which
+        bypass ``apply`` (e.g. bulk imports).
+        """
+        raise NotImplementedError
+
+
+_listeners = []
+
+
+def register(listener):
+    if listener not in _listeners:
+        _listeners.append(listener)
+    return listener
+
+
+def unregister(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def listeners_for(model_class):
+    return [listener for listener in _listeners if listener.handles(model_class)]
+
+
+def usernames(changes):
+    """
+    Returns the nicknames touched by a list of changes.
+    """
+    names = set()
+    for before, after in changes:
+        for entity in (before, after):
+            if entity is not None and entity.usernickname:
+                names.add(entity.usernickname)
+    return names
@@ -1,10 +1,173 @@
+import atexit
+import copy
+import itertools
+import json
 import logging
 import os
+import queue
 import sys
+import threading
+from datetime import datetime, timezone
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+
+# Records waiting for the listener thread; more are dropped and counted.
+DEFAULT_QUEUE_SIZE = 10000
+
+# The attributes every LogRecord has: the others came in ``extra``.
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line, with the fields Cloud
+    Logging reads (time, severity, message) and the ``extra`` fields of the
+    logging call, e.g. the duration and the RPC counts of log_request.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'severity': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in ``rate`` records below WARNING of the loggers given by
+    name, a logger also matching the names of its children:
+    ``{'eridanus.weighing': 10}``. Warnings and errors are always kept.
+    """
+
+    def __init__(self, rates):
+        super(SamplingFilter, self).__init__()
+        self.rates = {name: rate for name, rate in rates.items() if rate > 1}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name):
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return name, rate
+            name = name.rpartition('.')[0]
+        return None, 1
+
+    def filter(self, record):
+        if not self.rates or record.levelno >= logging.WARNING:
+            return True
+        name, rate = self._rate(record.name)
+        if rate == 1:
+            return True
+        counter = self._counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(name, itertools.count())
+        return next(counter) % rate == 0
+
+
+def parse_sampling(value):
+    """
+    Parses the LOG_SAMPLING setting, 'logger=rate' pairs separated by
+    commas: 'eridanus.activities=10,eridanus.weighing=10'.
+    """
+    rates = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition('=')
+        try:
+            rates[name.strip()] = int(rate)
+        except ValueError:
+            raise ValueError(f'Invalid LOG_SAMPLING entry {item!r}, expected logger=rate.')
+    return rates
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without waiting: when the queue is
+    full, because the output is slower than the requests, the record is
+    dropped and counted.
+    """
+
+    def __init__(self, log_queue):
+        super(NonBlockingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only the message is resolved here, the arguments may change once
+        # the call returned; the formatting is left to the listener thread.
+        if not record.args:
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener(handler, output):
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+        _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+
+
+def _stop_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            # Writes the records still in the queue.
+            _listener.stop()
+            _listener = None
+
+
+def _restart_in_child():
+    # A forked worker inherits neither the listener thread nor a usable
+    # queue, whose lock another thread may have held.
+    global _listener
+    if _listener is None:
+        return
+    handler = _queue_handler()
+    handler.queue = queue.Queue(handler.queue.maxsize)
+    _listener = QueueListener(handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _queue_handler():
+    return next(handler for handler in logging.getLogger().handlers if isinstance(handler, NonBlockingQueueHandler))
 
 
 def configure_logging():
+    """
+    Logs to stdout from a background thread: the request threads only put
+    the records in a queue. LOG_FORMAT is 'json' (default) or 'text',
+    LOG_SAMPLING keeps one in N debug and info records of noisy loggers,
+    see parse_sampling.
+    """
     level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
     if level_name not in logging._nameToLevel:
         level_name = "INFO"
@@ -13,17 +176,14 @@ def configure_logging():
         {
             "version": 1,
             "disable_existing_loggers": False,
-            "formatters": {
-                "standard": {
-                    "format": "%(asctime)s %(levelname)s %(name)s %(message)s",
-                    "datefmt": "%Y-%m-%dT%H:%M:%S%z",
-                }
+            "filters": {
+                "sampling": {"()": SamplingFilter, "rates": parse_sampling(os.environ.get("LOG_SAMPLING"))},
             },
             "handlers": {
-                "stdout": {
-                    "class": "logging.StreamHandler",
-                    "stream": "ext://sys.stdout",
-                    "formatter": "standard",
+                "queue": {
+                    "()": NonBlockingQueueHandler,
+                    "log_queue": queue.Queue(int(os.environ.get("LOG_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))),
+                    "filters": ["sampling"],
                 }
             },
             "loggers": {
@@ -32,6 +192,18 @@ def configure_logging():
                 "__main__": {"level": level_name, "propagate": True},
                 "werkzeug": {"level": level_name, "propagate": True},
             },
-            "root": {"level": level_name, "handlers": ["stdout"]},
+            "root": {"level": level_name, "handlers": ["queue"]},
         }
     )
+
+    output = logging.StreamHandler(sys.stdout)
+    if os.environ.get("LOG_FORMAT", "json").lower() == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s",
+                                              "%Y-%m-%dT%H:%M:%S%z"))
+    _start_listener(_queue_handler(), output)
+
+
+atexit.register(_stop_listener)
+os.register_at_fork(after_in_child=_restart_in_child)
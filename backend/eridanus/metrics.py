@@ -0,0 +1,404 @@
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from eridanus import cache, singleflight
+from eridanus.settings import int_setting, setting
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Seconds, from a cached lookup to a slow page.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULT_FLUSH_SECONDS = 1
+
+
+class _Metric(object):
+    """
+    A metric family: one value per combination of label values. Every
+    update takes the lock of the family, so threads never lose one.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {self.labelnames}, not {tuple(labels)}.')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), self._copy(value)] for key, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._copy(self._values.get(self._key(labels)))
+
+
+class Counter(_Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def mirror(self, total, **labels):
+        """
+        Sets the counter to the running total of a count kept elsewhere,
+        e.g. the hits of the global cache.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = total
+
+
+class Gauge(_Metric):
+
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Observations counted per bucket; each value is [bucket counts (not
+    cumulative, the last one for +Inf), sum, count].
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _copy(self, value):
+        return None if value is None else [list(value[0]), value[1], value[2]]
+
+
+class Registry(object):
+    """
+    The metrics of the process, and the collectors which copy counts kept
+    by other modules into them when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f'Metric {name} is already registered differently.')
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def collector(self, function):
+        with self._lock:
+            self._collectors.append(function)
+        return function
+
+    def snapshot(self):
+        """
+        The values of every metric as plain JSON-able data.
+        """
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for function in collectors:
+            try:
+                function()
+            except Exception as exc:
+                logger.warning(f'Metrics collector {function.__name__} failed: {exc}')
+        return {metric.name: {'type': metric.type, 'help': metric.documentation,
+                              'labelnames': list(metric.labelnames),
+                              'buckets': list(getattr(metric, 'buckets', ())),
+                              'samples': metric.samples()}
+                for metric in metrics}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedFiles(object):
+    """
+    Shares the metrics of the worker processes of a host: each writes its
+    snapshot to its own file of ``directory``, and a scrape, whichever
+    worker serves it, adds up the files. Counters and histograms of workers
+    which exited are kept, their gauges are dropped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def write(self, snapshot, pid=None):
+        pid = pid or os.getpid()
+        path = self._path(pid)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as stream:
+            json.dump({'pid': pid, 'metrics': snapshot}, stream, separators=(',', ':'))
+        # Readers see the old file or the new one, never half of one.
+        os.replace(temporary, path)
+
+    def read(self):
+        snapshots = []
+        for path in sorted(glob.glob(os.path.join(self.directory, 'metrics-*.json'))):
+            try:
+                with open(path, encoding='utf-8') as stream:
+                    data = json.load(stream)
+            except (OSError, ValueError) as exc:
+                logger.warning(f'Skipping metrics file {path}: {exc}')
+                continue
+            snapshots.append((data['pid'], data['metrics']))
+        return snapshots
+
+
+def merge(snapshots, alive=_alive):
+    """
+    Adds up the (pid, snapshot) pairs of several processes.
+    """
+    merged = {}
+    for pid, snapshot in snapshots:
+        live = pid == os.getpid() or alive(pid)
+        for name, family in snapshot.items():
+            if family['type'] == 'gauge' and not live:
+                continue
+            target = merged.setdefault(name, dict(family, samples={}))
+            for labels, value in family['samples']:
+                key = tuple(labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif family['type'] == 'histogram':
+                    target['samples'][key] = [[a + b for a, b in zip(current[0], value[0])],
+                                              current[1] + value[1], current[2] + value[2]]
+                else:
+                    target['samples'][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _derive_ratios(merged):
+    hits = merged.get('eridanus_global_cache_hits', {}).get('samples', {})
+    misses = merged.get('eridanus_global_cache_misses', {}).get('samples', {})
+    if not hits and not misses:
+        return
+    samples = {}
+    for key in set(hits) | set(misses):
+        lookups = hits.get(key, 0) + misses.get(key, 0)
+        samples[key] = float(hits.get(key, 0)) / lookups if lookups else 0.0
+    merged['eridanus_global_cache_hit_ratio'] = {
+        'type': 'gauge', 'help': 'Share of the global cache lookups which were hits.',
+        'labelnames': ['kind'], 'buckets': [], 'samples': samples}
+
+
+def render(merged):
+    """
+    The OpenMetrics text exposition of merged snapshots.
+    """
+    _derive_ratios(merged)
+    lines = []
+    for name in sorted(merged):
+        family = merged[name]
+        names = family['labelnames']
+        lines.append(f'# TYPE {name} {family["type"]}')
+        lines.append(f'# HELP {name} {_escape(family["help"])}')
+        for key in sorted(family['samples']):
+            value = family['samples'][key]
+            if family['type'] == 'counter':
+                lines.append(f'{name}_total{_labels(names, key)} {_number(value)}')
+            elif family['type'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip(list(family['buckets']) + [float('inf')], value[0]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(names, key, [("le", _number(float(bound)))])} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_count{_labels(names, key)} {value[2]}')
+                lines.append(f'{name}_sum{_labels(names, key)} {_number(float(value[1]))}')
+            else:
+                lines.append(f'{name}{_labels(names, key)} {_number(value)}')
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'eridanus_request_duration_seconds', 'Time to answer a request, by endpoint, method and status.',
+    ('endpoint', 'method', 'status'))
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'eridanus_requests_in_flight', 'Requests being answered, by endpoint.', ('endpoint',))
+REPOSITORY_SECONDS = registry.histogram(
+    'eridanus_repository_call_duration_seconds', 'Time of the repository calls, by entity kind and operation.',
+    ('kind', 'operation'))
+DATASTORE_RPCS = registry.counter(
+    'eridanus_datastore_rpcs', 'Datastore RPCs made by requests, by method.', ('method',))
+
+
+def shared_files():
+    """
+    The SharedFiles of the METRICS_MULTIPROC_DIR setting, None when each
+    process only reports its own metrics.
+    """
+    directory = setting('METRICS_MULTIPROC_DIR', '')
+    return SharedFiles(directory) if directory else None
+
+
+def exposition():
+    """
+    The OpenMetrics text of this process, or of every worker sharing the
+    METRICS_MULTIPROC_DIR.
+    """
+    snapshot = registry.snapshot()
+    files = shared_files()
+    if files is None:
+        return render(merge([(os.getpid(), snapshot)]))
+    files.write(snapshot)
+    return render(merge(files.read()))
+
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher():
+    """
+    Starts the thread writing the snapshot of this process to the shared
+    files every METRICS_FLUSH_SECONDS, once per process and only in the
+    shared-file mode. A scrape may miss the last second of another worker.
+    """
+    global _flusher_pid
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _flusher_lock:
+        if _flusher_pid == pid:
+            return
+        _flusher_pid = pid
+        files = shared_files()
+        if files is None:
+            return
+        interval = max(1, int_setting('METRICS_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS))
+        thread = threading.Thread(target=_flush, args=(files, interval), name='metrics-flusher', daemon=True)
+        thread.start()
+
+
+def _flush(files, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            files.write(registry.snapshot())
+        except Exception as exc:
+            logger.warning(f'Could not write the metrics file: {exc}')
+
+
+CACHE_HITS = registry.counter(
+    'eridanus_global_cache_hits', 'Global cache lookups which found the entity, by kind.', ('kind',))
+CACHE_MISSES = registry.counter(
+    'eridanus_global_cache_misses', 'Global cache lookups which missed, by kind.', ('kind',))
+SINGLE_FLIGHT_CALLS = registry.counter(
+    'eridanus_single_flight_calls', 'Coalescable computations, by outcome.', ('outcome',))
+SINGLE_FLIGHT_IN_FLIGHT = registry.gauge(
+    'eridanus_single_flight_in_flight', 'Computations being run for coalesced callers.')
+
+
+@registry.collector
+def _collect_cache():
+    global_cache = cache.get_global_cache()
+    if global_cache is None:
+        return
+    for kind, counters in global_cache.stats.snapshot()['kinds'].items():
+        CACHE_HITS.mirror(counters['hits'], kind=kind or 'unknown')
+        CACHE_MISSES.mirror(counters['misses'], kind=kind or 'unknown')
+
+
+@registry.collector
+def _collect_single_flight():
+    counters = singleflight.single_flight_metrics()
+    for outcome in ('executions', 'coalesced', 'errors'):
+        SINGLE_FLIGHT_CALLS.mirror(counters[outcome], outcome=outcome)
+    SINGLE_FLIGHT_IN_FLIGHT.set(counters['in_flight'])
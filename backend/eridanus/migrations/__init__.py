@@ -0,0 +1,4 @@
+from eridanus.migrations.add_speed import AddRunSpeed
+
+# The migrations by name, in the order they were introduced.
+MIGRATIONS = {migration.name: migration for migration in (AddRunSpeed,)}
@@ -0,0 +1,20 @@
+from eridanus.migrations.runner import Migration
+from eridanus.models import Run
+
+
+class AddRunSpeed(Migration):
+    """
+    Stores the speed of the runs saved before it was a property, computed
+    from their distance and duration. Runs without one have no ``speed``
+    property at all, which no Datastore filter matches, so every run is
+    visited and only those missing a speed are saved.
+    """
+
+    name = 'add_run_speed'
+    model_class = Run
+
+    def transform(self, run):
+        if run.speed is not None or not run.distance or not run.duration:
+            return False
+        run.speed = run.distance / (run.duration / 60.0)
+        return True
@@ -0,0 +1,117 @@
+import logging
+import time
+
+from google.cloud import ndb
+
+from eridanus import cache, listeners
+from eridanus.datastore import uses_datastore
+from eridanus.models import MigrationState
+from eridanus.settings import int_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 200
+
+
+class Migration(object):
+    """
+    A change applied to every entity of a kind. Subclasses set ``name``
+    and ``model_class``, and implement ``transform``; ``query`` narrows the
+    entities visited when the change can be expressed as a filter.
+    """
+
+    name = None
+    model_class = None
+
+    def query(self):
+        return self.model_class.query()
+
+    def transform(self, entity):
+        """
+        Changes ``entity`` in place.
+        :return: True when the entity changed and must be saved.
+        """
+        raise NotImplementedError
+
+
+class MigrationRunner(object):
+    """
+    Walks the entities of a migration one page at a time with query
+    cursors and saves only those the migration changed, with one put_multi
+    per page. The cursor and counters are stored in a MigrationState after
+    each page, so a run which stops (or is stopped with ``max_pages``)
+    resumes where it left off.
+    """
+
+    def __init__(self, migration, page_size=None, max_writes_per_second=None, dry_run=False):
+        """
+        :param max_writes_per_second: Throttles the writes, None or 0 for no limit.
+        :param dry_run: Counts the entities which would change without saving
+            them or the progress.
+        """
+        self.migration = migration
+        self.page_size = page_size or int_setting('MIGRATION_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+        self.max_writes_per_second = max_writes_per_second
+        if max_writes_per_second is None:
+            self.max_writes_per_second = int_setting('MIGRATION_MAX_WRITES_PER_SECOND', 0)
+        self.dry_run = dry_run
+
+    @uses_datastore
+    def run(self, max_pages=None, restart=False, progress=None):
+        """
+        Runs the migration from its last position, or from the start when
+        it completed before or ``restart`` is set.
+        :param max_pages: Stops after this many pages, None to run to the end.
+        :param progress: Called with the report of this run after each page.
+        :return: A report of this run and of the migration so far.
+        """
+        state = None if restart else MigrationState.get_by_id(self.migration.name)
+        if state is None or state.completed:
+            state = MigrationState(id=self.migration.name)
+        report = {'migration': self.migration.name, 'dry_run': self.dry_run,
+                  'pages': 0, 'scanned': 0, 'changed': 0}
+        query = self.migration.query()
+        cursor = ndb.Cursor(urlsafe=state.cursor) if state.cursor else None
+        more = True
+        while more and (max_pages is None or report['pages'] < max_pages):
+            # The run holds one context: a cached page would stay in it
+            # until the end.
+            items, cursor, more = query.fetch_page(self.page_size, start_cursor=cursor, use_cache=False)
+            changed = [entity for entity in items if self.migration.transform(entity)]
+            if changed and not self.dry_run:
+                self._save(changed)
+            more = more and cursor is not None
+            report['pages'] += 1
+            report['scanned'] += len(items)
+            report['changed'] += len(changed)
+            state.scanned += len(items)
+            state.changed += len(changed)
+            state.cursor = cursor.urlsafe().decode('ascii') if more else None
+            state.completed = not more
+            if not self.dry_run:
+                state.put()
+            if progress is not None:
+                progress(report)
+
+        report['completed'] = state.completed
+        report['total_scanned'] = state.scanned
+        report['total_changed'] = state.changed
+        logger.info(f'Migration {self.migration.name}: {report}')
+        return report
+
+    def _save(self, entities):
+        started = time.monotonic()
+        # Without the global cache ndb would lock and unlock each key in
+        # turn; the entries are dropped with one call instead.
+        ndb.put_multi(entities, use_cache=False, use_global_cache=False)
+        cache.forget([entity.key for entity in entities])
+        # The write listeners are bypassed, the derived data is rebuilt
+        # on its next read.
+        names = listeners.usernames([(None, entity) for entity in entities])
+        for listener in listeners.listeners_for(self.migration.model_class):
+            for username in sorted(names):
+                listener.invalidate(username)
+        if self.max_writes_per_second:
+            remaining = len(entities) / float(self.max_writes_per_second) - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
@@ -1,3 +1,6 @@
+import json
+from datetime import date, datetime
+
 from google.cloud import ndb
 
 
@@ -36,3 +39,190 @@ class Crunch(Activity):
 
 class JumpRope(Activity):
     count = ndb.IntegerProperty()
+
+
+class UserStats(ndb.Model):
+    """
+    Per-user aggregates kept up to date on every write, keyed by the
+    user nickname. See eridanus.statistics.user_stats.
+    """
+    running = ndb.JsonProperty()
+    weighing = ndb.JsonProperty()
+    # Aggregates of the push ups, crunches and jump rope sessions, by kind.
+    activities = ndb.JsonProperty()
+    # Set when a delete made an aggregate impossible to maintain exactly,
+    # e.g. when the current maximum was removed; the next read rebuilds it.
+    stale = ndb.BooleanProperty(default=False)
+    revision = ndb.IntegerProperty(default=0)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class ImportCheckpoint(ndb.Model):
+    """
+    Progress of a CSV import, keyed by kind and file name, so an
+    interrupted import resumes after the rows already saved.
+    """
+    filename = ndb.StringProperty()
+    # Identifies the version of the file, a changed file starts over.
+    fingerprint = ndb.StringProperty()
+    # Data rows at the start of the file which are known to be saved.
+    rows_done = ndb.IntegerProperty(default=0)
+    completed = ndb.BooleanProperty(default=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class MigrationState(ndb.Model):
+    """
+    Progress of a data migration, keyed by the migration name.
+    """
+    # Urlsafe cursor after the last page processed, None before the first.
+    cursor = ndb.TextProperty()
+    scanned = ndb.IntegerProperty(default=0)
+    changed = ndb.IntegerProperty(default=0)
+    completed = ndb.BooleanProperty(default=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class Job(ndb.Model):
+    """
+    A long-running operation run by the background job pool, see
+    eridanus.jobs. Its status can be polled from any process.
+    """
+    kind = ndb.StringProperty()
+    username = ndb.StringProperty()
+    params = ndb.JsonProperty()
+    # queued, running, succeeded or failed
+    status = ndb.StringProperty()
+    progress = ndb.JsonProperty()
+    result = ndb.JsonProperty()
+    error = ndb.TextProperty()
+    # host:pid of the process running the job
+    worker = ndb.StringProperty()
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    started = ndb.DateTimeProperty()
+    finished = ndb.DateTimeProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class ActivityRollup(ndb.Model):
+    """
+    Per-period totals of one kind of activity of a user over one year,
+    keyed by nickname, kind and year. See eridanus.statistics.rollups.
+    """
+    usernickname = ndb.StringProperty()
+    # running, pushups, crunches or jump_rope
+    kind = ndb.StringProperty()
+    year = ndb.IntegerProperty()
+    # Totals by bucket: the year ('2025'), its months ('2025-03') and its
+    # ISO weeks ('2025-W11').
+    buckets = ndb.JsonProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class RollupState(ndb.Model):
+    """
+    Freshness of the ActivityRollup entities of a user, keyed by the user
+    nickname. Writes which bypass the listeners mark them stale and the
+    next read rebuilds them.
+    """
+    stale = ndb.BooleanProperty(default=False)
+    revision = ndb.IntegerProperty(default=0)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class PersonalRecords(ndb.Model):
+    """
+    The best activities of a user for every metric of every kind, with
+    their ids, keyed by the user nickname. See eridanus.statistics.records.
+    """
+    # {kind: {metric: {'entries': [[value, id, date], ...], 'truncated': bool}}}
+    records = ndb.JsonProperty()
+    stale = ndb.BooleanProperty(default=False)
+    revision = ndb.IntegerProperty(default=0)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class ActivityDays(ndb.Model):
+    """
+    The days of one year on which a user did one kind of activity, one bit
+    per day, keyed by nickname, kind and year. See
+    eridanus.statistics.activity_calendar.
+    """
+    usernickname = ndb.StringProperty()
+    kind = ndb.StringProperty()
+    year = ndb.IntegerProperty()
+    # Bit n, little-endian, is set for the day n + 1 of the year.
+    days = ndb.BlobProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class CalendarState(ndb.Model):
+    """
+    Freshness of the ActivityDays of a user, keyed by the user nickname.
+    """
+    first_year = ndb.IntegerProperty()
+    # [kind, date] pairs of days which lost an activity and may be empty
+    # now; they are checked on the next read.
+    pending = ndb.JsonProperty()
+    stale = ndb.BooleanProperty(default=False)
+    revision = ndb.IntegerProperty(default=0)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class DataVersion(ndb.Model):
+    """
+    Counts the writes to the activities and weighings of a user, keyed by
+    the user nickname. A view computed at one version is current until the
+    next write.
+    """
+    version = ndb.IntegerProperty(default=0)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+def _encode_date(value):
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode_date(item):
+    if len(item) == 1:
+        if '$datetime' in item:
+            return datetime.fromisoformat(item['$datetime'])
+        if '$date' in item:
+            return date.fromisoformat(item['$date'])
+    return item
+
+
+class DatedJsonProperty(ndb.BlobProperty):
+    """
+    Like ndb.JsonProperty, except that dates and datetimes read back as
+    such, they are stored as {"$date": "2025-01-31"}. A value which is not
+    JSON, like the pickled values of an earlier property type, is left as
+    the bytes read.
+    """
+
+    def _to_base_type(self, value):
+        return json.dumps(value, separators=(',', ':'), default=_encode_date).encode('ascii')
+
+    def _from_base_type(self, value):
+        try:
+            if not isinstance(value, str):
+                value = value.decode('ascii')
+            return json.loads(value, object_hook=_decode_date)
+        except ValueError:
+            # None leaves the value unchanged.
+            return None
+
+
+class DashboardSnapshot(ndb.Model):
+    """
+    The dashboard statistics of a user as computed at ``version`` of their
+    data on ``day``, keyed by the user nickname.
+    """
+    version = ndb.IntegerProperty()
+    day = ndb.DateProperty()
+    stats = DatedJsonProperty(compressed=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
@@ -1,16 +1,40 @@
+import hashlib
 import logging
-from datetime import datetime
+from datetime import date, datetime, time
 from google.cloud import ndb
 
-from eridanus.models import Crunch, Run, Weight, PushUp, JumpRope
+from eridanus import listeners
+from eridanus.datastore import datastore_context, uses_datastore
+from eridanus.models import Crunch, Run, Weight, PushUp, JumpRope, UserStats, ImportCheckpoint, Job, \
+    ActivityRollup, RollupState, PersonalRecords, ActivityDays, CalendarState, DataVersion, DashboardSnapshot
+from eridanus.statistics import activity_calendar, data_version, records, rollups, user_stats
 
 logger = logging.getLogger(__name__)
 
+listeners.register(user_stats.UserStatsListener())
+listeners.register(rollups.RollupListener())
+listeners.register(records.RecordsListener())
+listeners.register(activity_calendar.CalendarListener())
+listeners.register(data_version.DataVersionListener())
+
+# Entities written per commit by the bulk methods. Datastore allows 500
+# mutations per commit; the rest is left for the derived entities the
+# write listeners save in the same transaction.
+BATCH_SIZE = 400
+
+# Natural ids are kept below 2**53 so they survive JSON numbers intact.
+NATURAL_ID_BITS = 53
+
 
 class Repository(object):
     """
-    Base repository class. It's empty because NDB context management
-    is handled globally in main.py, not per-repository instance.
+    Base repository class. Methods which reach Datastore are decorated
+    with ``uses_datastore``, which opens the NDB context lazily.
+
+    The ``*_async`` methods return NDB futures instead of results, so a
+    caller can start several lookups and queries and wait for all of them
+    together. The futures belong to the NDB context: outside a request they
+    must be resolved inside the same ``datastore_context`` block.
     """
     pass
 
@@ -21,6 +45,10 @@ class CrudRepository(Repository):
     operations for any NDB model.
     """
 
+    # The properties which identify a record, from which ``load_many``
+    # derives its ids. Empty when the kind has none.
+    natural_key = ()
+
     def __init__(self, model_class):
         """
         Initializes the repository for a specific model class.
@@ -29,32 +57,121 @@ class CrudRepository(Repository):
         super(CrudRepository, self).__init__()
         self.model_class = model_class
 
+    @uses_datastore
     def create(self, record):
         """
         Creates and saves a new entity from a dictionary.
         """
         logger.debug(f'Creating record of kind {self.model_class.__name__}: {record}')
-        
+        entity = self._new_entity(record)
+        self._write(lambda: [(None, entity)])
+        return entity
+
+    @uses_datastore
+    def create_many(self, records):
+        """
+        Creates and saves new entities from a list of dictionaries, with one
+        commit per batch of BATCH_SIZE.
+        :return: The created entities, in the order of ``records``.
+        """
+        entities = [self._new_entity(record) for record in records]
+        for batch in _batches(entities):
+            self._write(lambda batch=batch: [(None, entity) for entity in batch])
+        logger.debug(f'Created {len(entities)} records of kind {self.model_class.__name__}.')
+        return entities
+
+    @uses_datastore
+    def load_many(self, records):
+        """
+        Saves entities from a list of dictionaries with one put_multi per
+        batch of BATCH_SIZE, outside any transaction and without the write
+        listeners. Meant for bulk loads, which must call ``invalidate_derived``
+        for the users they touched once they are done.
+
+        When the kind has a ``natural_key`` the ids are derived from it, so
+        loading a record twice overwrites the first copy instead of
+        duplicating it, without reading anything first.
+        :return: The saved entities, in the order of ``records``.
+        """
+        entities = []
+        for record in records:
+            entity = self._new_entity(record)
+            if self.natural_key:
+                entity.key = ndb.Key(self.model_class, self.natural_id(record))
+            entities.append(entity)
+        for batch in _batches(entities):
+            ndb.put_multi(batch)
+        return entities
+
+    def natural_id(self, record):
+        """
+        Returns the numeric id of a record derived from its kind and its
+        ``natural_key`` properties.
+        """
+        parts = [self.model_class._get_kind()]
+        for name in self.natural_key:
+            value = record.get(name)
+            parts.append(value.isoformat() if isinstance(value, (date, datetime, time)) else str(value))
+        digest = hashlib.sha256('|'.join(parts).encode('utf-8')).digest()
+        return (int.from_bytes(digest[:8], 'big') % ((1 << NATURAL_ID_BITS) - 1)) + 1
+
+    @uses_datastore
+    def invalidate_derived(self, usernames):
+        """
+        Marks the data derived from this kind as out of date for the given
+        users, after writes which bypassed the write listeners.
+        """
+        for listener in listeners.listeners_for(self.model_class):
+            for username in usernames:
+                listener.invalidate(username)
+
+    def _new_entity(self, record):
         # Add the creation datetime automatically
         if 'creation_datetime' not in record:
             record['creation_datetime'] = datetime.now()
 
-        # Instantiate the NDB model object and save it
-        entity = self.model_class(**record)
-        entity.put()
-        return entity
+        # Instantiate the NDB model object
+        return self.model_class(**record)
 
+    @uses_datastore
     def delete(self, identifier):
         """
         Deletes an entity by its numeric ID.
         """
         try:
             key = ndb.Key(self.model_class, int(identifier))
-            return key.delete()
         except (ValueError, TypeError) as e:
             logger.error(f"Could not delete {self.model_class.__name__} with identifier {identifier}: Invalid ID. {e}")
             return None
 
+        def changes():
+            entity = key.get()
+            return [(entity, None)] if entity else []
+        self._write(changes)
+        return None
+
+    @uses_datastore
+    def delete_many(self, identifiers):
+        """
+        Deletes entities by their numeric IDs, reading and deleting them one
+        batch of BATCH_SIZE at a time.
+        :return: One flag per identifier, False when the identifier is
+            invalid or no such entity exists.
+        """
+        keys = [self._key(identifier, 'delete') for identifier in identifiers]
+        deleted = set()
+
+        def changes(batch):
+            found = [entity for entity in ndb.get_multi(batch) if entity is not None]
+            deleted.difference_update(batch)
+            deleted.update(entity.key for entity in found)
+            return [(entity, None) for entity in found]
+
+        for batch in _batches(list(dict.fromkeys(key for key in keys if key is not None))):
+            self._write(lambda batch=batch: changes(batch))
+        return [key in deleted for key in keys]
+
+    @uses_datastore
     def fetch_all(self):
         """
         Fetches all entities of this kind.
@@ -65,27 +182,162 @@ class CrudRepository(Repository):
             query = query.order(-self.model_class.activity_date)
         return query.fetch()
 
-    def fetch_by_username(self, username, order=None):
+    @uses_datastore
+    def fetch_by_username(self, username, order=None, projection=None):
         """
         Fetches entities for a specific user, with optional ordering.
         :param order: A list of NDB properties to order by, e.g., [-Weight.weighing_date]
+        :param projection: The names of the properties to read, e.g. ('weight',),
+            None to read whole entities. Projected entities are read-only and
+            every such query needs a composite index in index.yaml.
+        """
+        return self.fetch_by_username_async(username, order, projection).result()
+
+    @uses_datastore
+    def fetch_by_username_async(self, username, order=None, projection=None):
+        """
+        Like ``fetch_by_username``, returning a future of the entities.
+        """
+        return self._query_by_username(username, order).fetch_async(
+            projection=self._projection(projection))
+
+    def iter_by_username(self, username, order=None, projection=None, batch_size=BATCH_SIZE):
+        """
+        Iterates over a user's entities, fetching them one page of
+        ``batch_size`` at a time as the iteration advances, so only one page
+        is in memory. The NDB context is held until the iteration ends; the
+        pages bypass its cache, which would otherwise keep every entity read.
+        """
+        with datastore_context():
+            query = self._query_by_username(username, order)
+            projection = self._projection(projection)
+            cursor, more = None, True
+            while more:
+                items, cursor, more = query.fetch_page(
+                    batch_size, start_cursor=cursor, projection=projection,
+                    use_cache=False, use_global_cache=False)
+                yield from items
+                more = more and cursor is not None
+
+    @uses_datastore
+    def fetch_page(self, username, page_size, cursor=None, order=None, projection=None):
         """
+        Fetches one page of a user's entities.
+        :param cursor: The opaque cursor returned with the previous page,
+            None for the first page. Cursors are only valid for the same
+            order and projection.
+        :param projection: As for ``fetch_by_username``.
+        :return: An (items, next_cursor) tuple, next_cursor is None on the last page.
+        """
+        return self.fetch_page_async(username, page_size, cursor, order, projection).result()
+
+    @uses_datastore
+    def fetch_page_async(self, username, page_size, cursor=None, order=None, projection=None):
+        """
+        Like ``fetch_page``, returning a future of the (items, next_cursor) tuple.
+        """
+        return self._fetch_page(username, page_size, cursor, order, projection)
+
+    @ndb.tasklet
+    def _fetch_page(self, username, page_size, cursor, order, projection):
+        query = self._query_by_username(username, order)
+        items, next_cursor, more = yield query.fetch_page_async(
+            page_size, start_cursor=self._start_cursor(cursor),
+            projection=self._projection(projection))
+        if not more or next_cursor is None:
+            return items, None
+        return items, next_cursor.urlsafe().decode('ascii')
+
+    def _query_by_username(self, username, order=None):
         query = self.model_class.query(self.model_class.usernickname == username)
         if order:
             for o in order:
                 query = query.order(o)
-        return query.fetch()
+        return query
 
+    def _projection(self, projection):
+        if not projection:
+            return None
+        # Datastore cannot project a property with an equality filter.
+        if 'usernickname' in projection:
+            raise ValueError(f"Cannot project 'usernickname' of {self.model_class.__name__}.")
+        return tuple(projection)
+
+    def _start_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            return ndb.Cursor(urlsafe=cursor)
+        except (ValueError, TypeError):
+            logger.warning(f"Ignoring invalid cursor for {self.model_class.__name__}: '{cursor}'.")
+            return None
+
+    @uses_datastore
     def read(self, identifier):
         """
         Reads a single entity by its numeric ID.
         """
+        return self.read_async(identifier).result()
+
+    @uses_datastore
+    def read_async(self, identifier):
+        """
+        Like ``read``, returning a future of the entity.
+        """
         try:
-            return self.model_class.get_by_id(int(identifier))
+            return self.model_class.get_by_id_async(int(identifier))
         except (ValueError, TypeError):
             logger.warning(f"Could not read {self.model_class.__name__}: Invalid identifier '{identifier}'.")
+            return _completed(None)
+
+    @uses_datastore
+    def update_many(self, records):
+        """
+        Updates existing entities from a list of dictionaries which must each
+        contain an 'id', reading and saving them one batch of BATCH_SIZE at
+        a time.
+        :return: One updated entity per record, None when the identifier is
+            invalid or no such entity exists.
+        """
+        keyed = []
+        for record in records:
+            record = dict(record)
+            identifier = record.pop('id', None)
+            if not identifier:
+                raise ValueError(f"Record for {self.model_class.__name__} must contain an 'id' for update.")
+            keyed.append((self._key(identifier, 'update'), record))
+        updated = {}
+
+        def changes(batch):
+            pairs = []
+            entities = ndb.get_multi([key for key, record in batch])
+            for (key, record), entity in zip(batch, entities):
+                updated.pop(key, None)
+                if entity is None:
+                    continue
+                before = self._copy(entity)
+                entity.populate(**record)
+                updated[key] = entity
+                pairs.append((before, entity))
+            return pairs
+
+        # Several records for one entity are merged, later values winning.
+        merged = {}
+        for key, record in keyed:
+            if key is not None:
+                merged.setdefault(key, {}).update(record)
+        for batch in _batches(list(merged.items())):
+            self._write(lambda batch=batch: changes(batch))
+        return [updated.get(key) if key is not None else None for key, record in keyed]
+
+    def _key(self, identifier, action):
+        try:
+            return ndb.Key(self.model_class, int(identifier))
+        except (ValueError, TypeError):
+            logger.warning(f"Could not {action} {self.model_class.__name__}: Invalid identifier '{identifier}'.")
             return None
 
+    @uses_datastore
     def update(self, record):
         """
         Updates an existing entity from a dictionary.
@@ -95,92 +347,522 @@ class CrudRepository(Repository):
         if not identifier:
             raise ValueError(f"Record for {self.model_class.__name__} must contain an 'id' for update.")
 
-        entity = self.read(identifier)
-        if entity:
+        try:
+            key = ndb.Key(self.model_class, int(identifier))
+        except (ValueError, TypeError):
+            logger.warning(f"Could not update {self.model_class.__name__}: Invalid identifier '{identifier}'.")
+            return None
+
+        updated = []
+
+        def changes():
+            del updated[:]
+            entity = key.get()
+            if not entity:
+                return []
+            before = self._copy(entity)
             # Use populate to update the entity's properties from the dictionary
             entity.populate(**record)
-            entity.put()
-        else:
+            updated.append(entity)
+            return [(before, entity)]
+        self._write(changes)
+        if not updated:
             logger.warning(f"Could not update {self.model_class.__name__}: No entity found for id {identifier}.")
-        return entity
+            return None
+        return updated[0]
+
+    def _copy(self, entity):
+        return self.model_class(key=entity.key, **entity.to_dict())
+
+    def _write(self, changes):
+        """
+        Runs ``changes``, which returns (before, after) entity pairs, then
+        saves the new entities, deletes the removed ones and lets the write
+        listeners update the derived data. When there are listeners all of
+        it runs in one transaction, so ``changes`` may run more than once.
+        """
+        write_listeners = listeners.listeners_for(self.model_class)
+
+        def commit():
+            pairs = changes()
+            # One lookup for the derived data of every listener.
+            keys = list(dict.fromkeys(key for listener in write_listeners for key in listener.keys(pairs)))
+            entities = dict(zip(keys, ndb.get_multi(keys))) if keys else {}
+            puts = [after for before, after in pairs if after is not None]
+            deletes = [before.key for before, after in pairs if after is None]
+            if puts:
+                ndb.put_multi(puts)
+            if deletes:
+                ndb.delete_multi(deletes)
+            for listener in write_listeners:
+                listener.apply(pairs, entities)
+            return pairs
+
+        if write_listeners:
+            return ndb.transaction(commit, join=True)
+        return commit()
+
+
+def _batches(items, size=None):
+    size = size or BATCH_SIZE
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _completed(result):
+    """
+    Returns a future which is already resolved to ``result``.
+    """
+    future = ndb.Future()
+    future.set_result(result)
+    return future
 
 
 # Specific repositories now pass the actual model class
 class CrunchesRepository(CrudRepository):
+    natural_key = ('usernickname', 'activity_date', 'activity_time')
+
     def __init__(self):
         super(CrunchesRepository, self).__init__(Crunch)
 
 
 class JumpRopeRepository(CrudRepository):
+    natural_key = ('usernickname', 'activity_date', 'activity_time')
+
     def __init__(self):
         super(JumpRopeRepository, self).__init__(JumpRope)
 
 
 class PushUpsRepository(CrudRepository):
+    natural_key = ('usernickname', 'activity_date', 'activity_time')
+
     def __init__(self):
         super(PushUpsRepository, self).__init__(PushUp)
 
 
 class RunRepository(CrudRepository):
+    natural_key = ('usernickname', 'activity_date', 'activity_time')
+
     def __init__(self):
         super(RunRepository, self).__init__(Run)
 
 
 class WeightRepository(CrudRepository):
+    natural_key = ('usernickname', 'weighing_date', 'creation_datetime')
+
     def __init__(self):
         super(WeightRepository, self).__init__(Weight)
 
 
+class ImportRepository(Repository):
+    """
+    Repository for the checkpoints of the CSV imports.
+    """
+
+    def __init__(self):
+        super(ImportRepository, self).__init__()
+
+    @uses_datastore
+    def checkpoint(self, name):
+        return ImportCheckpoint.get_by_id(name)
+
+    @uses_datastore
+    def save_checkpoint(self, name, filename, fingerprint, rows_done, completed=False):
+        checkpoint = ImportCheckpoint(id=name, filename=filename, fingerprint=fingerprint,
+                                      rows_done=rows_done, completed=completed)
+        checkpoint.put()
+        return checkpoint
+
+
+class JobRepository(Repository):
+    """
+    Repository for the status of the background jobs.
+    """
+
+    def __init__(self):
+        super(JobRepository, self).__init__()
+
+    @uses_datastore
+    def create(self, kind, username, params):
+        job = Job(kind=kind, username=username, params=params, status='queued', progress={})
+        job.put()
+        return job
+
+    @uses_datastore
+    def read(self, identifier):
+        try:
+            return Job.get_by_id(int(identifier))
+        except (ValueError, TypeError):
+            logger.warning(f"Could not read Job: Invalid identifier '{identifier}'.")
+            return None
+
+    @uses_datastore
+    def save(self, job):
+        job.put()
+        return job
+
+
 class StatisticsRepository(Repository):
     """
-    Repository for calculating statistics. This has been updated to work
-    with NDB model objects instead of dictionaries.
+    Repository for statistics. They are read from the UserStats aggregates,
+    which the write listeners keep up to date, and rebuilt from the full
+    history only when missing or stale.
     """
 
     def __init__(self):
         super(StatisticsRepository, self).__init__()
 
+    @uses_datastore
+    def user_stats(self, username):
+        """
+        Returns the UserStats of a user with a single key lookup, rebuilding
+        them first if they are missing or stale.
+        """
+        return self.user_stats_async(username).result()
+
+    @uses_datastore
+    def user_stats_async(self, username):
+        """
+        Like ``user_stats``, returning a future of the UserStats.
+        """
+        return self._user_stats(username)
+
+    @ndb.tasklet
+    def _user_stats(self, username):
+        stats = yield UserStats.get_by_id_async(username)
+        if user_stats.needs_rebuild(stats):
+            stats = yield self._rebuild_user_stats(username, stats)
+        return stats
+
+    @uses_datastore
+    def rebuild_user_stats(self, username, current=None):
+        """
+        Recomputes the UserStats of a user from all of their runs,
+        weighings and countable activities. The result is only saved if no write was applied to
+        the aggregates in the meantime.
+        """
+        return self._rebuild_user_stats(username, current).result()
+
+    @ndb.tasklet
+    def _rebuild_user_stats(self, username, current=None):
+        if current is None:
+            current = yield UserStats.get_by_id_async(username)
+        revision = current.revision if current else 0
+        # Every history is queried at the same time.
+        countable = list(user_stats.COUNTABLE.items())
+        runs, weighings, *sessions = yield [
+            RunRepository().fetch_by_username_async(
+                username, order=[-Run.activity_date, -Run.activity_time],
+                projection=user_stats.fields_of('running')),
+            WeightRepository().fetch_by_username_async(
+                username, order=[-Weight.weighing_date],
+                projection=user_stats.WEIGHT_FIELDS)] + [
+            CrudRepository(model_class).fetch_by_username_async(
+                username, order=[-model_class.activity_date, -model_class.activity_time],
+                projection=user_stats.ACTIVITY_FIELDS)
+            for kind, model_class in countable]
+        activities = {kind: items for (kind, _), items in zip(countable, sessions)}
+        rebuilt = user_stats.build(username, runs, weighings, activities, revision=revision)
+
+        @ndb.tasklet
+        def save():
+            latest = yield UserStats.get_by_id_async(username)
+            if (latest.revision if latest else 0) != revision:
+                return False
+            yield rebuilt.put_async()
+            return True
+
+        saved = yield ndb.transaction_async(save)
+        if not saved:
+            logger.info(f'UserStats of {username} changed while rebuilding, keeping them stale.')
+        return rebuilt
+
+    @uses_datastore
+    def rollups(self, username, kind, labels):
+        """
+        Returns the totals of one kind of activity of a user for the given
+        bucket labels (see eridanus.statistics.rollups), reading one
+        ActivityRollup per year covered. Buckets without activities have
+        zero totals. The rollups are rebuilt first if they are stale.
+        """
+        return self.rollups_async(username, kind, labels).result()
+
+    @uses_datastore
+    def rollups_async(self, username, kind, labels):
+        """
+        Like ``rollups``, returning a future of the totals.
+        """
+        return self._rollups(username, kind, list(labels))
+
+    @ndb.tasklet
+    def _rollups(self, username, kind, labels):
+        years = dict.fromkeys(rollups.bucket_year(label) for label in labels)
+        keys = [rollups.rollup_key(username, kind, year) for year in years]
+        state, *entities = yield ndb.get_multi_async([ndb.Key(RollupState, username)] + keys)
+        if state is None or state.stale:
+            rebuilt = yield self._rebuild_rollups(username, state)
+            rebuilt = {entity.key: entity for entity in rebuilt}
+            entities = [rebuilt.get(key) for key in keys]
+        buckets = {}
+        for entity in entities:
+            if entity is not None:
+                buckets.update(entity.buckets or {})
+        return {label: buckets.get(label) or rollups.empty_totals() for label in labels}
+
+    @uses_datastore
+    def rebuild_rollups(self, username, state=None):
+        """
+        Recomputes every ActivityRollup of a user from all of their
+        activities. Like ``rebuild_user_stats``, the result is only saved if
+        no write was applied to the rollups in the meantime.
+        """
+        return self._rebuild_rollups(username, state).result()
+
+    @ndb.tasklet
+    def _rebuild_rollups(self, username, state=None):
+        if state is None:
+            state = yield RollupState.get_by_id_async(username)
+        revision = state.revision if state else 0
+        # Every kind is queried at the same time.
+        histories = yield [
+            CrudRepository(model_class).fetch_by_username_async(
+                username, order=[-model_class.activity_date, -model_class.activity_time],
+                projection=user_stats.fields_of(kind))
+            for kind, model_class in user_stats.KINDS.items()]
+        rebuilt = rollups.build(username, [item for history in histories for item in history])
+        existing = yield ActivityRollup.query(ActivityRollup.usernickname == username).fetch_async(keys_only=True)
+        obsolete = set(existing) - {entity.key for entity in rebuilt}
+
+        @ndb.tasklet
+        def save():
+            latest = yield RollupState.get_by_id_async(username)
+            if (latest.revision if latest else 0) != revision:
+                return False
+            fresh = RollupState(id=username, stale=False, revision=revision)
+            yield ndb.put_multi_async(rebuilt + [fresh])
+            if obsolete:
+                yield ndb.delete_multi_async(list(obsolete))
+            return True
+
+        saved = yield ndb.transaction_async(save)
+        if not saved:
+            logger.info(f'Rollups of {username} changed while rebuilding, keeping them stale.')
+        return rebuilt
+
+    @uses_datastore
+    def records(self, username):
+        """
+        Returns the personal Records of a user with a single key lookup,
+        rebuilding them first if they are missing or stale.
+        """
+        return self.records_async(username).result()
+
+    @uses_datastore
+    def records_async(self, username):
+        """
+        Like ``records``, returning a future of the Records.
+        """
+        return self._records(username)
+
+    @ndb.tasklet
+    def _records(self, username):
+        entity = yield PersonalRecords.get_by_id_async(username)
+        if entity is None or entity.stale:
+            entity = yield self._rebuild_records(username, entity)
+        return records.Records(entity.records)
+
+    @uses_datastore
+    def rebuild_records(self, username, current=None):
+        """
+        Recomputes the PersonalRecords of a user from all of their
+        activities. Like ``rebuild_user_stats``, the result is only saved if
+        no write was applied to the records in the meantime.
+        """
+        return self._rebuild_records(username, current).result()
+
+    @ndb.tasklet
+    def _rebuild_records(self, username, current=None):
+        if current is None:
+            current = yield PersonalRecords.get_by_id_async(username)
+        revision = current.revision if current else 0
+        # Every kind is queried at the same time.
+        kinds = list(user_stats.KINDS.items())
+        histories = yield [
+            CrudRepository(model_class).fetch_by_username_async(
+                username, order=[-model_class.activity_date, -model_class.activity_time],
+                projection=user_stats.fields_of(kind))
+            for kind, model_class in kinds]
+        built = records.Records.build({kind: items for (kind, _), items in zip(kinds, histories)})
+        rebuilt = PersonalRecords(id=username, records=built.to_dict(), stale=False, revision=revision)
+
+        @ndb.tasklet
+        def save():
+            latest = yield PersonalRecords.get_by_id_async(username)
+            if (latest.revision if latest else 0) != revision:
+                return False
+            yield rebuilt.put_async()
+            return True
+
+        saved = yield ndb.transaction_async(save)
+        if not saved:
+            logger.info(f'Records of {username} changed while rebuilding, keeping them stale.')
+        return rebuilt
+
+    @uses_datastore
+    def calendar(self, username, today=None):
+        """
+        Returns the activity Calendar of a user, read from one ActivityDays
+        bitmap per kind and year. Days left pending by deletes are checked
+        first with keys-only queries, and the bitmaps are rebuilt if they
+        are missing or stale.
+        """
+        return self.calendar_async(username, today).result()
+
+    @uses_datastore
+    def calendar_async(self, username, today=None):
+        """
+        Like ``calendar``, returning a future of the Calendar.
+        """
+        return self._calendar(username, today or date.today())
+
+    @ndb.tasklet
+    def _calendar(self, username, today):
+        state = yield CalendarState.get_by_id_async(username)
+        if state is None or state.stale:
+            calendar = yield self._rebuild_calendar(username, state)
+            return calendar
+        if not state.first_year:
+            return activity_calendar.Calendar(None, {})
+
+        last_year = max([today.year] + [int(day[:4]) for _, day in state.pending or []])
+        identifiers = [(kind, year) for kind in user_stats.KINDS
+                       for year in range(state.first_year, last_year + 1)]
+        entities = yield ndb.get_multi_async(
+            [activity_calendar.days_key(username, kind, year) for kind, year in identifiers])
+        bitmaps = {identifier: activity_calendar.to_bits(entity.days)
+                   for identifier, entity in zip(identifiers, entities) if entity is not None}
+        if state.pending:
+            yield self._check_pending(username, state, bitmaps)
+        return activity_calendar.Calendar(state.first_year, bitmaps)
+
+    @ndb.tasklet
+    def _check_pending(self, username, state, bitmaps):
+        # Equality filters only, served by the built-in indexes.
+        pending = [(kind, date.fromisoformat(day)) for kind, day in state.pending]
+        found = yield [
+            user_stats.KINDS[kind].query(user_stats.KINDS[kind].usernickname == username,
+                                         user_stats.KINDS[kind].activity_date == day)
+            .fetch_async(1, keys_only=True)
+            for kind, day in pending]
+        changed = set()
+        for (kind, day), keys in zip(pending, found):
+            if not keys and (kind, day.year) in bitmaps:
+                bitmaps[(kind, day.year)] &= ~(1 << activity_calendar.day_index(day))
+                changed.add((kind, day.year))
+        entities = [ActivityDays(key=activity_calendar.days_key(username, kind, year), usernickname=username,
+                                 kind=kind, year=year, days=activity_calendar.to_bytes(bitmaps[(kind, year)]))
+                    for kind, year in sorted(changed)]
+        revision = state.revision
+
+        @ndb.tasklet
+        def save():
+            latest = yield CalendarState.get_by_id_async(username)
+            if latest is None or latest.revision != revision:
+                return False
+            latest.pending = []
+            yield ndb.put_multi_async(entities + [latest])
+            return True
+
+        saved = yield ndb.transaction_async(save)
+        if not saved:
+            logger.info(f'Calendar of {username} changed while checking its days, checking them again later.')
+
+    @uses_datastore
+    def rebuild_calendar(self, username, state=None):
+        """
+        Recomputes every ActivityDays of a user from the dates of all of
+        their activities. Like ``rebuild_user_stats``, the result is only
+        saved if no write was applied to the calendar in the meantime.
+        """
+        return self._rebuild_calendar(username, state).result()
+
+    @ndb.tasklet
+    def _rebuild_calendar(self, username, state=None):
+        if state is None:
+            state = yield CalendarState.get_by_id_async(username)
+        revision = state.revision if state else 0
+        # Every kind is queried at the same time, for its dates only.
+        kinds = list(user_stats.KINDS.items())
+        histories = yield [
+            CrudRepository(model_class).fetch_by_username_async(
+                username, order=[-model_class.activity_date, -model_class.activity_time],
+                projection=('activity_date', 'activity_time'))
+            for kind, model_class in kinds]
+        bitmaps = activity_calendar.build({kind: items for (kind, _), items in zip(kinds, histories)})
+        first_year = min((year for _, year in bitmaps), default=None)
+        rebuilt = [ActivityDays(key=activity_calendar.days_key(username, kind, year), usernickname=username,
+                                kind=kind, year=year, days=activity_calendar.to_bytes(bits))
+                   for (kind, year), bits in sorted(bitmaps.items())]
+        existing = yield ActivityDays.query(ActivityDays.usernickname == username).fetch_async(keys_only=True)
+        obsolete = set(existing) - {entity.key for entity in rebuilt}
+
+        @ndb.tasklet
+        def save():
+            latest = yield CalendarState.get_by_id_async(username)
+            if (latest.revision if latest else 0) != revision:
+                return False
+            fresh = CalendarState(id=username, first_year=first_year, pending=[], stale=False, revision=revision)
+            yield ndb.put_multi_async(rebuilt + [fresh])
+            if obsolete:
+                yield ndb.delete_multi_async(list(obsolete))
+            return True
+
+        saved = yield ndb.transaction_async(save)
+        if not saved:
+            logger.info(f'Calendar of {username} changed while rebuilding, keeping it stale.')
+        return activity_calendar.Calendar(first_year, bitmaps)
+
+    @uses_datastore
+    def data_version(self, username):
+        """
+        Returns the DataVersion counter of a user, 0 before their first write.
+        """
+        entity = DataVersion.get_by_id(username)
+        return entity.version if entity is not None else 0
+
+    @uses_datastore
+    def dashboard_snapshot(self, username):
+        return DashboardSnapshot.get_by_id(username)
+
+    @uses_datastore
+    def save_dashboard_snapshot(self, username, version, day, stats):
+        DashboardSnapshot(id=username, version=version, day=day, stats=stats).put()
+
+    @uses_datastore
     def running_stats(self, username):
-        repository = RunRepository()
-        # The 'order' parameter now uses the NDB model property
-        items = repository.fetch_by_username(username, order=[-Run.activity_date, -Run.activity_time])
-        
-        if not items:
-            return {}
+        return self.running_summary(self.user_stats(username))
 
-        count = len(items)
-        date_last_run = items[0].activity_date
-        days_from_last_run = self._days_from_last_run(date_last_run)
-
-        total_calories = sum(item.calories for item in items if item.calories)
-        total_distance = sum(item.distance for item in items if item.distance)
-        total_time = sum(item.duration for item in items if item.duration)
-        
-        # Handle speed calculation, now accessing object properties
-        speeds = []
-        for item in items:
-            if item.speed is not None:
-                speeds.append(item.speed)
-            elif item.distance is not None and item.duration > 0:
-                speeds.append(item.distance / (item.duration / 60.0))
-        
-        total_speed = sum(speeds)
+    def running_summary(self, stats):
+        totals = user_stats.RunningTotals(stats.running)
+        count = totals.count
+        if not count:
+            return {}
 
         return {
-            'avg_calories': self._avg(total_calories, count),
-            'avg_speed': self._avg(total_speed, len(speeds)) if speeds else 0.0,
-            'avg_distance': self._avg(total_distance, count),
-            'avg_time': self._avg(total_time, count),
+            'avg_calories': self._avg(totals.total_calories, count),
+            'avg_speed': self._avg(totals.speed_total, totals.speed_count),
+            'avg_distance': self._avg(totals.total_distance, count),
+            'avg_time': self._avg(totals.total_time, count),
             'count': count,
-            'date_last_run': date_last_run,
-            'days_from_last_run': days_from_last_run,
-            'max_calories': max(item.calories for item in items if item.calories),
-            'max_distance': max(item.distance for item in items if item.distance),
-            'max_speed': max(speeds) if speeds else 0.0,
-            'max_time': max(item.duration for item in items if item.duration),
-            'total_distance': total_distance,
-            'total_time': total_time,
-            'total_calories': total_calories
+            'date_last_run': totals.date_last_run,
+            'days_from_last_run': self._days_from_last_run(totals.date_last_run),
+            'max_calories': totals.max_calories,
+            'max_distance': totals.max_distance,
+            'max_speed': totals.max_speed,
+            'max_time': totals.max_time,
+            'total_distance': totals.total_distance,
+            'total_time': totals.total_time,
+            'total_calories': totals.total_calories
         }
 
     def _avg(self, total, count):
@@ -195,38 +877,73 @@ class StatisticsRepository(Repository):
             return diff.days
         return None
 
+    @uses_datastore
+    def activity_stats(self, username, kind):
+        return self.activity_summary(self.user_stats(username), kind)
+
+    def activity_summary(self, stats, kind):
+        """
+        The summary of one countable activity (see user_stats.COUNTABLE),
+        empty when the user has no session of it.
+        """
+        totals = user_stats.ActivityTotals((stats.activities or {}).get(kind))
+        count = totals.count
+        if not count:
+            return {}
+
+        return {
+            'avg_repetitions': self._avg(totals.total_repetitions, count),
+            'avg_time': self._avg(totals.total_time, count),
+            'count': count,
+            'date_last': totals.date_last,
+            'days_from_last': self._days_from_last_run(totals.date_last),
+            'max_rate': totals.max_rate,
+            'max_repetitions': totals.max_repetitions,
+            'max_time': totals.max_time,
+            'rate_per_minute': self._avg(totals.timed_repetitions, totals.timed_time),
+            'total_calories': totals.total_calories,
+            'total_repetitions': totals.total_repetitions,
+            'total_time': totals.total_time,
+        }
+
+    @uses_datastore
     def weighing_stats(self, username):
-        repository = WeightRepository()
-        # Order using the NDB model property
-        items = repository.fetch_by_username(username, order=[-Weight.weighing_date])
+        return self.weighing_summary(self.user_stats(username))
 
-        if not items:
+    def weighing_summary(self, stats):
+        totals = user_stats.WeighingTotals(stats.weighing)
+        if not totals.count:
             return {}
-        
-        count = len(items)
-        last_weight = items[0].weight
-        
-        all_weights = [item.weight for item in items if item.weight is not None]
-        total = sum(all_weights)
-        
-        # Calculate stats for the last 20 entries
-        last_20_weights = all_weights[:20]
-        total_last20 = sum(last_20_weights)
-        avg_last20 = self._avg(total_last20, len(last_20_weights))
+
+        last_weight = totals.last_weight
+        # The recent weighings are the last 20 entries
+        last_20_weights = [item[1] for item in totals.recent]
+        avg_last20 = self._avg(sum(last_20_weights), len(last_20_weights))
 
         return {
-            'avg': self._avg(total, len(all_weights)),
+            'avg': self._avg(totals.weight_total, totals.weight_count),
             'avg_last20': avg_last20,
-            'count': count,
+            'count': totals.count,
             'growth_rate_last20': self._growth_rate(avg_last20, last_weight),
             'last_weight': last_weight,
-            'max': max(all_weights) if all_weights else 0.0,
-            'min': min(all_weights) if all_weights else 0.0,
-            'trend': '' # This was empty before, keeping it
+            'max': totals.max if totals.max is not None else 0.0,
+            'min': totals.min if totals.min is not None else 0.0,
+            'trend': '', # This was empty before, keeping it
+            'weight_trend': {
+                'smoothed': totals.trend.smoothed,
+                'kg_per_week': totals.trend.slope_per_week,
+            }
         }
 
+    def weight_target_date(self, stats, target):
+        """
+        The day the smoothed weight reaches ``target`` at its current trend,
+        None when it is moving away from it.
+        """
+        return user_stats.WeighingTotals(stats.weighing).trend.projected_date(target)
+
     def _growth_rate(self, avg, last):
         if not avg or not last:
             return 0.0
         # https://www.wikihow.com/Calculate-Growth-Rate
-        return ((float(last) / float(avg)) - 1.0) * 100.0
\ No newline at end of file
+        return ((float(last) / float(avg)) - 1.0) * 100.0
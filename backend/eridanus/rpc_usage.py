@@ -0,0 +1,181 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+# Calls of one method touching a single entity, or queries, above which a
+# request is reported as a likely N+1 pattern: one RPC per item of a list
+# instead of one for the whole list.
+DEFAULT_REPEAT_THRESHOLD = 10
+
+# The RpcUsage collecting the Datastore calls of the code running.
+_current = contextvars.ContextVar('eridanus_rpc_usage', default=None)
+
+
+def _pb(message):
+    # Proto-plus messages wrap the protobuf message which knows its size.
+    pb = getattr(type(message), 'pb', None)
+    return pb(message) if pb is not None else message
+
+
+class RpcBudgetExceeded(AssertionError):
+    pass
+
+
+class RpcUsage(object):
+    """
+    Counts the Datastore RPCs made while it is current: calls and errors
+    by method, entities read and written, and the bytes sent and received.
+    Responses arrive on gRPC threads, so the counters are locked. Whatever
+    is recorded is also recorded in the ``parent`` usage.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.calls = {}
+        # Lookups of one key, commits of one mutation and queries, by method.
+        self.single = {}
+        self.errors = 0
+        self.entities_read = 0
+        self.entities_written = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    @property
+    def rpcs(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def record_call(self, method, request, future=None):
+        """
+        Records an RPC as it is sent. The response is recorded when
+        ``future`` completes.
+        """
+        pb = _pb(request)
+        size = pb.ByteSize()
+        if method == 'Lookup':
+            single = len(pb.keys) <= 1
+        elif method == 'Commit':
+            single = len(pb.mutations) <= 1
+        else:
+            single = method in ('RunQuery', 'RunAggregationQuery')
+        self._sent(method, size, single)
+        if future is not None:
+            future.add_done_callback(lambda done: self._completed(method, done))
+
+    def record_response(self, method, response):
+        pb = _pb(response)
+        if method == 'Lookup':
+            read, written = len(pb.found), 0
+        elif method == 'RunQuery':
+            read, written = len(pb.batch.entity_results), 0
+        elif method == 'Commit':
+            read, written = 0, len(pb.mutation_results)
+        else:
+            read, written = 0, 0
+        self._received(pb.ByteSize(), read, written)
+
+    def _completed(self, method, future):
+        try:
+            error = future.exception()
+        except Exception as exc:
+            error = exc
+        if error is not None:
+            self._failed()
+        else:
+            self.record_response(method, future.result())
+
+    def _sent(self, method, size, single):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if single:
+                self.single[method] = self.single.get(method, 0) + 1
+            self.bytes_sent += size
+        if self.parent is not None:
+            self.parent._sent(method, size, single)
+
+    def _received(self, size, read, written):
+        with self._lock:
+            self.bytes_received += size
+            self.entities_read += read
+            self.entities_written += written
+        if self.parent is not None:
+            self.parent._received(size, read, written)
+
+    def _failed(self):
+        with self._lock:
+            self.errors += 1
+        if self.parent is not None:
+            self.parent._failed()
+
+    def repeated(self, threshold=DEFAULT_REPEAT_THRESHOLD):
+        """
+        The methods called for a single entity at least ``threshold`` times,
+        with their counts: the likely N+1 patterns.
+        """
+        with self._lock:
+            return {method: count for method, count in self.single.items() if count >= threshold}
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'datastore_rpcs': sum(self.calls.values()),
+                'datastore_calls': dict(self.calls),
+                'datastore_errors': self.errors,
+                'datastore_entities_read': self.entities_read,
+                'datastore_entities_written': self.entities_written,
+                'datastore_bytes_sent': self.bytes_sent,
+                'datastore_bytes_received': self.bytes_received,
+            }
+
+
+def current():
+    return _current.get()
+
+
+def start():
+    """
+    Starts counting the RPCs of the current context, on top of the usage
+    already counting them, if any.
+    """
+    usage = RpcUsage(parent=_current.get())
+    _current.set(usage)
+    return usage
+
+
+def finish(usage):
+    """
+    Stops counting into ``usage``, the one returned by ``start``.
+    """
+    if usage is not None and _current.get() is usage:
+        _current.set(usage.parent)
+    return usage
+
+
+@contextmanager
+def track():
+    usage = start()
+    try:
+        yield usage
+    finally:
+        finish(usage)
+
+
+@contextmanager
+def budget(max_rpcs=None, **max_calls):
+    """
+    Raises RpcBudgetExceeded when the block makes more than ``max_rpcs``
+    Datastore RPCs, or more calls of a method than given by name, e.g.
+    ``budget(4, Lookup=2, RunQuery=0)``.
+    """
+    with track() as usage:
+        yield usage
+    over = []
+    if max_rpcs is not None and usage.rpcs > max_rpcs:
+        over.append(f'{usage.rpcs} RPCs (budget {max_rpcs})')
+    for method, limit in sorted(max_calls.items()):
+        count = usage.calls.get(method, 0)
+        if count > limit:
+            over.append(f'{count} {method} calls (budget {limit})')
+    if over:
+        raise RpcBudgetExceeded(f"Datastore RPC budget exceeded: {', '.join(over)}; made {usage.calls}.")
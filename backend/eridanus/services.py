@@ -1,13 +1,27 @@
 from abc import ABCMeta, abstractmethod
 # import warnings
 
+from eridanus.settings import int_setting
+
+DEFAULT_PAGE_SIZE = 50
+# Upper bound of the page size a client can ask for, a page is read at once.
+MAX_PAGE_SIZE = 200
+
 
 class CrudService(metaclass=ABCMeta):
 
     @abstractmethod
-    def fetch_all(self, username):
+    def fetch_all(self, username, cursor=None, page_size=None):
+        '''
+        Returns one page of the user's items, along with 'next_cursor',
+        the opaque cursor of the following page (None on the last one).
+        '''
         raise NotImplementedError
 
+    def page_size(self, page_size=None):
+        page_size = page_size or int_setting('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+        return max(1, min(page_size, MAX_PAGE_SIZE))
+
     @abstractmethod
     def create(self, activity):
         raise NotImplementedError
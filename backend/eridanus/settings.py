@@ -0,0 +1,18 @@
+import os
+
+from config import Configuration
+
+
+def setting(name, default=None):
+    """
+    Reads a setting from the environment, falling back to the Configuration
+    class of config.py and then to ``default``.
+    """
+    return os.environ.get(name, getattr(Configuration, name, default))
+
+
+def int_setting(name, default):
+    try:
+        return int(setting(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,87 @@
+import os
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls of the same computation within a process.
+
+    The first thread to call ``do`` with a key runs the function; the
+    threads which call it with the same key before it returns wait and get
+    its result, or its exception. The next call after that runs the
+    function again, nothing is cached. The result is shared by all of the
+    callers, which must not change it.
+
+    Keys should name the user, the computation and the data version it
+    reads, so a call made after a write never gets a result computed
+    before it.
+    """
+
+    FIELDS = ('calls', 'executions', 'coalesced', 'errors')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            self._counters['calls'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self._counters['executions'] += 1
+            else:
+                self._counters['coalesced'] += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as exc:
+            with self._lock:
+                self._counters['errors'] += 1
+                del self._flights[key]
+            flight.set_exception(exc)
+            raise
+        with self._lock:
+            del self._flights[key]
+        flight.set_result(result)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters['in_flight'] = len(self._flights)
+        return counters
+
+
+_group = None
+_group_pid = None
+_group_lock = threading.Lock()
+
+
+def get_single_flight():
+    """
+    Returns the SingleFlight of the current process. A forked worker gets
+    its own, the flights of the parent are never completed in the child.
+    """
+    global _group, _group_pid
+    pid = os.getpid()
+    if _group_pid == pid:
+        return _group
+    with _group_lock:
+        if _group_pid != pid:
+            _group = SingleFlight()
+            _group_pid = pid
+        return _group
+
+
+def single_flight(key, function, *args, **kwargs):
+    return get_single_flight().do(key, function, *args, **kwargs)
+
+
+def single_flight_metrics():
+    return get_single_flight().snapshot()
@@ -0,0 +1,227 @@
+import logging
+from datetime import date, timedelta
+
+from google.cloud import ndb
+
+from eridanus.listeners import WriteListener, usernames
+from eridanus.models import Activity, ActivityDays, CalendarState
+from eridanus.statistics.user_stats import kind_of
+
+logger = logging.getLogger(__name__)
+
+# 366 bits, enough for a leap year.
+YEAR_BYTES = 46
+
+# The years a heatmap can show: the weeks of the last one end in the next.
+MIN_YEAR = 1
+MAX_YEAR = 9998
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def day_index(day):
+    return day.timetuple().tm_yday - 1
+
+
+def to_bits(days):
+    return int.from_bytes(days or b'', 'little')
+
+
+def to_bytes(bits):
+    return bits.to_bytes(YEAR_BYTES, 'little')
+
+
+def days_key(username, kind, year):
+    return ndb.Key(ActivityDays, f'{username}:{kind}:{year}')
+
+
+def set_day(bitmaps, username, kind, day):
+    """
+    Sets the bit of a day. ``bitmaps`` maps (username, kind, year) to
+    integers and is filled with empty years as needed.
+    """
+    identifier = (username, kind, day.year)
+    bitmaps[identifier] = bitmaps.get(identifier, 0) | 1 << day_index(day)
+
+
+def build(activities):
+    """
+    The bitmaps of every year and kind of the activities of a user.
+    :param activities: The activities of each kind, by kind.
+    """
+    bitmaps = {}
+    for kind, items in activities.items():
+        for item in items:
+            if item.activity_date:
+                set_day(bitmaps, None, kind, item.activity_date)
+    return {(kind, year): bits for (_, kind, year), bits in bitmaps.items()}
+
+
+class Calendar(object):
+    """
+    The activity days of a user from ``first_year`` on, answering streak
+    and recency questions with bit operations on a single integer whose
+    bit n is the n-th day since January 1st of the first year.
+    """
+
+    def __init__(self, first_year, bitmaps):
+        """
+        :param bitmaps: The day bits by (kind, year).
+        """
+        self.first_year = first_year
+        self.bitmaps = bitmaps
+        self.origin = date(first_year, 1, 1) if first_year else None
+
+    def _offset(self, day):
+        return (day - self.origin).days
+
+    def timeline(self, kinds=None):
+        """
+        The days with an activity of any of ``kinds`` (all by default).
+        """
+        bits = 0
+        for (kind, year), year_bits in self.bitmaps.items():
+            if kinds is None or kind in kinds:
+                bits |= year_bits << self._offset(date(year, 1, 1))
+        return bits
+
+    def days_since_last(self, today, kinds=None):
+        if self.origin is None or today < self.origin:
+            return None
+        past = self.timeline(kinds) & ((1 << (self._offset(today) + 1)) - 1)
+        if not past:
+            return None
+        return self._offset(today) - (past.bit_length() - 1)
+
+    def current_streak(self, today, kinds=None):
+        """
+        The consecutive active days ending today, or yesterday when today
+        has no activity yet.
+        """
+        if self.origin is None or today < self.origin:
+            return 0
+        bits = self.timeline(kinds)
+        end = self._offset(today)
+        if not bits >> end & 1:
+            end -= 1
+        if end < 0 or not bits >> end & 1:
+            return 0
+        # The highest inactive day up to the end bounds the streak.
+        gaps = ~bits & ((1 << (end + 1)) - 1)
+        return end + 1 - gaps.bit_length()
+
+    def longest_streak(self, kinds=None):
+        # Each step shortens every run of set bits by one.
+        bits = self.timeline(kinds)
+        length = 0
+        while bits:
+            bits &= bits >> 1
+            length += 1
+        return length
+
+    def active_days(self, year, kinds=None):
+        bits = 0
+        for (kind, bitmap_year), year_bits in self.bitmaps.items():
+            if bitmap_year == year and (kinds is None or kind in kinds):
+                bits |= year_bits
+        return bin(bits).count('1')
+
+    def heatmap(self, year):
+        """
+        A year at a glance: weeks from the Monday on or before January 1st,
+        each a list of seven days holding the number of kinds done that
+        day, None outside the year, and the neighbouring years which can be
+        shown too.
+        """
+        if not MIN_YEAR <= year <= MAX_YEAR:
+            raise ValueError(f'No heatmap for the year {year}, only from {MIN_YEAR} to {MAX_YEAR}.')
+        years = [(kind, bits) for (kind, bitmap_year), bits in self.bitmaps.items() if bitmap_year == year]
+        first = date(year, 1, 1)
+        day = first - timedelta(days=first.weekday())
+        weeks = []
+        while day.year <= year:
+            week = []
+            for _ in range(7):
+                if day.year == year:
+                    index = day_index(day)
+                    week.append(sum(bits >> index & 1 for _, bits in years))
+                else:
+                    week.append(None)
+                day += timedelta(days=1)
+            weeks.append(week)
+        return {'year': year, 'start': _iso(first - timedelta(days=first.weekday())), 'weeks': weeks,
+                'previous_year': year - 1 if year > MIN_YEAR else None,
+                'next_year': year + 1 if year < MAX_YEAR else None}
+
+
+class CalendarListener(WriteListener):
+    """
+    Sets the day bit of each saved activity. A day which loses an activity
+    may still have others, so instead of clearing its bit the day is left
+    pending in the CalendarState and checked on the next read.
+    """
+
+    kinds = (Activity,)
+
+    def _days(self, changes):
+        # The day bits set by a write and the days it may have emptied.
+        added, pending = {}, []
+        for before, after in changes:
+            if after is not None and after.usernickname and after.activity_date:
+                set_day(added, after.usernickname, kind_of(type(after)), after.activity_date)
+            if before is not None and before.usernickname and before.activity_date:
+                moved = (after is None or after.activity_date != before.activity_date
+                         or after.usernickname != before.usernickname)
+                if moved:
+                    pending.append((before.usernickname, kind_of(type(before)), before.activity_date))
+        return added, pending
+
+    def keys(self, changes):
+        names = sorted(usernames(changes))
+        if not names:
+            return []
+        added, _ = self._days(changes)
+        return ([days_key(*identifier) for identifier in added]
+                + [ndb.Key(CalendarState, name) for name in names])
+
+    def apply(self, changes, entities):
+        names = sorted(usernames(changes))
+        if not names:
+            return
+        added, pending = self._days(changes)
+
+        keys = [days_key(*identifier) for identifier in added]
+        state_keys = [ndb.Key(CalendarState, name) for name in names]
+        puts = []
+        for key, ((name, kind, year), bits) in zip(keys, added.items()):
+            entity = entities.get(key)
+            if entity is None:
+                entity = ActivityDays(key=key, usernickname=name, kind=kind, year=year)
+            entity.days = to_bytes(to_bits(entity.days) | bits)
+            puts.append(entity)
+
+        for key in state_keys:
+            # The days of a user seen for the first time may predate the
+            # calendar, they are rebuilt on their first read.
+            state = entities.get(key) or CalendarState(key=key, pending=[], stale=True)
+            name = key.id()
+            days = {tuple(item) for item in state.pending or []}
+            days.update((kind, _iso(day)) for user, kind, day in pending if user == name)
+            # A day which got an activity in the same write is not empty.
+            days = {(kind, day) for kind, day in days
+                    if not added.get((name, kind, int(day[:4])), 0) >> day_index(date.fromisoformat(day)) & 1}
+            state.pending = sorted([kind, day] for kind, day in days)
+            years = [year for user, _, year in added if user == name]
+            if years:
+                state.first_year = min([state.first_year or years[0]] + years)
+            state.revision = (state.revision or 0) + 1
+            puts.append(state)
+        ndb.put_multi(puts)
+
+    def invalidate(self, username):
+        state = CalendarState.get_by_id(username)
+        if state is not None and not state.stale:
+            state.stale = True
+            state.put()
@@ -0,0 +1,46 @@
+import logging
+
+from google.cloud import ndb
+
+from eridanus.listeners import WriteListener, usernames
+from eridanus.models import Activity, DataVersion, Weight
+
+logger = logging.getLogger(__name__)
+
+
+def version_keys(names):
+    return [ndb.Key(DataVersion, name) for name in sorted(names)]
+
+
+def bump(names, found=None):
+    """
+    Increments the DataVersion of each user, creating it when needed.
+    :param found: The DataVersion entities already read, by key.
+    """
+    keys = version_keys(names)
+    if found is None:
+        found = dict(zip(keys, ndb.get_multi(keys)))
+    entities = [found.get(key) or DataVersion(key=key) for key in keys]
+    for entity in entities:
+        entity.version = (entity.version or 0) + 1
+    ndb.put_multi(entities)
+
+
+class DataVersionListener(WriteListener):
+    """
+    Increments the DataVersion of the users touched by every write of an
+    activity or a weighing, so the views cached for them expire.
+    """
+
+    kinds = (Activity, Weight)
+
+    def keys(self, changes):
+        return version_keys(usernames(changes))
+
+    def apply(self, changes, entities):
+        names = usernames(changes)
+        if names:
+            bump(names, entities)
+
+    def invalidate(self, username):
+        ndb.transaction(lambda: bump([username]), join=True)
@@ -0,0 +1,213 @@
+from datetime import date
+from operator import attrgetter
+
+import numpy as np
+
+from eridanus.statistics.trend import HALF_LIFE_DAYS, REGRESSION_WINDOW, WeightTrend
+
+# Number of most recent weighings kept for the "last 20" averages.
+RECENT_WEIGHINGS = 20
+
+
+def _column(entities, name, dtype=float):
+    """
+    The values of a property as an array. Properties which a projection
+    query did not read count as missing; the entities are expected to come
+    from one query, so only the first one is checked.
+    """
+    if entities and entities[0]._projection and name not in entities[0]._projection:
+        return np.full(len(entities), None, dtype=dtype)
+    values = list(map(attrgetter(name), entities))
+    if dtype == 'datetime64[D]':
+        return _dates(values)
+    return np.array(values, dtype=dtype)
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_NAT = np.iinfo(np.int64).min
+
+
+def _dates(values):
+    # Converting date objects one by one in NumPy is far slower than going
+    # through their ordinals.
+    try:
+        ordinals = np.fromiter(map(date.toordinal, values), dtype=np.int64, count=len(values))
+        return (ordinals - _EPOCH_ORDINAL).astype('datetime64[D]')
+    except TypeError:
+        ordinals = [value.toordinal() - _EPOCH_ORDINAL if value is not None else _NAT
+                    for value in values]
+        return np.array(ordinals, dtype=np.int64).astype('datetime64[D]')
+
+
+def _iso(day):
+    return None if np.isnat(day) else str(day)
+
+
+class RunColumns(object):
+    """
+    The runs of a user as NumPy arrays, one per property, missing values
+    being NaN (NaT for dates). ``totals`` computes every aggregate with
+    vectorized operations, in the layout of RunningTotals.to_dict and with
+    the results of adding the runs one at a time.
+    """
+
+    def __init__(self, activity_date, distance, duration, calories, speed):
+        self.activity_date = np.asarray(activity_date, dtype='datetime64[D]')
+        self.distance = np.asarray(distance, dtype=float)
+        self.duration = np.asarray(duration, dtype=float)
+        self.calories = np.asarray(calories, dtype=float)
+        self.speed = np.asarray(speed, dtype=float)
+
+    @classmethod
+    def from_runs(cls, runs):
+        return cls(_column(runs, 'activity_date', 'datetime64[D]'),
+                   _column(runs, 'distance'),
+                   _column(runs, 'duration'),
+                   _column(runs, 'calories'),
+                   _column(runs, 'speed'))
+
+    def __len__(self):
+        return len(self.distance)
+
+    def speeds(self):
+        """
+        The stored speed of each run, else its distance over its duration,
+        NaN when neither is known.
+        """
+        # Like run_speed: a zero or missing duration gives no speed.
+        computable = ~np.isnan(self.distance) & (np.nan_to_num(self.duration) != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            computed = np.where(computable, self.distance / (self.duration / 60.0), np.nan)
+        return np.where(np.isnan(self.speed), computed, self.speed)
+
+    def totals(self):
+        speeds = self.speeds()
+        known = speeds[~np.isnan(speeds)]
+        calories = np.nan_to_num(self.calories)
+        distance = np.nan_to_num(self.distance)
+        duration = np.nan_to_num(self.duration)
+        dates = self.activity_date[~np.isnat(self.activity_date)]
+        return {
+            'count': len(self),
+            'total_calories': int(calories.sum()),
+            'total_distance': float(distance.sum()),
+            'total_time': int(duration.sum()),
+            'speed_total': float(known.sum()),
+            'speed_count': int(known.size),
+            'max_calories': int(max(0, calories.max(initial=0))),
+            'max_distance': float(max(0.0, distance.max(initial=0.0))),
+            'max_speed': float(max(0.0, known.max(initial=0.0))),
+            'max_time': int(max(0, duration.max(initial=0))),
+            'date_last_run': _iso(dates.max()) if dates.size else None,
+        }
+
+
+class ActivityColumns(object):
+    """
+    The sessions of a countable activity as NumPy arrays, the counterpart
+    of RunColumns for ActivityTotals.
+    """
+
+    def __init__(self, activity_date, repetitions, duration, calories):
+        self.activity_date = np.asarray(activity_date, dtype='datetime64[D]')
+        self.repetitions = np.asarray(repetitions, dtype=float)
+        self.duration = np.asarray(duration, dtype=float)
+        self.calories = np.asarray(calories, dtype=float)
+
+    @classmethod
+    def from_activities(cls, activities):
+        return cls(_column(activities, 'activity_date', 'datetime64[D]'),
+                   _column(activities, 'count'),
+                   _column(activities, 'duration'),
+                   _column(activities, 'calories'))
+
+    def __len__(self):
+        return len(self.repetitions)
+
+    def totals(self):
+        repetitions = np.nan_to_num(self.repetitions)
+        duration = np.nan_to_num(self.duration)
+        # Like session_rate: a zero or missing duration gives no rate.
+        timed = duration != 0
+        rates = repetitions[timed] / duration[timed]
+        dates = self.activity_date[~np.isnat(self.activity_date)]
+        return {
+            'count': len(self),
+            'total_repetitions': int(repetitions.sum()),
+            'total_time': int(duration.sum()),
+            'total_calories': int(np.nan_to_num(self.calories).sum()),
+            'timed_repetitions': int(repetitions[timed].sum()),
+            'timed_time': int(duration[timed].sum()),
+            'max_repetitions': int(max(0, repetitions.max(initial=0))),
+            'max_rate': float(max(0.0, rates.max(initial=0.0))),
+            'max_time': int(max(0, duration.max(initial=0))),
+            'date_last': _iso(dates.max()) if dates.size else None,
+        }
+
+
+class WeightColumns(object):
+    """
+    The weighings of a user as NumPy arrays, the counterpart of RunColumns
+    for WeighingTotals.
+    """
+
+    def __init__(self, weighing_date, weight, ids):
+        self.weighing_date = np.asarray(weighing_date, dtype='datetime64[D]')
+        self.weight = np.asarray(weight, dtype=float)
+        self.ids = list(ids)
+
+    @classmethod
+    def from_weighings(cls, weighings):
+        return cls(_column(weighings, 'weighing_date', 'datetime64[D]'),
+                   _column(weighings, 'weight'),
+                   [item.key.id() if item.key else None for item in weighings])
+
+    def __len__(self):
+        return len(self.weight)
+
+    def recent(self, count=RECENT_WEIGHINGS):
+        """
+        The ``count`` latest weighings with a weight as [date, weight, id],
+        newest first; weighings of the same day keep their order.
+        """
+        indexes = np.flatnonzero(~np.isnan(self.weight))
+        days = self.weighing_date[indexes]
+        # Undated weighings sort last, like their empty ISO date.
+        keys = np.where(np.isnat(days), np.iinfo(np.int64).min + 1, days.astype(np.int64))
+        latest = indexes[np.argsort(-keys, kind='stable')[:count]]
+        return [[_iso(self.weighing_date[i]), float(self.weight[i]), self.ids[i]] for i in latest]
+
+    def trend(self):
+        """
+        The WeightTrend of the dated weighings with a weight, in date order;
+        weighings of the same day keep their order.
+        """
+        indexes = np.flatnonzero(~np.isnan(self.weight) & ~np.isnat(self.weighing_date))
+        if not indexes.size:
+            return WeightTrend()
+        indexes = indexes[np.argsort(self.weighing_date[indexes], kind='stable')]
+        days = self.weighing_date[indexes].astype(np.int64)
+        weights = self.weight[indexes]
+        # The moving average in closed form: each weighing counts by its
+        # smoothing factor times the decay of every later gap, the decays
+        # being halved per HALF_LIFE_DAYS and gaps counting one day at least.
+        elapsed = np.concatenate(([0], np.cumsum(np.maximum(np.diff(days), 1))))
+        later_decay = 0.5 ** ((elapsed[-1] - elapsed) / HALF_LIFE_DAYS)
+        factors = np.concatenate(([1.0], 1.0 - 0.5 ** (np.diff(elapsed) / HALF_LIFE_DAYS)))
+        smoothed = float(np.sum(factors * later_decay * weights))
+        window = [[int(day - days[0]), float(weight)]
+                  for day, weight in zip(days[-REGRESSION_WINDOW:], weights[-REGRESSION_WINDOW:])]
+        first, last = self.weighing_date[indexes[[0, -1]]].astype(object)
+        return WeightTrend.from_window(first, last, smoothed, window)
+
+    def totals(self):
+        weights = self.weight[~np.isnan(self.weight)]
+        return {
+            'count': len(self),
+            'weight_count': int(weights.size),
+            'weight_total': float(weights.sum()),
+            'max': float(weights.max()) if weights.size else None,
+            'min': float(weights.min()) if weights.size else None,
+            'recent': self.recent(),
+            'trend': self.trend().to_dict(),
+        }
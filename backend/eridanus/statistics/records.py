@@ -0,0 +1,180 @@
+import heapq
+import logging
+
+from google.cloud import ndb
+
+from eridanus.listeners import WriteListener, usernames
+from eridanus.models import Activity, PersonalRecords
+from eridanus.statistics.user_stats import KINDS, kind_of, run_speed, session_rate
+
+logger = logging.getLogger(__name__)
+
+# Records shown for every metric.
+TOP_RECORDS = 5
+
+# Entries kept for every metric. The extra ones take the place of deleted
+# records, so the index only needs a rebuild after many deletions.
+KEPT_RECORDS = 2 * TOP_RECORDS
+
+METRICS = {kind: ('distance', 'duration', 'speed', 'calories') if kind == 'running'
+           else ('repetitions', 'duration', 'rate', 'calories')
+           for kind in KINDS}
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _rank(entry):
+    """
+    Sort key of a [value, id, date] entry: the best value first, then the
+    earliest date and the smallest id, so that the first activity to reach
+    a value holds the record whatever order the activities came in.
+    """
+    value, identifier, day = entry
+    return -value, day is None, day or '', identifier
+
+
+def metrics(activity):
+    """
+    The value of every record metric of an activity, None when unknown.
+    """
+    if kind_of(type(activity)) == 'running':
+        return {'distance': activity.distance, 'duration': activity.duration,
+                'speed': run_speed(activity), 'calories': activity.calories}
+    return {'repetitions': activity.count, 'duration': activity.duration,
+            'rate': session_rate(activity), 'calories': activity.calories}
+
+
+class RecordList(object):
+    """
+    The best entries of one metric as [value, id, date] triples, in the
+    order of ``_rank``. The entries are always the
+    exact best ones of the user; ``truncated`` tells that other activities
+    have a value too.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.entries = [list(item) for item in data.get('entries', [])]
+        self.truncated = data.get('truncated', False)
+
+    def add(self, value, identifier, day):
+        if not value:
+            return
+        entry = [value, identifier, _iso(day)]
+        # The activities left out of a truncated list may rank before this
+        # one, which would then not be one of the best entries.
+        if self.truncated and self.entries and _rank(entry) > _rank(self.entries[-1]):
+            return
+        self.entries.append(entry)
+        self.entries.sort(key=_rank)
+        if len(self.entries) > KEPT_RECORDS:
+            del self.entries[KEPT_RECORDS:]
+            self.truncated = True
+
+    def remove(self, identifier):
+        """
+        :return: False when the list no longer holds TOP_RECORDS entries
+            while other activities were left out, meaning a rebuild.
+        """
+        self.entries = [item for item in self.entries if item[1] != identifier]
+        return not (self.truncated and len(self.entries) < TOP_RECORDS)
+
+    def to_dict(self):
+        return {'entries': self.entries, 'truncated': self.truncated}
+
+
+class Records(object):
+    """
+    The RecordList of every metric of every kind of a user.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.lists = {kind: {metric: RecordList(data.get(kind, {}).get(metric)) for metric in names}
+                      for kind, names in METRICS.items()}
+
+    @classmethod
+    def build(cls, activities):
+        """
+        Builds the records from the full history of a user.
+        :param activities: The activities of each kind, by kind.
+        """
+        records = cls()
+        for kind, items in activities.items():
+            values = [(metrics(item), item.key.id(), _iso(item.activity_date)) for item in items]
+            for metric, record_list in records.lists[kind].items():
+                candidates = [[metric_values[metric], identifier, day]
+                              for metric_values, identifier, day in values if metric_values[metric]]
+                record_list.entries = heapq.nsmallest(KEPT_RECORDS, candidates, key=_rank)
+                record_list.truncated = len(candidates) > KEPT_RECORDS
+        return records
+
+    def add(self, activity):
+        lists = self.lists[kind_of(type(activity))]
+        for metric, value in metrics(activity).items():
+            lists[metric].add(value, activity.key.id(), activity.activity_date)
+
+    def remove(self, activity):
+        lists = self.lists[kind_of(type(activity))]
+        exact = [record_list.remove(activity.key.id()) for record_list in lists.values()]
+        return all(exact)
+
+    def top(self, kind, metric, count=TOP_RECORDS):
+        """
+        The best ``count`` entries of a metric as dicts of value, id and date.
+        """
+        return [{'value': value, 'id': identifier, 'date': day}
+                for value, identifier, day in self.lists[kind][metric].entries[:count]]
+
+    def best(self, kind, metric, default=0):
+        entries = self.lists[kind][metric].entries
+        return entries[0][0] if entries else default
+
+    def to_dict(self):
+        return {kind: {metric: record_list.to_dict() for metric, record_list in lists.items()}
+                for kind, lists in self.lists.items()}
+
+
+class RecordsListener(WriteListener):
+    """
+    Applies each activity write to the PersonalRecords of its user: the
+    previous values of an activity leave the lists and the new ones enter
+    them, so an edited or deleted record holder gives way to the next best
+    activity.
+    """
+
+    kinds = (Activity,)
+
+    def keys(self, changes):
+        return [ndb.Key(PersonalRecords, name) for name in sorted(usernames(changes))]
+
+    def apply(self, changes, entities):
+        keys = self.keys(changes)
+        if not keys:
+            return
+        indexes = {}
+        for key in keys:
+            # Records of a user seen for the first time may predate the
+            # index, they are rebuilt on their first read.
+            indexes[key.id()] = entities.get(key) or PersonalRecords(key=key, records={}, stale=True)
+        records = {name: Records(entity.records) for name, entity in indexes.items()}
+
+        for before, after in changes:
+            if before is not None and before.usernickname:
+                if not records[before.usernickname].remove(before):
+                    indexes[before.usernickname].stale = True
+            if after is not None and after.usernickname:
+                records[after.usernickname].add(after)
+
+        for name, entity in indexes.items():
+            entity.records = records[name].to_dict()
+            entity.revision = (entity.revision or 0) + 1
+        ndb.put_multi(list(indexes.values()))
+
+    def invalidate(self, username):
+        entity = PersonalRecords.get_by_id(username)
+        if entity is not None and not entity.stale:
+            entity.stale = True
+            entity.put()
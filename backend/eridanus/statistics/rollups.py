@@ -0,0 +1,191 @@
+import logging
+from datetime import date, timedelta
+
+from google.cloud import ndb
+
+from eridanus.listeners import WriteListener, usernames
+from eridanus.models import Activity, ActivityRollup, RollupState, Run
+from eridanus.statistics.user_stats import kind_of
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('week', 'month', 'year')
+
+# Totals kept for every bucket. Repetitions are the ``count`` of the push
+# ups, crunches and jumps, distance the kilometres of the runs.
+FIELDS = ('count', 'distance', 'duration', 'calories', 'repetitions')
+
+
+def bucket(day, period):
+    """
+    The label of the bucket of a day: '2025-W11' for ISO weeks, '2025-03'
+    for months and '2025' for years.
+    """
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year}-W{week:02d}'
+    if period == 'month':
+        return f'{day.year}-{day.month:02d}'
+    if period == 'year':
+        return str(day.year)
+    raise ValueError(f"Unknown period '{period}'.")
+
+
+def bucket_start(label):
+    """
+    The first day of a bucket.
+    """
+    if '-W' in label:
+        year, week = label.split('-W')
+        return date.fromisocalendar(int(year), int(week), 1)
+    if '-' in label:
+        year, month = label.split('-')
+        return date(int(year), int(month), 1)
+    return date(int(label), 1, 1)
+
+
+def last_buckets(period, count, day):
+    """
+    The labels of the ``count`` buckets of a period ending with the one
+    holding ``day``, oldest first.
+    """
+    labels = []
+    start = bucket_start(bucket(day, period))
+    for _ in range(count):
+        labels.append(bucket(start, period))
+        # The day before a bucket falls in the previous one.
+        start = bucket_start(bucket(start - timedelta(days=1), period))
+    return labels[::-1]
+
+
+def bucket_year(label):
+    # Weeks are stored with the ISO year they belong to.
+    return int(label[:4])
+
+
+def rollup_key(username, kind, year):
+    return ndb.Key(ActivityRollup, f'{username}:{kind}:{year}')
+
+
+def empty_totals():
+    totals = {field: 0 for field in FIELDS}
+    totals['distance'] = 0.0
+    return totals
+
+
+def _contribution(activity):
+    run = isinstance(activity, Run)
+    return {
+        'count': 1,
+        'distance': (activity.distance or 0.0) if run else 0.0,
+        'duration': activity.duration or 0,
+        'calories': activity.calories or 0,
+        'repetitions': 0 if run else activity.count or 0,
+    }
+
+
+def accumulate(rollups, username, activity, sign=1):
+    """
+    Adds an activity of a user to (or with ``sign`` -1 removes it from) the
+    totals of its week, month and year. ``rollups`` maps (username, kind,
+    year) to dicts of bucket totals and is filled as needed.
+    """
+    kind = kind_of(type(activity))
+    if kind is None or not activity.activity_date or not username:
+        return
+    values = _contribution(activity)
+    for period in PERIODS:
+        label = bucket(activity.activity_date, period)
+        buckets = rollups.setdefault((username, kind, bucket_year(label)), {})
+        totals = buckets.setdefault(label, empty_totals())
+        for field in FIELDS:
+            totals[field] += sign * values[field]
+
+
+def _merged(buckets, deltas):
+    merged = {label: dict(totals) for label, totals in (buckets or {}).items()}
+    for label, delta in deltas.items():
+        totals = merged.setdefault(label, empty_totals())
+        for field in FIELDS:
+            totals[field] = totals.get(field, 0) + delta[field]
+        # An empty bucket is dropped, which also clears any rounding left
+        # over from adding and removing distances.
+        if totals['count'] <= 0:
+            del merged[label]
+    return merged
+
+
+def build(username, activities):
+    """
+    Builds every ActivityRollup of a user from their full history.
+    :param activities: The activities of all kinds, possibly projected
+        without their nickname.
+    """
+    rollups = {}
+    for activity in activities:
+        accumulate(rollups, username, activity)
+    return [ActivityRollup(key=rollup_key(name, kind, year), usernickname=name, kind=kind,
+                           year=year, buckets=buckets)
+            for (name, kind, year), buckets in sorted(rollups.items())]
+
+
+class RollupListener(WriteListener):
+    """
+    Applies each activity write to the week, month and year totals of its
+    user. Sums and counts are exact under add and remove, so unlike
+    UserStats the rollups never need a rebuild after a delete.
+    """
+
+    kinds = (Activity,)
+
+    def _deltas(self, changes):
+        deltas = {}
+        for before, after in changes:
+            if before is not None:
+                accumulate(deltas, before.usernickname, before, -1)
+            if after is not None:
+                accumulate(deltas, after.usernickname, after)
+        return deltas
+
+    def keys(self, changes):
+        names = sorted(usernames(changes))
+        if not names:
+            return []
+        return ([rollup_key(*identifier) for identifier in self._deltas(changes)]
+                + [ndb.Key(RollupState, name) for name in names])
+
+    def apply(self, changes, entities):
+        names = sorted(usernames(changes))
+        if not names:
+            return
+
+        deltas = self._deltas(changes)
+        keys = [rollup_key(*identifier) for identifier in deltas]
+        state_keys = [ndb.Key(RollupState, name) for name in names]
+        puts, deletes = [], []
+        for key, (identifier, delta) in zip(keys, deltas.items()):
+            entity = entities.get(key)
+            name, kind, year = identifier
+            if entity is None:
+                entity = ActivityRollup(key=key, usernickname=name, kind=kind, year=year)
+            entity.buckets = _merged(entity.buckets, delta)
+            if entity.buckets:
+                puts.append(entity)
+            else:
+                deletes.append(key)
+
+        for key in state_keys:
+            # The rollups of a user seen for the first time may predate
+            # them, they are rebuilt on their first read.
+            state = entities.get(key) or RollupState(key=key, stale=True)
+            state.revision = (state.revision or 0) + 1
+            puts.append(state)
+        ndb.put_multi(puts)
+        if deletes:
+            ndb.delete_multi(deletes)
+
+    def invalidate(self, username):
+        state = RollupState.get_by_id(username) or RollupState(id=username)
+        if not state.stale:
+            state.stale = True
+            state.put()
@@ -0,0 +1,139 @@
+import math
+from datetime import date, timedelta
+
+# Days after which a weighing counts half as much in the smoothed weight.
+HALF_LIFE_DAYS = 7.0
+
+# The regression slope is fitted on the last 20 weighings, the window of
+# the other "last 20" statistics.
+REGRESSION_WINDOW = 20
+
+# Target dates further away than this are not projected.
+MAX_PROJECTION_DAYS = 3 * 365
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _date(value):
+    return date.fromisoformat(value) if value else None
+
+
+class WeightTrend(object):
+    """
+    The weight trend of a user, updated in constant time as each weighing
+    arrives in date order.
+
+    ``smoothed`` is an exponentially weighted moving average whose weights
+    halve every HALF_LIFE_DAYS days, so irregular weighings are handled;
+    weighings of the same day count as a day apart. ``slope`` is the least
+    squares slope of the weight over the days of the last REGRESSION_WINDOW
+    weighings, kept as running sums which are updated as weighings enter
+    and leave the window.
+
+    A weighing older than the last one, or a removed weighing, cannot be
+    applied in constant time: ``add`` and ``remove`` then return False and
+    the trend must be rebuilt, like the other totals.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        # Days are counted from the first weighing, keeping the sums small.
+        self.origin = _date(data.get('origin'))
+        self.last_date = _date(data.get('last_date'))
+        self.smoothed = data.get('smoothed')
+        # [day, weight] pairs of the regression window, oldest first.
+        self.window = [list(item) for item in data.get('window', [])]
+        self.sum_x = data.get('sum_x', 0.0)
+        self.sum_y = data.get('sum_y', 0.0)
+        self.sum_xx = data.get('sum_xx', 0.0)
+        self.sum_xy = data.get('sum_xy', 0.0)
+
+    @classmethod
+    def from_window(cls, origin, last_date, smoothed, window):
+        """
+        Builds the trend of a history whose smoothed weight was computed in
+        one pass, from the [day, weight] pairs of its regression window.
+        """
+        trend = cls({'origin': _iso(origin), 'last_date': _iso(last_date), 'smoothed': smoothed})
+        for x, weight in window[-REGRESSION_WINDOW:]:
+            trend.window.append([x, weight])
+            trend._update_sums(x, weight, 1)
+        return trend
+
+    def add(self, weighing):
+        if weighing.weight is None or weighing.weighing_date is None:
+            return True
+        if self.last_date is not None and weighing.weighing_date < self.last_date:
+            return False
+        self._add(weighing.weighing_date, weighing.weight)
+        return True
+
+    def remove(self, weighing):
+        return weighing.weight is None or weighing.weighing_date is None
+
+    def _add(self, day, weight):
+        if self.origin is None:
+            self.origin = day
+        if self.smoothed is None:
+            self.smoothed = weight
+        else:
+            days = max((day - self.last_date).days, 1)
+            alpha = 1.0 - 0.5 ** (days / HALF_LIFE_DAYS)
+            self.smoothed += alpha * (weight - self.smoothed)
+        self.last_date = day
+
+        x = (day - self.origin).days
+        self.window.append([x, weight])
+        self._update_sums(x, weight, 1)
+        while len(self.window) > REGRESSION_WINDOW:
+            self._update_sums(*self.window.pop(0), -1)
+
+    def _update_sums(self, x, y, sign):
+        self.sum_x += sign * x
+        self.sum_y += sign * y
+        self.sum_xx += sign * x * x
+        self.sum_xy += sign * x * y
+
+    @property
+    def slope(self):
+        """
+        The change of weight in kg per day, None with fewer than two days
+        in the window.
+        """
+        n = len(self.window)
+        denominator = n * self.sum_xx - self.sum_x * self.sum_x
+        if n < 2 or denominator <= 0:
+            return None
+        return (n * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+    @property
+    def slope_per_week(self):
+        slope = self.slope
+        return slope * 7.0 if slope is not None else None
+
+    def projected_date(self, target):
+        """
+        The day the smoothed weight reaches ``target`` at the current slope,
+        None when it moves away from it or would take too long.
+        """
+        slope = self.slope
+        if self.smoothed is None or target is None or not slope:
+            return None
+        days = (target - self.smoothed) / slope
+        if days < 0 or days > MAX_PROJECTION_DAYS:
+            return None
+        return self.last_date + timedelta(days=math.ceil(days))
+
+    def to_dict(self):
+        return {
+            'origin': _iso(self.origin),
+            'last_date': _iso(self.last_date),
+            'smoothed': self.smoothed,
+            'window': self.window,
+            'sum_x': self.sum_x,
+            'sum_y': self.sum_y,
+            'sum_xx': self.sum_xx,
+            'sum_xy': self.sum_xy,
+        }
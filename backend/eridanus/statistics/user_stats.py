@@ -0,0 +1,373 @@
+import logging
+from datetime import date
+
+from google.cloud import ndb
+
+from eridanus.listeners import WriteListener, usernames
+from eridanus.models import Crunch, JumpRope, PushUp, Run, UserStats, Weight
+from eridanus.statistics.engine import RECENT_WEIGHINGS, ActivityColumns, RunColumns, WeightColumns
+from eridanus.statistics.trend import WeightTrend
+
+logger = logging.getLogger(__name__)
+
+KINDS = {'running': Run, 'pushups': PushUp, 'crunches': Crunch, 'jump_rope': JumpRope}
+
+# The activities measured in repetitions: the kinds of the Activity
+# hierarchy with a ``count``.
+COUNTABLE = {kind: model_class for kind, model_class in KINDS.items() if 'count' in model_class._properties}
+
+# Properties read when rebuilding the aggregates, with projection queries;
+# the same projections and orders as the list pages, so they use the same
+# indexes. Runs are read whole: projecting ``speed`` would miss the runs
+# saved before it existed, and leaving it out would derive every speed
+# where the writes use the stored one, see run_speed.
+ACTIVITY_FIELDS = ('activity_date', 'activity_time', 'calories', 'count', 'duration')
+WEIGHT_FIELDS = ('weighing_date', 'weight')
+
+
+def kind_of(model_class):
+    for kind, kind_class in KINDS.items():
+        if issubclass(model_class, kind_class):
+            return kind
+    return None
+
+
+def fields_of(kind):
+    """
+    The properties to project when reading a whole history of ``kind``,
+    None to read the entities.
+    """
+    return None if kind == 'running' else ACTIVITY_FIELDS
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def run_speed(run):
+    """
+    The stored speed of a run, else its distance over its duration. This is
+    the rule of every aggregate, record and list, whichever path reads the
+    run; a projection without ``speed`` can only derive it.
+    """
+    projected = not run._projection or 'speed' in run._projection
+    if projected and run.speed is not None:
+        return run.speed
+    if run.distance is not None and run.duration:
+        return run.distance / (run.duration / 60.0)
+    return None
+
+
+def session_rate(activity):
+    """
+    The repetitions per minute of a countable activity, None without a
+    duration.
+    """
+    if activity.duration:
+        return (activity.count or 0) / float(activity.duration)
+    return None
+
+
+class RunningTotals(object):
+    """
+    Running aggregates which can be updated one run at a time.
+
+    Sums and counts are exact under add and remove. Maxima and the last run
+    date are not: removing the run which holds one of them returns False,
+    meaning the totals must be rebuilt from the runs.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.count = data.get('count', 0)
+        self.total_calories = data.get('total_calories', 0)
+        self.total_distance = data.get('total_distance', 0.0)
+        self.total_time = data.get('total_time', 0)
+        self.speed_total = data.get('speed_total', 0.0)
+        self.speed_count = data.get('speed_count', 0)
+        self.max_calories = data.get('max_calories', 0)
+        self.max_distance = data.get('max_distance', 0.0)
+        self.max_speed = data.get('max_speed', 0.0)
+        self.max_time = data.get('max_time', 0)
+        self.date_last_run = _date(data.get('date_last_run'))
+
+    def add(self, run):
+        speed = run_speed(run)
+        self.count += 1
+        self.total_calories += run.calories or 0
+        self.total_distance += run.distance or 0.0
+        self.total_time += run.duration or 0
+        if speed is not None:
+            self.speed_total += speed
+            self.speed_count += 1
+            self.max_speed = max(self.max_speed, speed)
+        self.max_calories = max(self.max_calories, run.calories or 0)
+        self.max_distance = max(self.max_distance, run.distance or 0.0)
+        self.max_time = max(self.max_time, run.duration or 0)
+        if run.activity_date and (self.date_last_run is None or run.activity_date > self.date_last_run):
+            self.date_last_run = run.activity_date
+        return True
+
+    def remove(self, run):
+        speed = run_speed(run)
+        self.count -= 1
+        self.total_calories -= run.calories or 0
+        self.total_distance -= run.distance or 0.0
+        self.total_time -= run.duration or 0
+        if speed is not None:
+            self.speed_total -= speed
+            self.speed_count -= 1
+        held_record = (
+            (speed is not None and speed >= self.max_speed)
+            or (run.calories or 0) >= self.max_calories > 0
+            or (run.distance or 0.0) >= self.max_distance > 0
+            or (run.duration or 0) >= self.max_time > 0
+            or (run.activity_date is not None and run.activity_date == self.date_last_run))
+        return self.count == 0 or not held_record
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_calories': self.total_calories,
+            'total_distance': self.total_distance,
+            'total_time': self.total_time,
+            'speed_total': self.speed_total,
+            'speed_count': self.speed_count,
+            'max_calories': self.max_calories,
+            'max_distance': self.max_distance,
+            'max_speed': self.max_speed,
+            'max_time': self.max_time,
+            'date_last_run': _iso(self.date_last_run),
+        }
+
+
+class WeighingTotals(object):
+    """
+    Weighing aggregates which can be updated one weighing at a time, with
+    the same exactness rules as RunningTotals. The most recent weighings
+    are kept as [date, weight, id] triples, newest first, and the weight
+    trend along with them; as the trend cannot forget a weighing, removing
+    one with a weight always means a rebuild.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.count = data.get('count', 0)
+        self.weight_count = data.get('weight_count', 0)
+        self.weight_total = data.get('weight_total', 0.0)
+        self.max = data.get('max')
+        self.min = data.get('min')
+        self.recent = [list(item) for item in data.get('recent', [])]
+        self.trend = WeightTrend(data.get('trend'))
+
+    @staticmethod
+    def _identifier(weighing):
+        return weighing.key.id() if weighing.key else None
+
+    def add(self, weighing):
+        self.count += 1
+        if weighing.weight is None:
+            return True
+        in_order = self.trend.add(weighing)
+        self.weight_count += 1
+        self.weight_total += weighing.weight
+        self.max = weighing.weight if self.max is None else max(self.max, weighing.weight)
+        self.min = weighing.weight if self.min is None else min(self.min, weighing.weight)
+        entry = [_iso(weighing.weighing_date), weighing.weight, self._identifier(weighing)]
+        self.recent.append(entry)
+        self.recent.sort(key=lambda item: item[0] or '', reverse=True)
+        del self.recent[RECENT_WEIGHINGS:]
+        return in_order
+
+    def remove(self, weighing):
+        self.count -= 1
+        if weighing.weight is None:
+            return True
+        was_full = len(self.recent) >= RECENT_WEIGHINGS
+        self.weight_count -= 1
+        self.weight_total -= weighing.weight
+        identifier = self._identifier(weighing)
+        recent = [item for item in self.recent if item[2] != identifier]
+        removed_recent = len(recent) != len(self.recent)
+        self.recent = recent
+        if self.weight_count == 0:
+            self.max = self.min = None
+            self.trend = WeightTrend()
+            return True
+        held_record = weighing.weight >= self.max or weighing.weight <= self.min
+        exact = self.trend.remove(weighing)
+        return exact and not held_record and not (removed_recent and was_full)
+
+    @property
+    def last_weight(self):
+        return self.recent[0][1] if self.recent else None
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'weight_count': self.weight_count,
+            'weight_total': self.weight_total,
+            'max': self.max,
+            'min': self.min,
+            'recent': self.recent,
+            'trend': self.trend.to_dict(),
+        }
+
+
+class ActivityTotals(object):
+    """
+    Aggregates of any countable activity, updated one session at a time
+    with the same exactness rules as RunningTotals. The rate is the
+    repetitions per minute of the sessions with a duration.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.count = data.get('count', 0)
+        self.total_repetitions = data.get('total_repetitions', 0)
+        self.total_time = data.get('total_time', 0)
+        self.total_calories = data.get('total_calories', 0)
+        self.timed_repetitions = data.get('timed_repetitions', 0)
+        self.timed_time = data.get('timed_time', 0)
+        self.max_repetitions = data.get('max_repetitions', 0)
+        self.max_rate = data.get('max_rate', 0.0)
+        self.max_time = data.get('max_time', 0)
+        self.date_last = _date(data.get('date_last'))
+
+    def add(self, activity):
+        rate = session_rate(activity)
+        self.count += 1
+        self.total_repetitions += activity.count or 0
+        self.total_time += activity.duration or 0
+        self.total_calories += activity.calories or 0
+        if rate is not None:
+            self.timed_repetitions += activity.count or 0
+            self.timed_time += activity.duration
+            self.max_rate = max(self.max_rate, rate)
+        self.max_repetitions = max(self.max_repetitions, activity.count or 0)
+        self.max_time = max(self.max_time, activity.duration or 0)
+        if activity.activity_date and (self.date_last is None or activity.activity_date > self.date_last):
+            self.date_last = activity.activity_date
+        return True
+
+    def remove(self, activity):
+        rate = session_rate(activity)
+        self.count -= 1
+        self.total_repetitions -= activity.count or 0
+        self.total_time -= activity.duration or 0
+        self.total_calories -= activity.calories or 0
+        if rate is not None:
+            self.timed_repetitions -= activity.count or 0
+            self.timed_time -= activity.duration
+        held_record = (
+            (rate is not None and rate >= self.max_rate > 0)
+            or (activity.count or 0) >= self.max_repetitions > 0
+            or (activity.duration or 0) >= self.max_time > 0
+            or (activity.activity_date is not None and activity.activity_date == self.date_last))
+        return self.count == 0 or not held_record
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_repetitions': self.total_repetitions,
+            'total_time': self.total_time,
+            'total_calories': self.total_calories,
+            'timed_repetitions': self.timed_repetitions,
+            'timed_time': self.timed_time,
+            'max_repetitions': self.max_repetitions,
+            'max_rate': self.max_rate,
+            'max_time': self.max_time,
+            'date_last': _iso(self.date_last),
+        }
+
+
+# Where the aggregates of each kind are kept: a UserStats property, and for
+# the countable activities the key of their totals in ``activities``.
+TOTALS = {Run: ('running', None, RunningTotals), Weight: ('weighing', None, WeighingTotals)}
+TOTALS.update({model_class: ('activities', kind, ActivityTotals) for kind, model_class in COUNTABLE.items()})
+
+
+def _totals_for(model_class):
+    for kind, totals in TOTALS.items():
+        if issubclass(model_class, kind):
+            return totals
+    return None
+
+
+def needs_rebuild(stats):
+    """
+    Whether UserStats are missing, stale or older than the aggregates of
+    the countable activities or the weight trend.
+    """
+    return (stats is None or stats.stale or stats.activities is None
+            or 'trend' not in (stats.weighing or {}))
+
+
+def build(username, runs, weighings, activities=None, revision=0):
+    """
+    Builds the UserStats of a user from the full list of runs, weighings
+    and countable activities, with the vectorized engine rather than one
+    add per entity.
+    :param activities: The sessions of each countable kind, by kind.
+    """
+    activities = activities or {}
+    running = RunColumns.from_runs(runs).totals()
+    weighing = WeightColumns.from_weighings(weighings).totals()
+    countable = {kind: ActivityColumns.from_activities(activities.get(kind, [])).totals()
+                 for kind in COUNTABLE}
+    return UserStats(id=username, running=running, weighing=weighing, activities=countable,
+                     stale=False, revision=revision)
+
+
+class UserStatsListener(WriteListener):
+    """
+    Applies each run, weighing and countable activity write to the
+    UserStats of its user.
+    """
+
+    kinds = tuple(TOTALS)
+
+    def keys(self, changes):
+        return [ndb.Key(UserStats, name) for name in sorted(usernames(changes))]
+
+    def apply(self, changes, entities):
+        keys = self.keys(changes)
+        if not keys:
+            return
+        stats = {}
+        for key in keys:
+            entity = entities.get(key) or UserStats(key=key, running={}, weighing={}, activities={}, stale=True)
+            # UserStats built before the countable activities had aggregates
+            # are only complete once rebuilt.
+            entity.stale = needs_rebuild(entity)
+            stats[key.id()] = entity
+
+        for before, after in changes:
+            for entity, add in ((before, False), (after, True)):
+                if entity is None or not entity.usernickname:
+                    continue
+                user_stats = stats[entity.usernickname]
+                attribute, kind, totals_class = _totals_for(type(entity))
+                data = getattr(user_stats, attribute) or {}
+                totals = totals_class(data.get(kind) if kind else data)
+                exact = totals.add(entity) if add else totals.remove(entity)
+                if kind:
+                    data = dict(data, **{kind: totals.to_dict()})
+                else:
+                    data = totals.to_dict()
+                setattr(user_stats, attribute, data)
+                user_stats.stale = user_stats.stale or not exact
+
+        for user_stats in stats.values():
+            user_stats.revision = (user_stats.revision or 0) + 1
+        ndb.put_multi(list(stats.values()))
+
+    def invalidate(self, username):
+        stats = UserStats.get_by_id(username)
+        if stats is not None and not stats.stale:
+            stats.stale = True
+            stats.put()
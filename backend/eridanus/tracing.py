@@ -0,0 +1,460 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import urllib.request
+
+from eridanus.settings import int_setting, setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OTLP_ENDPOINT = 'http://localhost:4318/v1/traces'
+DEFAULT_TRACE_FILE = 'traces.jsonl'
+
+# Traces waiting for the exporter thread; more are dropped.
+EXPORT_QUEUE_SIZE = 1000
+EXPORT_BATCH_SIZE = 50
+
+# Server-Timing entries per response, the header stays well below the
+# size proxies accept.
+MAX_SERVER_TIMINGS = 30
+
+# OTLP span kinds.
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+_TOKEN = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+# The (trace, span) pair of the code running, None when it is not traced.
+_current = contextvars.ContextVar('eridanus_trace', default=None)
+
+
+def enabled():
+    return bool(int_setting('TRACING', 0))
+
+
+class Span(object):
+    """
+    A timed stage of a traced request. Times are nanoseconds of the
+    performance counter, converted to wall time on export.
+    """
+
+    __slots__ = ('name', 'category', 'span_id', 'parent', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name, category, parent, attributes=None):
+        self.name = name
+        self.category = category
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.start = time.perf_counter_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    @property
+    def duration_ms(self):
+        end = self.end if self.end is not None else time.perf_counter_ns()
+        return (end - self.start) / 1e6
+
+    @property
+    def depth(self):
+        depth, parent = 0, self.parent
+        while parent is not None:
+            depth, parent = depth + 1, parent.parent
+        return depth
+
+
+class Trace(object):
+    """
+    The spans of one request, the root span first.
+    """
+
+    def __init__(self, name, attributes=None, traceparent=None):
+        match = _TRACEPARENT.match(traceparent or '')
+        # A request which is part of a distributed trace joins it.
+        self.trace_id = match.group(1) if match else os.urandom(16).hex()
+        self.remote_parent_id = match.group(2) if match else None
+        self.wall_start = time.time_ns()
+        self.root = Span(name, 'request', None, attributes)
+        self.spans = [self.root]
+        # The template spans being rendered, see instrument_templates.
+        self.rendering = []
+
+    def open(self, name, category, parent, attributes=None):
+        span = Span(name, category, parent, attributes)
+        self.spans.append(span)
+        return span
+
+    def finish(self):
+        if self.root.end is None:
+            self.root.end = time.perf_counter_ns()
+
+    def _wall(self, counter):
+        return self.wall_start + (counter - self.root.start)
+
+    def server_timing(self):
+        """
+        The Server-Timing header value: the total, then the time of each
+        span name summed over its calls, in the order they first ran.
+        """
+        totals = {}
+        for span in self.spans[1:]:
+            name = _TOKEN.sub('_', span.name)
+            duration, count = totals.get(name, (0.0, 0))
+            totals[name] = (duration + span.duration_ms, count + 1)
+        entries = [f'total;dur={self.root.duration_ms:.1f}']
+        for name, (duration, count) in list(totals.items())[:MAX_SERVER_TIMINGS - 1]:
+            entries.append(f'{name};dur={duration:.1f}' + (f';desc="x{count}"' if count > 1 else ''))
+        return ', '.join(entries)
+
+    def summary(self):
+        """
+        The spans as plain values, for the request log line.
+        """
+        return {
+            'trace_id': self.trace_id,
+            'spans': [{'name': span.name, 'category': span.category, 'depth': span.depth,
+                       'ms': round(span.duration_ms, 2)} for span in self.spans[1:]],
+        }
+
+    def to_otlp(self):
+        """
+        The spans in the OTLP JSON encoding of an ExportTraceServiceRequest.
+        """
+        spans = []
+        for span in self.spans:
+            if span.parent is not None:
+                parent_id = span.parent.span_id
+            else:
+                parent_id = self.remote_parent_id
+            item = {
+                'traceId': self.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': SPAN_KIND_SERVER if span is self.root else SPAN_KIND_INTERNAL,
+                'startTimeUnixNano': str(self._wall(span.start)),
+                'endTimeUnixNano': str(self._wall(span.end if span.end is not None else span.start)),
+                'attributes': _attributes(dict(span.attributes, **{'eridanus.category': span.category})),
+            }
+            if parent_id:
+                item['parentSpanId'] = parent_id
+            if span.error:
+                item['status'] = {'code': 2, 'message': span.error}
+            spans.append(item)
+        return {'resourceSpans': [{
+            'resource': {'attributes': _attributes({'service.name': setting('TRACING_SERVICE_NAME', 'eridanus')})},
+            'scopeSpans': [{'scope': {'name': 'eridanus.tracing'}, 'spans': spans}],
+        }]}
+
+
+def _attributes(values):
+    attributes = []
+    for key, value in values.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            encoded = {'boolValue': value}
+        elif isinstance(value, int):
+            encoded = {'intValue': str(value)}
+        elif isinstance(value, float):
+            encoded = {'doubleValue': value}
+        else:
+            encoded = {'stringValue': str(value)}
+        attributes.append({'key': key, 'value': encoded})
+    return attributes
+
+
+class _NoSpan(object):
+    """
+    What ``span`` returns outside a traced request: does nothing.
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _SpanContext(object):
+
+    __slots__ = ('name', 'category', 'attributes', 'span', 'token', 'deferred')
+
+    def __init__(self, name, category, attributes, deferred=False):
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.deferred = deferred
+
+    def __enter__(self):
+        trace, parent = _current.get()
+        self.span = trace.open(self.name, self.category, parent, self.attributes)
+        self.token = _current.set((trace, self.span))
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None or not self.deferred:
+            end_span(self.span, exc)
+        _current.reset(self.token)
+        return False
+
+
+def active():
+    return _current.get() is not None
+
+
+def span(name, category='code', **attributes):
+    """
+    Times the enclosed block as a child of the current span. Outside a
+    traced request it costs one context variable lookup.
+    """
+    if _current.get() is None:
+        return _NO_SPAN
+    return _SpanContext(name, category, attributes)
+
+
+def deferred_span(name, category='code', **attributes):
+    """
+    Like ``span``, except that the span stays open after the block when it
+    did not raise, for work which goes on in a future: ``end_span`` closes
+    it once the future resolved.
+    """
+    if _current.get() is None:
+        return _NO_SPAN
+    return _SpanContext(name, category, attributes, deferred=True)
+
+
+def end_span(span, error=None):
+    span.end = time.perf_counter_ns()
+    if error is not None:
+        span.error = f'{type(error).__name__}: {error}'
+
+
+def traced(category='service', name=None):
+    """
+    Decorator timing each call of a function as a span named after its
+    qualified name.
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return function(*args, **kwargs)
+            with _SpanContext(span_name, category, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace(name, traceparent=None, **attributes):
+    """
+    Starts tracing the code running in the current context, when tracing
+    is enabled.
+    :return: The Trace, None when tracing is disabled.
+    """
+    if not enabled():
+        return None
+    trace = Trace(name, attributes, traceparent)
+    _current.set((trace, trace.root))
+    return trace
+
+
+def finish_trace():
+    """
+    Ends the trace of the current context and hands it to the exporter.
+    :return: The finished Trace, None when there was none.
+    """
+    current = _current.get()
+    if current is None:
+        return None
+    _end_rendering(current[0])
+    _current.set(None)
+    trace = current[0]
+    trace.finish()
+    exporter = get_exporter()
+    if exporter is not None:
+        exporter.submit(trace)
+    return trace
+
+
+def _end_rendering(trace, error=None):
+    # A template which raised never sent template_rendered.
+    while trace.rendering:
+        trace.rendering.pop().__exit__(type(error) if error is not None else None, error, None)
+
+
+def instrument_templates(app):
+    """
+    Times every render_template of ``app`` with the Flask template signals.
+    The spans of templates which raised end with the request's exception,
+    or at the latest with the trace.
+    """
+    from flask import before_render_template, got_request_exception, template_rendered
+
+    def before(sender, template, context, **extra):
+        current = _current.get()
+        if current is not None:
+            rendering = _SpanContext(f'render:{template.name}', 'template', None)
+            rendering.__enter__()
+            current[0].rendering.append(rendering)
+
+    def rendered(sender, template, context, **extra):
+        current = _current.get()
+        if current is not None and current[0].rendering:
+            current[0].rendering.pop().__exit__(None, None, None)
+
+    def failed(sender, exception, **extra):
+        current = _current.get()
+        if current is not None:
+            _end_rendering(current[0], exception)
+
+    before_render_template.connect(before, app, weak=False)
+    template_rendered.connect(rendered, app, weak=False)
+    got_request_exception.connect(failed, app, weak=False)
+
+
+class FileExporter(object):
+    """
+    Appends each batch of traces to a file as one OTLP JSON line, the
+    format read by the collector's otlpjsonfile receiver.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, payload):
+        with open(self.path, 'a', encoding='utf-8') as stream:
+            stream.write(json.dumps(payload, separators=(',', ':')) + '\n')
+
+
+class OtlpHttpExporter(object):
+    """
+    Posts each batch of traces to an OpenTelemetry collector over OTLP/HTTP
+    with the JSON encoding.
+    """
+
+    def __init__(self, endpoint, timeout=5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, payload):
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchExporter(object):
+    """
+    Exports finished traces from a background thread, so a slow collector
+    never delays a response. Traces arriving while the queue is full are
+    dropped and counted.
+    """
+
+    def __init__(self, exporter, queue_size=EXPORT_QUEUE_SIZE, batch_size=EXPORT_BATCH_SIZE):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def submit(self, trace):
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Waits until every submitted trace was exported.
+        """
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            traces = [self.queue.get()]
+            while len(traces) < self.batch_size:
+                try:
+                    traces.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(_merge([trace.to_otlp() for trace in traces]))
+                self.exported += len(traces)
+            except Exception as exc:
+                self.failed += len(traces)
+                logger.warning(f'Could not export {len(traces)} traces: {exc}')
+            finally:
+                for _ in traces:
+                    self.queue.task_done()
+
+
+def _merge(payloads):
+    resource_spans = payloads[0]['resourceSpans'][0]
+    spans = resource_spans['scopeSpans'][0]['spans']
+    for payload in payloads[1:]:
+        spans.extend(payload['resourceSpans'][0]['scopeSpans'][0]['spans'])
+    return {'resourceSpans': [resource_spans]}
+
+
+def create_exporter():
+    """
+    Builds the exporter selected by the TRACING_EXPORTER setting: 'file'
+    (writes TRACING_FILE), 'otlp' (posts to TRACING_OTLP_ENDPOINT) or empty
+    to only emit the Server-Timing header and the log fields.
+    """
+    backend = (setting('TRACING_EXPORTER', '') or '').lower()
+    if backend == 'file':
+        return BatchExporter(FileExporter(setting('TRACING_FILE', DEFAULT_TRACE_FILE) or DEFAULT_TRACE_FILE))
+    if backend == 'otlp':
+        return BatchExporter(OtlpHttpExporter(
+            setting('TRACING_OTLP_ENDPOINT', DEFAULT_OTLP_ENDPOINT) or DEFAULT_OTLP_ENDPOINT))
+    if backend:
+        raise ValueError(f'Unknown TRACING_EXPORTER {backend!r}.')
+    return None
+
+
+_exporter = None
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """
+    Returns the trace exporter of the current process, or None when the
+    spans are not exported.
+    """
+    global _exporter, _exporter_pid
+    pid = os.getpid()
+    if _exporter_pid == pid:
+        return _exporter
+    with _exporter_lock:
+        if _exporter_pid != pid:
+            _exporter = create_exporter()
+            _exporter_pid = pid
+            if _exporter is not None:
+                atexit.register(_exporter.flush)
+        return _exporter
+
+
+def reset_exporter():
+    global _exporter, _exporter_pid
+    with _exporter_lock:
+        _exporter = None
+        _exporter_pid = None
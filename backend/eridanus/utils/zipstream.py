@@ -0,0 +1,57 @@
+import io
+import time
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """
+    A write-only, unseekable file which keeps what was written until it is
+    drained. ZipFile writes data descriptors after each member when it
+    cannot seek back, so nothing has to be kept once it is sent.
+    """
+
+    def __init__(self):
+        super(_ChunkBuffer, self).__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files, compression=ZIP_DEFLATED):
+    """
+    Builds a ZIP archive incrementally, yielding its bytes as they are
+    produced. Memory use depends on the size of the chunks, not on the
+    size of the archive.
+
+    :param files: An iterable of (filename, chunks) pairs, where chunks is
+        an iterable of the bytes of the file. Both are consumed lazily.
+    """
+    buffer = _ChunkBuffer()
+    with ZipFile(buffer, 'w', compression=compression) as archive:
+        for filename, chunks in files:
+            info = ZipInfo(filename, date_time=time.localtime()[:6])
+            info.compress_type = compression
+            info.create_system = 0
+            with archive.open(info, 'w') as member:
+                # The local header goes out before the first chunk is read.
+                yield from _drained(buffer)
+                for chunk in chunks:
+                    member.write(chunk)
+                    yield from _drained(buffer)
+    yield from _drained(buffer)
+
+
+def _drained(buffer):
+    data = buffer.drain()
+    if data:
+        yield data
@@ -18,8 +18,8 @@ service = WeighingService()
 @weighings.route("/list/")
 def index():
     username = session['nickname']
-    items = service.fetch_all(username)
-    logger.debug(f'Received the following items: {items}')
+    items = service.fetch_all(username, cursor=request.args.get('cursor'))
+    logger.debug('Received the following items: %s', items)
     return render_template('weighings/index.html', vm=items)
 
 
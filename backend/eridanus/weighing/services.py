@@ -1,45 +1,53 @@
 import logging
 
-from eridanus.repository import WeightRepository
+from eridanus.repository import StatisticsRepository, WeightRepository
 from eridanus.models import Weight
 from eridanus.services import CrudService
+from eridanus.tracing import traced
 from eridanus.utils.format import format_date
 
 logger = logging.getLogger(__name__)
 
+# Properties shown by the list page, read with a projection query.
+LIST_FIELDS = ('weighing_date', 'weight')
+
 class WeighingService(CrudService):
 
     def __init__(self):
         self.repository = WeightRepository()
+        self.statistics = StatisticsRepository()
 
-    def fetch_all(self, username):
-        min_weight = None
+    @traced()
+    def fetch_all(self, username, cursor=None, page_size=None):
         items = []
         # Use the NDB model property for ordering
-        models = self.repository.fetch_by_username(username, order=[-Weight.weighing_date])
-        
+        models, next_cursor = self.repository.fetch_page(
+            username, self.page_size(page_size), cursor=cursor, order=[-Weight.weighing_date],
+            projection=LIST_FIELDS)
+        # The minimum is over the whole history, not just this page
+        min_weight = self.statistics.weighing_stats(username).get('min')
+
         for model in models:
-            # Access attributes directly on the model object
-            if model.weight is not None:
-                if min_weight is None or min_weight > model.weight:
-                    min_weight = model.weight
-            
             items.append({
                 # Use the id() method to get the numeric/string identifier
                 'id': model.key.id(),
                 'weight': model.weight,
                 'weighing_date': format_date(model.weighing_date)
             })
-        return {'items': items, 'min_weight': min_weight}
+        return {'items': items, 'min_weight': min_weight, 'next_cursor': next_cursor}
 
+    @traced()
     def create(self, weighing):
         return self.repository.create(weighing)
 
+    @traced()
     def read(self, id):
         return self.repository.read(id)
 
+    @traced()
     def update(self, weighing):
         return self.repository.update(weighing)
 
+    @traced()
     def delete(self, id):
         return self.repository.delete(id)
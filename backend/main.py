@@ -6,9 +6,10 @@ from flask import Flask, abort, g, redirect, render_template, request, session,
 from flask_login import LoginManager, UserMixin, current_user, login_user
 from flask_wtf import CSRFProtect
 from flask_wtf.csrf import CSRFError
-from google.cloud import ndb
 
 from config import Configuration
+from eridanus import datastore, metrics, rpc_usage, tracing
+from eridanus.settings import int_setting
 from eridanus.logging_config import configure_logging
 from eridanus.admin.blueprint import admin
 from eridanus.activities.crunches.blueprint import crunches
@@ -24,6 +25,7 @@ configure_logging()
 logger = logging.getLogger(__name__)
 app = Flask(__name__)
 csrf = CSRFProtect(app)
+tracing.instrument_templates(app)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -91,22 +93,27 @@ def _is_local_dev():
 
 
 @app.before_request
-def start_ndb_context():
-    client = getattr(g, 'ndb_client', None)
-    if client is None:
-        client = ndb.Client()
-        g.ndb_client = client
-    ctx = client.context()
-    ctx.__enter__()
-    g.ndb_context = ctx
+def start_request_timer():
+    # No ndb context is opened here: repositories open one on first use,
+    # see eridanus.datastore.datastore_context.
     g.request_start_time = time.monotonic()
+    g.rpc_usage = rpc_usage.start()
+    metrics.start_flusher()
+    g.metrics_endpoint = request.endpoint or 'none'
+    metrics.REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+    tracing.start_trace('request', traceparent=request.headers.get('traceparent'),
+                        **{'http.method': request.method, 'http.target': request.path})
 
 
 @app.teardown_request
 def end_ndb_context(exception):
-    ctx = getattr(g, 'ndb_context', None)
-    if ctx:
-        ctx.__exit__(None, None, None)
+    datastore.end_request_context()
+    # A request which failed before log_request still ends its trace.
+    tracing.finish_trace()
+    rpc_usage.finish(g.pop('rpc_usage', None))
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None:
+        metrics.REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
 
 
 @app.after_request
@@ -114,18 +121,36 @@ def log_request(response):
     start_time = getattr(g, "request_start_time", None)
     if start_time is not None:
         duration_ms = (time.monotonic() - start_time) * 1000.0
+        metrics.REQUEST_SECONDS.observe(duration_ms / 1000.0, endpoint=request.endpoint or 'none',
+                                        method=request.method, status=response.status_code)
     else:
         duration_ms = None
-    logger.info(
-        "request completed",
-        extra={
-            "method": request.method,
-            "path": request.path,
-            "status_code": response.status_code,
-            "remote_addr": request.headers.get("X-Forwarded-For", request.remote_addr),
-            "duration_ms": None if duration_ms is None else round(duration_ms, 2),
-        },
-    )
+    extra = {
+        "method": request.method,
+        "path": request.path,
+        "status_code": response.status_code,
+        "remote_addr": request.headers.get("X-Forwarded-For", request.remote_addr),
+        "duration_ms": None if duration_ms is None else round(duration_ms, 2),
+    }
+    usage = rpc_usage.finish(g.pop("rpc_usage", None))
+    if usage is not None:
+        extra.update(usage.to_dict())
+        for method, count in extra["datastore_calls"].items():
+            metrics.DATASTORE_RPCS.inc(count, method=method)
+        repeated = usage.repeated(int_setting("RPC_REPEAT_THRESHOLD", rpc_usage.DEFAULT_REPEAT_THRESHOLD))
+        if repeated:
+            logger.warning(f"Possible N+1 Datastore access on {request.method} {request.path}: "
+                           f"single-entity calls {repeated}")
+    trace = tracing.finish_trace()
+    if trace is not None:
+        trace.root.attributes['http.status_code'] = response.status_code
+        if usage is not None:
+            trace.root.attributes['datastore.rpcs'] = extra['datastore_rpcs']
+        if request.url_rule is not None:
+            trace.root.name = f'{request.method} {request.url_rule.rule}'
+        response.headers['Server-Timing'] = trace.server_timing()
+        extra.update(trace.summary())
+    logger.info("request completed", extra=extra)
     return response
 
 
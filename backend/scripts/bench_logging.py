@@ -0,0 +1,100 @@
+"""
+Measures what logging costs the request thread: the request log line of
+main.log_request written synchronously (the former setup, text and JSON)
+or through the queue, and the list dumps of the blueprints with and
+without sampling.
+
+    python scripts/bench_logging.py --requests 20000 --output /tmp/bench.log
+"""
+import argparse
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueListener
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eridanus.logging_config import JsonFormatter, NonBlockingQueueHandler, SamplingFilter
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+# The fields log_request passes, with a traced request's spans.
+EXTRA = {
+    "method": "GET", "path": "/dashboard/", "status": 200, "duration_ms": 12.5, "endpoint": "dashboard.index",
+    "datastore_rpcs": 2, "datastore_calls": {"Lookup": 2}, "datastore_errors": 0,
+    "datastore_entities_read": 2, "datastore_entities_written": 0,
+    "datastore_bytes_sent": 180, "datastore_bytes_received": 2400,
+    "trace_id": "0af7651916cd43dd8448eb211c80319c",
+    "spans": [{"name": "DashboardService.cached_home_stats", "category": "service", "depth": 1, "ms": 4.2},
+              {"name": "render:dashboard/index.html", "category": "template", "depth": 1, "ms": 6.1}],
+}
+ITEMS = [{"id": index, "date": "2025-01-01", "count": index % 40, "comment": "after work"} for index in range(50)]
+
+
+def _logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers[:] = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def _per_call(function, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def _queued(output, sampling=None):
+    handler = NonBlockingQueueHandler(queue.Queue(-1))
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+    listener = QueueListener(handler.queue, output)
+    return handler, listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--output", default=os.devnull)
+    args = parser.parse_args()
+    stream = open(args.output, "a", encoding="utf-8")
+    calls = args.requests
+
+    def output(formatter):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(formatter)
+        return handler
+
+    text = _logger("bench.text", output(logging.Formatter(TEXT_FORMAT)))
+    print(f'{"request line, sync text":>32}: {_per_call(lambda: text.info("request completed", extra=EXTRA), calls):8.1f} us')
+    synchronous = _logger("bench.json", output(JsonFormatter()))
+    print(f'{"request line, sync JSON":>32}: '
+          f'{_per_call(lambda: synchronous.info("request completed", extra=EXTRA), calls):8.1f} us')
+
+    handler, listener = _queued(output(JsonFormatter()))
+    queued = _logger("bench.queued", handler)
+    # The listener starts afterwards so that the measure is the request
+    # thread's share alone, not its competition with the writing thread.
+    caller = _per_call(lambda: queued.info("request completed", extra=EXTRA), calls)
+    started = time.perf_counter()
+    listener.start()
+    listener.stop()
+    drain = (time.perf_counter() - started) / calls * 1e6
+    print(f'{"request line, queued JSON":>32}: {caller:8.1f} us  (listener thread: {drain:.1f} us)')
+
+    for rate in (1, 10):
+        handler, listener = _queued(output(JsonFormatter()), {"bench": rate})
+        dumps = _logger(f"bench.dump{rate}", handler)
+        listener.start()
+        caller = _per_call(lambda: dumps.debug("Received the following items: %s", ITEMS), calls)
+        listener.stop()
+        print(f'{f"list dump, queued, 1 in {rate}":>32}: {caller:8.1f} us')
+    stream.close()
+
+
+if __name__ == "__main__":
+    main()
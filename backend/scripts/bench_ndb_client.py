@@ -0,0 +1,73 @@
+"""
+Measures the fixed per-request cost of the ndb client against the
+Datastore emulator: a new ndb.Client for every request (the old
+behaviour) versus the process-wide shared client.
+
+    gcloud beta emulators datastore start --no-store-on-disk
+    $(gcloud beta emulators datastore env-init)
+    python scripts/bench_ndb_client.py --requests 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud import ndb
+
+from eridanus import datastore
+from eridanus.models import Run
+
+
+def _request_with_new_client():
+    client = ndb.Client()
+    with client.context():
+        Run.get_by_id(1)
+
+
+def _request_with_shared_client():
+    ctx = datastore.open_context()
+    try:
+        Run.get_by_id(1)
+    finally:
+        datastore.close_context(ctx)
+
+
+def _measure(fn, requests):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return timings
+
+
+def _report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{label:<14} p50 {statistics.median(timings):8.2f} ms   '
+          f'p95 {p95:8.2f} ms   mean {statistics.mean(timings):8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    if not os.environ.get('DATASTORE_EMULATOR_HOST'):
+        sys.exit('Set DATASTORE_EMULATOR_HOST to point at a running Datastore emulator.')
+    os.environ.setdefault('DATASTORE_DATASET', 'test')
+
+    # Warm up the emulator and the shared client outside of the timings.
+    _request_with_new_client()
+    _request_with_shared_client()
+
+    _report('new client', _measure(_request_with_new_client, args.requests))
+    _report('shared client', _measure(_request_with_shared_client, args.requests))
+    print(datastore.client_metrics())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares the statistics of a full history computed one entity at a time
+(RunningTotals / WeighingTotals) with the vectorized engine, on synthetic
+runs and weighings. No Datastore is needed.
+
+    python scripts/bench_stats_engine.py --rows 1000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eridanus.statistics.engine import RunColumns, WeightColumns
+from eridanus.statistics.user_stats import RunningTotals, WeighingTotals
+
+
+class _Key(object):
+    __slots__ = ('identifier',)
+
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+    def id(self):
+        return self.identifier
+
+
+class _Row(object):
+    """
+    Stands in for an ndb entity, building a million of those would
+    dominate the timings.
+    """
+    _projection = ()
+
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+def _runs(rng, count):
+    start = date(2000, 1, 1)
+    return [_Row(activity_date=start + timedelta(days=rng.randrange(9000)),
+                 distance=rng.uniform(1, 20), duration=rng.randrange(10, 120),
+                 calories=rng.randrange(100, 1200),
+                 speed=None if rng.random() < 0.5 else rng.uniform(6, 16))
+            for _ in range(count)]
+
+
+def _weighings(rng, count):
+    start = date(2000, 1, 1)
+    return [_Row(key=_Key(i + 1), weighing_date=start + timedelta(days=rng.randrange(9000)),
+                 weight=rng.uniform(70, 90))
+            for i in range(count)]
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000.0
+
+
+def _incremental(totals_class, entities):
+    totals = totals_class()
+    for entity in entities:
+        totals.add(entity)
+    return totals.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{"kind":<8} {"rows":>9} {"per entity":>12} {"load":>10} {"aggregate":>10} {"engine":>10}')
+    for rows in args.rows:
+        rng = random.Random(args.seed)
+        for kind, entities, totals_class, columns_class in (
+                ('runs', _runs(rng, rows), RunningTotals, RunColumns.from_runs),
+                ('weights', _weighings(rng, rows), WeighingTotals, WeightColumns.from_weighings)):
+            incremental = _timed(lambda: _incremental(totals_class, entities))
+            columns = []
+            load = _timed(lambda: columns.append(columns_class(entities)))
+            aggregate = _timed(lambda: columns[0].totals())
+            print(f'{kind:<8} {rows:>9} {incremental:>10.1f}ms {load:>8.1f}ms '
+                  f'{aggregate:>8.1f}ms {load + aggregate:>8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
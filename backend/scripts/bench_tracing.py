@@ -0,0 +1,66 @@
+"""
+Measures what the tracing hooks add to a repository call and a service
+call, with tracing disabled and enabled. No Datastore is needed: the ndb
+context is replaced by an empty one.
+
+    python scripts/bench_tracing.py --calls 1000000
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eridanus import datastore, tracing
+
+
+class Repository(object):
+
+    def plain(self, value):
+        with datastore.datastore_context():
+            return value
+
+    @datastore.uses_datastore
+    def read(self, value):
+        return value
+
+
+@tracing.traced()
+def service(value):
+    return value
+
+
+def _per_call(function, calls):
+    started = time.perf_counter()
+    for value in range(calls):
+        function(value)
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1000000)
+    args = parser.parse_args()
+    datastore.datastore_context = contextlib.nullcontext
+    repository = Repository()
+
+    baseline = _per_call(repository.plain, args.calls)
+    print(f'{"undecorated":>28}: {baseline:8.1f} ns/call')
+    print(f'{"repository, disabled":>28}: {_per_call(repository.read, args.calls) - baseline:+8.1f} ns/call')
+    print(f'{"service, disabled":>28}: {_per_call(service, args.calls) - _per_call(int, args.calls):+8.1f} ns/call')
+
+    # Enabled, in batches so a trace does not grow to millions of spans.
+    os.environ['TRACING'] = '1'
+    batch = min(args.calls, 1000)
+    elapsed = 0.0
+    for _ in range(max(1, args.calls // batch)):
+        tracing.start_trace('bench')
+        elapsed += _per_call(repository.read, batch)
+        tracing.finish_trace()
+    print(f'{"repository, enabled":>28}: {elapsed / max(1, args.calls // batch) - baseline:+8.1f} ns/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@ import os
 
 import pytest
 
+from eridanus import rpc_usage
+
 
 @pytest.fixture(scope="session")
 def datastore_emulator():
@@ -36,3 +38,14 @@ def app(monkeypatch):
 @pytest.fixture()
 def client(app):
     return app.test_client()
+
+
+@pytest.fixture()
+def rpc_budget():
+    """
+    Fails the test when a block makes more Datastore RPCs than allowed:
+
+        with rpc_budget(3, RunQuery=0):
+            client.get("/dashboard/")
+    """
+    return rpc_usage.budget
@@ -0,0 +1,110 @@
+from datetime import date, time, timedelta
+
+import pytest
+
+import eridanus.api.resources.dashboard as dashboard_resource
+import eridanus.dashboard.blueprint as dashboard_blueprint
+from eridanus.repository import PushUpsRepository, RunRepository, StatisticsRepository
+from eridanus.statistics.activity_calendar import MAX_YEAR, MIN_YEAR, YEAR_BYTES, Calendar, day_index, set_day, \
+    to_bits, to_bytes
+
+
+def _calendar(days):
+    bitmaps = {}
+    for kind, day in days:
+        set_day(bitmaps, "u", kind, day)
+    first_year = min(year for _, _, year in bitmaps)
+    return Calendar(first_year, {(kind, year): bits for (_, kind, year), bits in bitmaps.items()})
+
+
+def test_a_year_fits_in_46_bytes():
+    bits = 1 << day_index(date(2024, 12, 31))
+    assert day_index(date(2024, 12, 31)) == 365
+    assert len(to_bytes(bits)) == YEAR_BYTES
+    assert to_bits(to_bytes(bits)) == bits
+
+
+def test_streaks_span_kinds_and_years():
+    days = [("running", date(2024, 12, 29) + timedelta(days=offset)) for offset in range(0, 6, 2)]
+    days += [("pushups", date(2024, 12, 30) + timedelta(days=offset)) for offset in range(0, 6, 2)]
+    days += [("running", date(2024, 6, 1))]
+    calendar = _calendar(days)
+
+    # Every day from Dec 29 to Jan 3, half of them runs, half push ups.
+    assert calendar.longest_streak() == 6
+    assert calendar.longest_streak(kinds=["running"]) == 1
+    assert calendar.current_streak(date(2025, 1, 3)) == 6
+    # Today without activity yet keeps yesterday's streak.
+    assert calendar.current_streak(date(2025, 1, 4)) == 6
+    assert calendar.current_streak(date(2025, 1, 5)) == 0
+    assert calendar.days_since_last(date(2025, 1, 10)) == 7
+    assert calendar.days_since_last(date(2024, 6, 5), kinds=["pushups"]) is None
+    assert calendar.active_days(2024) == 4
+
+
+def test_heatmap_counts_kinds_per_day():
+    calendar = _calendar([("running", date(2025, 1, 1)), ("pushups", date(2025, 1, 1)),
+                          ("crunches", date(2025, 1, 2))])
+    heatmap = calendar.heatmap(2025)
+    # 2025 starts on a Wednesday.
+    assert heatmap["start"] == "2024-12-30"
+    assert heatmap["weeks"][0] == [None, None, 2, 1, 0, 0, 0]
+    assert sum(len(week) for week in heatmap["weeks"]) == 7 * len(heatmap["weeks"])
+    assert Calendar(None, {}).longest_streak() == 0
+
+
+def test_heatmap_years_are_bounded():
+    calendar = Calendar(None, {})
+    assert calendar.heatmap(MIN_YEAR)["previous_year"] is None
+    assert calendar.heatmap(MAX_YEAR)["next_year"] is None
+    assert calendar.heatmap(2025)["next_year"] == 2026
+    for year in (MIN_YEAR - 1, MAX_YEAR + 1):
+        with pytest.raises(ValueError):
+            calendar.heatmap(year)
+
+
+def test_calendar_route(client, monkeypatch):
+    class FakeDashboardService:
+        def heatmap(self, username, year=None):
+            return dict(_calendar([("running", date(2025, 1, 1))]).heatmap(year or 2025), current_streak=1,
+                        longest_streak=1, days_since_last=0, active_days=1, year_active_days=1)
+
+    monkeypatch.setattr(dashboard_blueprint, "DashboardService", FakeDashboardService)
+    monkeypatch.setattr(dashboard_resource, "DashboardService", FakeDashboardService)
+    assert client.get("/dashboard/calendar/?year=2025").status_code == 200
+    last = client.get(f"/dashboard/calendar/?year={MAX_YEAR}")
+    assert last.status_code == 200
+    assert f"year={MAX_YEAR + 1}".encode() not in last.data
+    assert client.get(f"/dashboard/calendar/?year={MAX_YEAR + 1}").status_code == 404
+    assert client.get("/dashboard/calendar/?year=-1").status_code == 404
+    assert client.get(f"/api/v1/stats/calendar/?year={MAX_YEAR + 1}").status_code == 404
+
+
+def test_calendar_follows_writes(datastore_emulator):
+    username = "__pytest_calendar__"
+    runs, pushups = RunRepository(), PushUpsRepository()
+
+    def run(day, hour):
+        return runs.create({"usernickname": username, "activity_date": day, "activity_time": time(hour, 0),
+                            "duration": 30, "distance": 5.0})
+
+    first, second, third = run(date(2025, 1, 1), 7), run(date(2025, 1, 1), 18), run(date(2025, 1, 2), 7)
+    pushup = pushups.create({"usernickname": username, "activity_date": date(2025, 1, 3),
+                             "activity_time": time(8, 0), "count": 20})
+    try:
+        repository = StatisticsRepository()
+        today = date(2025, 1, 3)
+        assert repository.calendar(username, today).current_streak(today) == 3
+
+        # The day keeps its other run, the next one becomes empty.
+        runs.delete(first.key.id())
+        runs.delete(third.key.id())
+        calendar = repository.calendar(username, today)
+        assert calendar.longest_streak() == 1
+        assert calendar.active_days(2025) == 2
+
+        rebuilt = repository.rebuild_calendar(username)
+        assert rebuilt.bitmaps == repository.calendar(username, today).bitmaps
+    finally:
+        runs.delete(second.key.id())
+        pushups.delete(pushup.key.id())
@@ -0,0 +1,243 @@
+from datetime import date
+
+import pytest
+import redis
+from google.cloud import ndb
+from google.cloud.datastore_v1.types import entity as entity_pb2
+
+from eridanus import cache
+
+
+def _cache_key(kind, identifier):
+    key = entity_pb2.Key(
+        partition_id=entity_pb2.PartitionId(project_id="test"),
+        path=[entity_pb2.Key.PathElement(kind=kind, id=identifier)])
+    return b"NDB30" + entity_pb2.Key.serialize(key)
+
+
+class FakeRedis:
+    """Just enough of the Redis protocol for ndb's RedisCache."""
+
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+
+    def _write(self, key, value):
+        self.data[key] = value
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def mset(self, items):
+        for key, value in items.items():
+            self._write(key, value)
+
+    def expire(self, key, seconds):
+        pass
+
+    def setnx(self, key, value):
+        if key in self.data:
+            return False
+        self._write(key, value)
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            if self.data.pop(key, None) is not None:
+                self.versions[key] = self.versions.get(key, 0) + 1
+
+    def flushdb(self):
+        self.data.clear()
+
+    def info(self, section=None):
+        return {"evicted_keys": 0, "expired_keys": 0}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.watched = {}
+        self.commands = []
+
+    def watch(self, key):
+        self.watched[key] = self.server.versions.get(key, 0)
+
+    def get(self, key):
+        return self.server.data.get(key)
+
+    def multi(self):
+        self.commands = []
+
+    def set(self, key, value):
+        self.commands.append((key, value))
+
+    def setex(self, key, seconds, value):
+        self.commands.append((key, value))
+
+    def execute(self):
+        for key, version in self.watched.items():
+            if self.server.versions.get(key, 0) != version:
+                raise redis.exceptions.WatchError()
+        for key, value in self.commands:
+            self.server._write(key, value)
+
+    def reset(self):
+        self.watched = {}
+        self.commands = []
+
+
+def test_lru_hits_and_misses():
+    lru = cache.LruGlobalCache(max_entries=10)
+    run = _cache_key("Run", 1)
+    assert lru.get([run]) == [None]
+    lru.set({run: b"entity"})
+    assert lru.get([run]) == [b"entity"]
+
+    totals = lru.stats.snapshot()["totals"]
+    assert totals["hits"] == 1
+    assert totals["misses"] == 1
+    assert lru.stats.snapshot()["kinds"]["Run"]["hits"] == 1
+
+
+def test_lru_evicts_least_recently_used():
+    lru = cache.LruGlobalCache(max_entries=2)
+    first, second, third = (_cache_key("Run", i) for i in (1, 2, 3))
+    lru.set({first: b"1"})
+    lru.set({second: b"2"})
+    lru.get([first])
+    lru.set({third: b"3"})
+
+    assert lru.get([first, second, third]) == [b"1", None, b"3"]
+    assert lru.stats.snapshot()["totals"]["evictions"] == 1
+
+
+def test_lru_kind_limits():
+    lru = cache.LruGlobalCache(max_entries=10, kind_limits={"Weight": 1})
+    lru.set({_cache_key("Weight", 1): b"w1", _cache_key("Run", 1): b"r1"})
+    lru.set({_cache_key("Weight", 2): b"w2"})
+
+    assert lru.get([_cache_key("Weight", 1)]) == [None]
+    assert lru.get([_cache_key("Weight", 2), _cache_key("Run", 1)]) == [b"w2", b"r1"]
+    assert len(lru) == 2
+
+
+def test_lru_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    lru = cache.LruGlobalCache(ttl=10)
+    key = _cache_key("Run", 1)
+    lru.set({key: b"entity"})
+    now[0] += 11
+
+    assert lru.get([key]) == [None]
+    assert lru.stats.snapshot()["totals"]["expirations"] == 1
+
+
+def test_lru_compare_and_swap():
+    lru = cache.LruGlobalCache()
+    key = _cache_key("Run", 1)
+    lru.set({key: b"0-lock"})
+    lru.watch({key: b"0-lock"})
+    assert lru.compare_and_swap({key: b"entity"}) == {key: True}
+
+    lru.watch({key: b"0-lock"})
+    assert lru.compare_and_swap({key: b"other"}) == {key: False}
+    assert lru.get([key]) == [b"entity"]
+
+
+def test_lock_values_count_as_misses():
+    lru = cache.LruGlobalCache()
+    key = _cache_key("Run", 1)
+    lru.set({key: b"00lock"})
+    lru.get([key])
+    assert lru.stats.snapshot()["totals"]["misses"] == 1
+
+
+def test_redis_cache_against_stand_in():
+    server = FakeRedis()
+    redis_cache = cache.RedisGlobalCache(server)
+    key = _cache_key("Weight", 7)
+    assert redis_cache.get([key]) == [None]
+    redis_cache.set({key: b"entity"})
+    assert redis_cache.get([key]) == [b"entity"]
+
+    redis_cache.watch({key: b"entity"})
+    assert redis_cache.compare_and_swap({key: b"newer"}) == {key: True}
+    redis_cache.delete([key])
+    assert redis_cache.get([key]) == [None]
+
+    info = redis_cache.info()
+    assert info["stats"]["totals"]["hits"] == 1
+    assert info["stats"]["totals"]["misses"] == 2
+    assert info["evicted_keys"] == 0
+
+
+def test_create_global_cache_from_settings(monkeypatch):
+    monkeypatch.setenv("GLOBAL_CACHE", "lru")
+    monkeypatch.setenv("GLOBAL_CACHE_MAX_ENTRIES", "5")
+    monkeypatch.setenv("GLOBAL_CACHE_KIND_LIMITS", "Run=2, Weight=3")
+    lru = cache.create_global_cache()
+    assert lru.max_entries == 5
+    assert lru.kind_limits == {"Run": 2, "Weight": 3}
+
+    monkeypatch.setenv("GLOBAL_CACHE", "")
+    assert cache.create_global_cache() is None
+
+
+def test_lru_is_refused_with_several_workers(monkeypatch):
+    monkeypatch.setenv("GLOBAL_CACHE", "lru")
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    with pytest.raises(ValueError):
+        cache.create_global_cache()
+
+
+def test_writes_invalidate_global_cache(datastore_emulator, monkeypatch):
+    from eridanus.repository import WeightRepository
+
+    monkeypatch.setenv("GLOBAL_CACHE", "lru")
+    cache.reset_global_cache()
+    try:
+        repo = WeightRepository()
+        created = repo.create({"usernickname": "__pytest_cache__", "weight": 80.0,
+                               "weighing_date": date(2025, 2, 1)})
+        identifier = created.key.id()
+        assert repo.read(identifier).weight == 80.0
+        assert repo.read(identifier).weight == 80.0
+        assert cache.get_global_cache().stats.snapshot()["totals"]["hits"] >= 1
+
+        repo.update({"id": identifier, "weight": 79.0})
+        assert repo.read(identifier).weight == 79.0
+
+        repo.delete(identifier)
+        assert repo.read(identifier) is None
+    finally:
+        cache.reset_global_cache()
+
+
+def test_forget_drops_the_entries_of_uncached_writes(datastore_emulator, monkeypatch):
+    from eridanus.datastore import datastore_context
+    from eridanus.models import Weight
+    from eridanus.repository import WeightRepository
+
+    monkeypatch.setenv("GLOBAL_CACHE", "lru")
+    cache.reset_global_cache()
+    repo = WeightRepository()
+    created = repo.create({"usernickname": "__pytest_cache__", "weight": 80.0,
+                           "weighing_date": date(2025, 2, 2)})
+    try:
+        assert repo.read(created.key.id()).weight == 80.0
+        with datastore_context():
+            weighing = Weight.get_by_id(created.key.id())
+            weighing.weight = 70.0
+            ndb.put_multi([weighing], use_cache=False, use_global_cache=False)
+            assert cache.get_global_cache().get([cache.cache_key(weighing.key)]) != [None]
+            cache.forget([weighing.key])
+            assert cache.get_global_cache().get([cache.cache_key(weighing.key)]) == [None]
+        assert repo.read(created.key.id()).weight == 70.0
+    finally:
+        repo.delete(created.key.id())
+        cache.reset_global_cache()
@@ -0,0 +1,59 @@
+import zlib
+from datetime import date, datetime, time
+
+from google.cloud import ndb
+
+from eridanus.dashboard.caching import etag
+from eridanus.dashboard.services import DashboardService
+from eridanus.models import DashboardSnapshot
+from eridanus.repository import RunRepository, StatisticsRepository, WeightRepository
+
+
+def test_etag_changes_with_version_day_and_representation():
+    day = date(2025, 1, 1)
+    tag = etag("u", 1, "html", day)
+    assert tag == etag("u", 1, "html", day)
+    assert len({tag, etag("u", 2, "html", day), etag("u", 1, "json", day),
+                etag("u", 1, "html", date(2025, 1, 2)), etag("v", 1, "html", day)}) == 5
+
+
+def test_snapshots_are_json_which_keeps_the_dates():
+    stats = {"running": {"date_last_run": date(2025, 1, 31), "count": 3, "speed": 10.5},
+             "updated": datetime(2025, 1, 31, 7, 30), "records": [{"value": 5.0, "date": "2025-01-31"}]}
+    prop = DashboardSnapshot.stats
+    stored = prop._call_to_base_type(stats)
+    assert zlib.decompress(stored.z_val).startswith(b'{"running":{"date_last_run":{"$date":"2025-01-31"}')
+    assert prop._call_from_base_type(stored) == stats
+    # Snapshots pickled by an earlier version are computed again.
+    pickled = ndb.PickleProperty("stats", compressed=True)._call_to_base_type(stats)
+    assert isinstance(prop._call_from_base_type(pickled), bytes)
+
+
+def test_writes_bump_the_version_and_expire_the_snapshot(datastore_emulator):
+    username = "__pytest_dashboard_cache__"
+    repository = StatisticsRepository()
+    service = DashboardService(repository)
+    runs = RunRepository()
+    version = repository.data_version(username)
+
+    run = runs.create({"usernickname": username, "activity_date": date(2025, 1, 1),
+                       "activity_time": time(7, 0), "duration": 30, "distance": 5.0})
+    try:
+        assert repository.data_version(username) == version + 1
+        stats = service.cached_home_stats(username, version + 1)
+        assert stats["activities"]["running"]["count"] == 1
+        snapshot = repository.dashboard_snapshot(username)
+        assert snapshot.version == version + 1
+        assert snapshot.stats == stats
+
+        # Served from the snapshot: a stale copy would tell a write apart.
+        repository.save_dashboard_snapshot(username, version + 1, date.today(), {"snapshot": True})
+        assert service.cached_home_stats(username, version + 1) == {"snapshot": True}
+
+        runs.update({"id": run.key.id(), "distance": 6.0})
+        WeightRepository().invalidate_derived([username])
+        assert repository.data_version(username) == version + 3
+        stats = service.cached_home_stats(username, version + 3)
+        assert stats["activities"]["running"]["max_distance"] == 6.0
+    finally:
+        runs.delete(run.key.id())
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from eridanus import datastore
+
+
+@pytest.fixture()
+def emulator_env(monkeypatch):
+    # Building a client against the emulator host needs no credentials
+    # and no running emulator, gRPC channels connect lazily.
+    monkeypatch.setenv("DATASTORE_EMULATOR_HOST", "localhost:8081")
+    monkeypatch.setenv("DATASTORE_DATASET", "test")
+    datastore.reset_client()
+    yield
+    datastore.reset_client()
+
+
+def test_client_is_shared_across_threads(emulator_env):
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(datastore.get_client()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in clients}) == 1
+
+
+def test_client_is_recreated_after_fork(emulator_env, monkeypatch):
+    parent = datastore.get_client()
+    monkeypatch.setattr(datastore.os, "getpid", lambda: -1)
+    assert datastore.get_client() is not parent
+
+
+def test_channel_pool_size(emulator_env, monkeypatch):
+    monkeypatch.setenv("NDB_CHANNEL_POOL_SIZE", "3")
+    client = datastore.get_client()
+    assert len(client.pool.channels) == 3
+    assert datastore.client_metrics()["channel_pool_size"] == 3
+
+
+def test_channel_pool_round_robin():
+    class FakeChannel:
+        def __init__(self):
+            self.calls = 0
+
+        def unary_unary(self, method, request_serializer=None, response_deserializer=None):
+            def call(request, *args, **kwargs):
+                self.calls += 1
+                return request
+            return call
+
+    channels = [FakeChannel(), FakeChannel()]
+    pool = datastore.ChannelPool(channels)
+    lookup = pool.unary_unary("/google.datastore.v1.Datastore/Lookup")
+    for i in range(4):
+        assert lookup(i) == i
+
+    assert [channel.calls for channel in channels] == [2, 2]
+    assert pool.calls == [2, 2]
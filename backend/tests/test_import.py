@@ -0,0 +1,132 @@
+import threading
+import time
+from datetime import date, datetime
+
+import pytest
+
+from eridanus.admin import services
+from eridanus.admin.importer import CsvImport, LocalStorage
+from eridanus.models import ImportCheckpoint, Weight
+from eridanus.repository import WeightRepository
+
+HEADER = "usernickname,weight,creation_datetime\r\n"
+
+
+class FakeRepository:
+    model_class = Weight
+
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.invalidated = []
+        self.delay = delay
+        self.fail_at = None
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def load_many(self, records):
+        if self.fail_at is not None and records[0]["weight"] == self.fail_at:
+            raise RuntimeError("deadline exceeded")
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+            self.batches.append(records)
+        return records
+
+    def invalidate_derived(self, usernames):
+        self.invalidated.extend(usernames)
+
+
+class FakeCheckpoints:
+    def __init__(self):
+        self.saved = {}
+
+    def checkpoint(self, name):
+        return self.saved.get(name)
+
+    def save_checkpoint(self, name, filename, fingerprint, rows_done, completed=False):
+        self.saved[name] = ImportCheckpoint(filename=filename, fingerprint=fingerprint,
+                                            rows_done=rows_done, completed=completed)
+
+
+def _weight_csv(tmp_path, rows):
+    folder = tmp_path / "import" / "2025"
+    folder.mkdir(parents=True)
+    lines = [f"{name},{weight},2025-01-{day:02d} 07:00:00.000000\r\n" for name, weight, day in rows]
+    (folder / "weight.csv").write_text(HEADER + "".join(lines), newline="")
+    return tmp_path
+
+
+def test_weight_import_from_local_storage(tmp_path, monkeypatch):
+    root = _weight_csv(tmp_path, [("u", 80.0 + day, day) for day in range(1, 11)] + [("u", "heavy", 11)])
+    repo = FakeRepository()
+    monkeypatch.setenv("IMPORT_LOCAL_DIR", str(root))
+    monkeypatch.setenv("IMPORT_BATCH_SIZE", "3")
+    monkeypatch.setattr(services.repository, "WeightRepository", lambda: repo)
+    monkeypatch.setattr(services.repository, "ImportRepository", FakeCheckpoints)
+
+    audit = services.ImportDataServices().import_from_csv("2025", "u")
+
+    report = audit["weight"]
+    assert audit["default_bucket"].startswith("file://")
+    assert report["rows"] == 11
+    assert report["imported"] == 10
+    assert report["invalid"] == 1
+    assert report["errors"][0]["line"] == 12
+    assert report["rows_per_second"] > 0
+    assert sorted(len(batch) for batch in repo.batches) == [1, 3, 3, 3]
+    assert repo.invalidated == ["u"]
+
+
+def test_import_concurrency_is_bounded(tmp_path):
+    root = _weight_csv(tmp_path, [("u", 80.0, day) for day in range(1, 21)])
+    repo = FakeRepository(delay=0.02)
+    parse = services.ImportDataServices()._parse_weight_row
+
+    with LocalStorage(str(root)).open("import/2025/weight.csv") as stream:
+        report = CsvImport(repo, parse, batch_size=2, concurrency=3).run(stream)
+
+    assert report["imported"] == 20
+    assert 1 < repo.max_active <= 3
+
+
+def test_interrupted_import_resumes_after_saved_rows(tmp_path, monkeypatch):
+    monkeypatch.setenv("IMPORT_CHECKPOINT_SECONDS", "0")
+    root = _weight_csv(tmp_path, [("u", float(day), day) for day in range(1, 11)])
+    storage = LocalStorage(str(root))
+    filename = "import/2025/weight.csv"
+    checkpoints = FakeCheckpoints()
+    repo = FakeRepository()
+    parse = services.ImportDataServices()._parse_weight_row
+
+    def run():
+        importer = CsvImport(repo, parse, batch_size=2, concurrency=1, checkpoints=checkpoints)
+        with storage.open(filename) as stream:
+            return importer.run(stream, filename=filename, fingerprint=storage.fingerprint(filename))
+
+    repo.fail_at = 7.0
+    with pytest.raises(RuntimeError):
+        run()
+    assert checkpoints.saved["Weight:" + filename].rows_done == 6
+
+    repo.fail_at = None
+    report = run()
+    assert report["skipped"] == 6
+    assert report["imported"] == 4
+    assert checkpoints.saved["Weight:" + filename].completed
+
+    # A completed file is imported again from the start.
+    assert run()["imported"] == 10
+
+
+def test_natural_ids_are_stable():
+    repo = WeightRepository()
+    record = {"usernickname": "u", "weighing_date": date(2025, 1, 1),
+              "creation_datetime": datetime(2025, 1, 1, 7, 0)}
+    identifier = repo.natural_id(record)
+    assert identifier == repo.natural_id(dict(record))
+    assert 0 < identifier < 2 ** 53
+    assert identifier != repo.natural_id(dict(record, usernickname="v"))
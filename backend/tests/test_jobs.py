@@ -0,0 +1,136 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from eridanus import jobs
+
+
+class FakeJobRepository:
+    jobs = {}
+
+    def create(self, kind, username, params):
+        job = FakeJob(len(self.jobs) + 1, kind, username, params)
+        self.jobs[job.id] = job
+        return job
+
+    def read(self, identifier):
+        return self.jobs.get(int(identifier))
+
+    def save(self, job):
+        job.saves.append(job.status)
+        job.updated = datetime.utcnow()
+        return job
+
+
+class FakeKey:
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+    def id(self):
+        return self.identifier
+
+
+class FakeJob:
+    def __init__(self, identifier, kind, username, params):
+        self.id = identifier
+        self.key = FakeKey(identifier)
+        self.kind, self.username, self.params = kind, username, params
+        self.status, self.progress, self.result, self.error = jobs.QUEUED, {}, None, None
+        self.created = self.started = self.finished = None
+        self.updated = datetime.utcnow()
+        self.saves = []
+
+
+@pytest.fixture()
+def fake_jobs(monkeypatch):
+    FakeJobRepository.jobs = {}
+    monkeypatch.setattr(jobs, "JobRepository", FakeJobRepository)
+    monkeypatch.setattr(jobs, "datastore_context", _no_context)
+    monkeypatch.setenv("JOB_PROGRESS_SECONDS", "0")
+    yield FakeJobRepository.jobs
+
+
+class _no_context:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def test_job_runs_in_the_pool(fake_jobs):
+    done = threading.Event()
+    caller = threading.current_thread()
+
+    @jobs.handler("__pytest_ok__")
+    def run(job, progress):
+        assert threading.current_thread() is not caller
+        progress({"step": 1})
+        done.set()
+        return {"answer": job.params["question"] * 2}
+
+    job = jobs.submit("__pytest_ok__", "u", {"question": 21})
+    assert done.wait(5)
+    for _ in range(100):
+        if job.status == jobs.SUCCEEDED:
+            break
+        threading.Event().wait(0.01)
+
+    status = jobs.status(job)
+    assert status["status"] == jobs.SUCCEEDED
+    assert status["result"] == {"answer": 42}
+    assert status["progress"] == {"step": 1}
+    assert job.saves[0] == jobs.RUNNING and job.saves[-1] == jobs.SUCCEEDED
+
+
+def test_failed_job_keeps_the_error(fake_jobs):
+    @jobs.handler("__pytest_fail__")
+    def run(job, progress):
+        raise RuntimeError("boom")
+
+    job = jobs.submit("__pytest_fail__", "u")
+    for _ in range(500):
+        if job.status == jobs.FAILED:
+            break
+        threading.Event().wait(0.01)
+    assert job.status == jobs.FAILED
+    assert job.error == "boom"
+
+
+def test_unknown_kind_is_rejected(fake_jobs):
+    with pytest.raises(ValueError):
+        jobs.submit("__pytest_unknown__", "u")
+
+
+def test_jobs_of_a_stopped_process_are_reported_failed(fake_jobs):
+    job = FakeJobRepository().create("export", "u", {})
+    assert jobs.status(job)["status"] == jobs.QUEUED
+    job.status, job.updated = jobs.RUNNING, datetime.utcnow() - timedelta(seconds=jobs.DEFAULT_STALE_SECONDS + 1)
+    status = jobs.status(job)
+    assert status["status"] == jobs.FAILED and status["error"]
+    job.status = jobs.SUCCEEDED
+    assert jobs.status(job)["status"] == jobs.SUCCEEDED
+
+
+def test_held_jobs_are_saved_by_the_heartbeat(fake_jobs):
+    release = threading.Event()
+
+    @jobs.handler("__pytest_slow__")
+    def run(job, progress):
+        release.wait(5)
+
+    job = jobs.submit("__pytest_slow__", "u")
+    for _ in range(500):
+        if job.status == jobs.RUNNING:
+            break
+        threading.Event().wait(0.01)
+    saves = len(job.saves)
+    jobs._save_held()
+    assert job.saves[saves:] == [jobs.RUNNING]
+    release.set()
+    for _ in range(500):
+        if job.status == jobs.SUCCEEDED and job.id not in jobs._held:
+            break
+        threading.Event().wait(0.01)
+    assert job.id not in jobs._held
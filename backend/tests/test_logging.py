@@ -0,0 +1,84 @@
+import io
+import json
+import logging
+import queue
+import sys
+
+import pytest
+
+from eridanus import logging_config
+from eridanus.logging_config import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, parse_sampling
+
+
+def _record(name="eridanus.weighing.blueprint", level=logging.DEBUG, msg="items %s", args=(1,), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture()
+def reconfigured(monkeypatch):
+    yield
+    monkeypatch.undo()
+    logging_config.configure_logging()
+
+
+def test_json_lines_keep_the_extra_fields():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = _record(level=logging.ERROR, duration_ms=1.5, spans=[{"name": "a"}], when=object())
+        record.exc_info = sys.exc_info()
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["severity"] == "ERROR" and entry["message"] == "items 1"
+    assert entry["logger"] == "eridanus.weighing.blueprint"
+    assert entry["duration_ms"] == 1.5 and entry["spans"] == [{"name": "a"}]
+    assert entry["when"].startswith("<object")
+    assert "ValueError: boom" in entry["exception"]
+    assert "args" not in entry and "levelno" not in entry
+
+
+def test_sampling_keeps_one_in_rate_below_warning():
+    sampling = SamplingFilter({"eridanus.weighing": 3})
+    kept = [sampling.filter(_record()) for _ in range(9)]
+    assert kept == [True, False, False] * 3
+    assert all(sampling.filter(_record(level=logging.WARNING)) for _ in range(3))
+    assert all(sampling.filter(_record(name="eridanus.activities")) for _ in range(3))
+
+
+def test_sampling_setting():
+    assert parse_sampling(" eridanus.activities=10, main=2,") == {"eridanus.activities": 10, "main": 2}
+    assert parse_sampling(None) == {}
+    with pytest.raises(ValueError):
+        parse_sampling("eridanus")
+
+
+def test_queued_records_keep_their_message_and_are_dropped_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    items = [1]
+    handler.handle(_record(args=(items,)))
+    # The list changes after the call, the record does not.
+    items.append(2)
+    handler.handle(_record())
+    assert handler.queue.get_nowait().getMessage() == "items [1]"
+    assert handler.dropped == 1
+
+
+def test_configured_logging_writes_json_from_the_listener(reconfigured, monkeypatch):
+    # Patched here: the capture of pytest replaces sys.stdout between the
+    # setup and the test.
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", stdout)
+    monkeypatch.setenv("LOG_LEVEL", "DEBUG")
+    monkeypatch.setenv("LOG_FORMAT", "json")
+    monkeypatch.setenv("LOG_SAMPLING", "eridanus.weighing=2")
+    logging_config.configure_logging()
+
+    logging.getLogger("main").info("request completed", extra={"status": 200})
+    for index in range(4):
+        logging.getLogger("eridanus.weighing.blueprint").debug("items %s", index)
+    logging_config._stop_listener()
+
+    entries = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert [entry["message"] for entry in entries] == ["request completed", "items 0", "items 2"]
+    assert entries[0]["status"] == 200
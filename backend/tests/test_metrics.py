@@ -0,0 +1,143 @@
+import contextlib
+import os
+import threading
+import time
+
+import pytest
+from google.cloud import ndb
+
+from eridanus import datastore, metrics
+from eridanus.metrics import Registry, SharedFiles
+
+
+def _run(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10.0)
+        assert not thread.is_alive()
+
+
+def test_counters_and_histograms_lose_no_update_across_threads():
+    registry = Registry()
+    counter = registry.counter("test_events", "Events.", ("kind",))
+    histogram = registry.histogram("test_seconds", "Durations.", ("kind",), buckets=(0.1, 1.0))
+
+    def work():
+        for index in range(5000):
+            counter.inc(kind="a")
+            histogram.observe(0.05 if index % 2 else 5.0, kind="a")
+
+    _run(8, work)
+    assert counter.value(kind="a") == 8 * 5000
+    buckets, total, count = histogram.value(kind="a")
+    assert buckets == [8 * 2500, 0, 8 * 2500]
+    assert count == 8 * 5000
+    assert total == pytest.approx(8 * 2500 * 5.05)
+
+
+def test_labels_must_match_the_family():
+    counter = Registry().counter("test_events", "Events.", ("kind",))
+    with pytest.raises(ValueError):
+        counter.inc(other="a")
+
+
+def test_render_is_openmetrics():
+    registry = Registry()
+    registry.counter("test_events", "Events.", ("kind",)).inc(3, kind='say "hi"')
+    registry.gauge("test_open", "Open things.").set(2)
+    registry.histogram("test_seconds", "Durations.", ("kind",), buckets=(0.1, 1.0)).observe(0.5, kind="a")
+
+    text = metrics.render(metrics.merge([(os.getpid(), registry.snapshot())]))
+    lines = text.splitlines()
+    assert "# TYPE test_events counter" in lines
+    assert 'test_events_total{kind="say \\"hi\\""} 3' in lines
+    assert "test_open 2" in lines
+    assert 'test_seconds_bucket{kind="a",le="0.1"} 0' in lines
+    assert 'test_seconds_bucket{kind="a",le="1.0"} 1' in lines
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 1' in lines
+    assert 'test_seconds_count{kind="a"} 1' in lines
+    assert 'test_seconds_sum{kind="a"} 0.5' in lines
+    assert lines[-1] == "# EOF"
+
+
+def test_shared_files_add_up_workers_and_drop_gauges_of_exited_ones(tmp_path):
+    files = SharedFiles(str(tmp_path))
+    for pid, value in ((101, 2), (102, 5)):
+        registry = Registry()
+        registry.counter("test_events", "Events.").inc(value)
+        registry.gauge("test_open", "Open things.").set(value)
+        files.write(registry.snapshot(), pid=pid)
+    # A half-written file never replaces a complete one.
+    (tmp_path / "metrics-103.json").write_text('{"pid": 103')
+
+    merged = metrics.merge(files.read(), alive=lambda pid: pid == 102)
+    assert merged["test_events"]["samples"] == {(): 7}
+    assert merged["test_open"]["samples"] == {(): 5}
+
+
+def test_shared_files_collect_forked_workers(tmp_path):
+    files = SharedFiles(str(tmp_path))
+    children = []
+    for _ in range(3):
+        pid = os.fork()
+        if pid == 0:
+            registry = Registry()
+            registry.counter("test_events", "Events.").inc(4)
+            files.write(registry.snapshot())
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        assert os.waitpid(pid, 0)[1] == 0
+    registry = Registry()
+    registry.counter("test_events", "Events.").inc()
+    files.write(registry.snapshot())
+
+    assert len(files.read()) == 4
+    assert metrics.merge(files.read())["test_events"]["samples"] == {(): 13}
+
+
+def test_async_repository_calls_are_timed_until_their_future_resolves(monkeypatch):
+    monkeypatch.setattr(datastore, "datastore_context", contextlib.nullcontext)
+    future = ndb.Future()
+
+    class _Repository:
+        @datastore.uses_datastore
+        def read_async(self, identifier):
+            return future
+
+    def observed():
+        return metrics.REPOSITORY_SECONDS.value(kind="_Repository", operation="read_async") or [[], 0.0, 0]
+
+    count = observed()[2]
+    assert _Repository().read_async(7) is future
+    assert observed()[2] == count
+    time.sleep(0.02)
+    future.set_result(7)
+    assert observed()[2] == count + 1
+    assert observed()[1] >= 0.02
+
+
+def test_requests_are_measured_and_exposed(client, monkeypatch):
+    import eridanus.admin.blueprint as admin_blueprint
+    monkeypatch.setattr(admin_blueprint.Configuration, "ALLOWED_USER_EMAIL", "dev@example.com")
+    monkeypatch.delenv("METRICS_MULTIPROC_DIR", raising=False)
+
+    assert client.get("/missing/").status_code == 404
+    response = client.get("/admin/metrics")
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert 'eridanus_request_duration_seconds_bucket{endpoint="none",method="GET",status="404",le="+Inf"}' in text
+    # The scrape itself is in flight while it renders.
+    assert 'eridanus_requests_in_flight{endpoint="admin.openmetrics"} 1' in text
+    assert 'eridanus_single_flight_calls_total{outcome="executions"}' in text
+    assert text.endswith("# EOF\n")
+    assert metrics.REQUESTS_IN_FLIGHT.value(endpoint="admin.openmetrics") == 0
+
+
+def test_metrics_are_for_the_allowed_user_only(client, monkeypatch):
+    import eridanus.admin.blueprint as admin_blueprint
+    monkeypatch.setattr(admin_blueprint.Configuration, "ALLOWED_USER_EMAIL", "someone@example.com")
+    assert client.get("/admin/metrics").status_code == 403
@@ -0,0 +1,52 @@
+from datetime import date, time
+
+from google.cloud import ndb
+
+from eridanus.datastore import datastore_context
+from eridanus.migrations import MIGRATIONS
+from eridanus.migrations.add_speed import AddRunSpeed
+from eridanus.migrations.runner import MigrationRunner
+from eridanus.models import MigrationState, Run
+
+
+def test_add_speed_only_changes_runs_without_speed():
+    migration = AddRunSpeed()
+    run = Run(distance=10.0, duration=60)
+    assert migration.transform(run) is True
+    assert run.speed == 10.0
+    assert migration.transform(run) is False
+    assert migration.transform(Run(distance=None, duration=60)) is False
+    assert MIGRATIONS["add_run_speed"] is AddRunSpeed
+
+
+class _TestRuns(AddRunSpeed):
+    name = "__pytest_add_run_speed__"
+
+    def query(self):
+        return Run.query(Run.usernickname == "__pytest_migration__")
+
+
+def test_runner_pages_resumes_and_dry_runs(datastore_emulator):
+    with datastore_context():
+        old = Run.query(Run.usernickname == "__pytest_migration__").fetch(keys_only=True)
+        ndb.delete_multi(old + [ndb.Key(MigrationState, _TestRuns.name)])
+        ndb.put_multi([Run(usernickname="__pytest_migration__", activity_date=date(2025, 1, day),
+                           activity_time=time(7, 0), distance=5.0, duration=30,
+                           speed=12.0 if day % 2 else None)
+                       for day in range(1, 8)])
+
+    dry = MigrationRunner(_TestRuns(), page_size=3, dry_run=True).run()
+    assert (dry["scanned"], dry["changed"]) == (7, 3)
+
+    with datastore_context():
+        first = MigrationRunner(_TestRuns(), page_size=3).run(max_pages=1)
+        # Neither the pages read nor the entities saved stay in the context.
+        assert not [key for key in ndb.get_context().cache if key.kind() == "Run"]
+    assert first["pages"] == 1 and not first["completed"]
+    rest = MigrationRunner(_TestRuns(), page_size=3).run()
+    assert rest["completed"]
+    assert rest["total_scanned"] == 7 and rest["total_changed"] == 3
+
+    with datastore_context():
+        runs = Run.query(Run.usernickname == "__pytest_migration__").fetch()
+    assert sorted(run.speed for run in runs) == [10.0] * 3 + [12.0] * 4
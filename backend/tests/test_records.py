@@ -0,0 +1,92 @@
+import random
+from datetime import date, time, timedelta
+
+from google.cloud import ndb
+
+from eridanus.models import Run
+from eridanus.repository import PushUpsRepository, RunRepository, StatisticsRepository
+from eridanus.statistics.records import KEPT_RECORDS, TOP_RECORDS, RecordList, Records
+
+
+def _run(identifier, distance, day=1):
+    return Run(key=ndb.Key(Run, identifier, project="test", namespace="", database=""),
+               usernickname="u", activity_date=date(2025, 1, day), distance=distance,
+               duration=30, calories=300)
+
+
+def test_record_list_keeps_the_exact_best_entries():
+    records = RecordList()
+    for identifier in range(1, 16):
+        records.add(float(identifier), identifier, date(2025, 1, identifier))
+
+    assert len(records.entries) == KEPT_RECORDS
+    assert records.truncated
+    assert records.entries[0] == [15.0, 15, "2025-01-15"]
+    # Lower than every kept entry of a truncated list: left out.
+    records.add(0.5, 99, None)
+    assert all(item[1] != 99 for item in records.entries)
+
+    # Deleting record holders promotes the next ones until the list runs
+    # out of spare entries.
+    for identifier in range(15, 15 - (KEPT_RECORDS - TOP_RECORDS), -1):
+        assert records.remove(identifier) is True
+    assert records.entries[0][1] == 10
+    assert records.remove(10) is False
+
+
+def test_build_matches_incremental_adds():
+    rng = random.Random(7)
+    runs = [_run(i + 1, rng.choice([None, round(rng.uniform(1, 20), 1)])) for i in range(200)]
+    incremental = Records()
+    for run in runs:
+        incremental.add(run)
+    # Every duration ties: the order of the history does not matter.
+    rng.shuffle(runs)
+    built = Records.build({"running": runs})
+    assert built.to_dict() == incremental.to_dict()
+    assert built.top("running", "distance", 1)[0]["value"] == max(run.distance or 0 for run in runs)
+
+
+def test_edited_holder_gives_way():
+    records = Records()
+    first, second = _run(1, 10.0), _run(2, 8.0, day=2)
+    records.add(first)
+    records.add(second)
+    assert records.best("running", "distance") == 10.0
+
+    edited = _run(1, 5.0)
+    assert records.remove(first) is True
+    records.add(edited)
+    assert [item["id"] for item in records.top("running", "distance")] == [2, 1]
+    assert records.best("pushups", "repetitions") == 0
+
+
+def test_records_follow_writes(datastore_emulator):
+    username = "__pytest_records__"
+    runs = RunRepository()
+    # The first run has an imported speed which is not distance over
+    # duration, and every run ties on calories.
+    created = [runs.create({"usernickname": username, "activity_date": date(2025, 1, 1) + timedelta(days=day),
+                            "activity_time": time(7, 0), "duration": 30 + day, "distance": 5.0 + day,
+                            "calories": 300, "speed": 20.0 if day == 0 else None})
+               for day in range(3)]
+    pushup = PushUpsRepository().create({"usernickname": username, "activity_date": date(2025, 1, 2),
+                                         "activity_time": time(8, 0), "duration": 2, "count": 40})
+    try:
+        repository = StatisticsRepository()
+        records = repository.records(username)
+        assert records.best("running", "distance") == 7.0
+        assert records.best("pushups", "rate") == 20.0
+
+        runs.delete(created[2].key.id())
+        records = repository.records(username)
+        assert [item["id"] for item in records.top("running", "distance")] == \
+            [created[1].key.id(), created[0].key.id()]
+
+        rebuilt = repository.rebuild_records(username)
+        assert rebuilt.records == records.to_dict()
+        assert records.best("running", "speed") == 20.0
+    finally:
+        for run in created[:2]:
+            runs.delete(run.key.id())
+        PushUpsRepository().delete(pushup.key.id())
@@ -0,0 +1,41 @@
+from datetime import date, time
+
+from eridanus.dashboard.services import DashboardService
+from eridanus.datastore import datastore_context
+from eridanus.repository import PushUpsRepository, RunRepository, StatisticsRepository, WeightRepository
+
+
+def test_async_reads_resolve_together(datastore_emulator):
+    username = "__pytest_async__"
+    runs, weights = RunRepository(), WeightRepository()
+    run = runs.create({"usernickname": username, "activity_date": date(2025, 1, 1),
+                       "activity_time": time(7, 0), "duration": 30, "distance": 5.0,
+                       "calories": 300})
+    weighing = weights.create({"usernickname": username, "weight": 80.0,
+                               "weighing_date": date(2025, 1, 1)})
+    pushup = PushUpsRepository().create({"usernickname": username, "activity_date": date(2025, 1, 2),
+                                         "activity_time": time(8, 0), "duration": 2, "count": 40,
+                                         "calories": 30})
+    try:
+        with datastore_context():
+            futures = [runs.read_async(run.key.id()),
+                       weights.fetch_by_username_async(username),
+                       runs.fetch_page_async(username, 10),
+                       runs.read_async("not-a-number")]
+            read, fetched, page, invalid = [future.result() for future in futures]
+
+        assert read.distance == 5.0
+        assert [item.weight for item in fetched] == [80.0]
+        assert page == ([run], None)
+        assert invalid is None
+
+        StatisticsRepository().rebuild_user_stats(username)
+        stats = DashboardService().home_stats(username)
+        assert stats["activities"]["running"]["count"] == 1
+        assert stats["weighing"]["last_weight"] == 80.0
+        assert stats["activities"]["pushups"]["rate_per_minute"] == 20.0
+        assert stats["activities"]["crunches"] == {}
+    finally:
+        PushUpsRepository().delete(pushup.key.id())
+        runs.delete(run.key.id())
+        weights.delete(weighing.key.id())
@@ -0,0 +1,53 @@
+from datetime import date
+
+from google.cloud import ndb
+
+from eridanus import repository
+from eridanus.repository import StatisticsRepository, WeightRepository
+
+
+def test_bulk_create_update_delete(datastore_emulator, monkeypatch):
+    monkeypatch.setattr(repository, "BATCH_SIZE", 2)
+    username = "__pytest_bulk__"
+    repo = WeightRepository()
+    repo.delete_many([item.key.id() for item in repo.fetch_by_username(username)])
+
+    created = repo.create_many([{"usernickname": username, "weight": 80.0 + day,
+                                 "weighing_date": date(2025, 3, day)} for day in range(1, 6)])
+    ids = [entity.key.id() for entity in created]
+    assert all(ids)
+    assert len(repo.fetch_by_username(username)) == 5
+
+    updated = repo.update_many([{"id": ids[0], "weight": 70.0},
+                                {"id": "not-a-number", "weight": 1.0},
+                                {"id": 999999999, "weight": 1.0}])
+    assert updated[0].weight == 70.0
+    assert updated[1:] == [None, None]
+    assert repo.read(ids[0]).weight == 70.0
+
+    stats = StatisticsRepository().weighing_stats(username)
+    assert stats["count"] == 5
+    assert stats["min"] == 70.0
+    assert stats["trend"] == ""
+    assert set(stats["weight_trend"]) == {"smoothed", "kg_per_week"}
+
+    assert repo.delete_many(ids + [999999999, "x"]) == [True] * 5 + [False, False]
+    assert repo.fetch_by_username(username) == []
+    assert StatisticsRepository().weighing_stats(username) == {}
+
+
+def test_iteration_leaves_the_context_cache_empty(datastore_emulator, monkeypatch):
+    monkeypatch.setattr(repository, "BATCH_SIZE", 2)
+    username = "__pytest_iterate__"
+    repo = WeightRepository()
+    repo.delete_many([item.key.id() for item in repo.fetch_by_username(username)])
+    created = repo.create_many([{"usernickname": username, "weight": 80.0 + day,
+                                 "weighing_date": date(2025, 4, day)} for day in range(1, 8)])
+    try:
+        sizes = []
+        for _ in repo.iter_by_username(username, batch_size=2):
+            sizes.append(len(ndb.get_context().cache))
+        assert len(sizes) == 7
+        assert max(sizes) == 0
+    finally:
+        repo.delete_many([entity.key.id() for entity in created])
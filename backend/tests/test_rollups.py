@@ -0,0 +1,110 @@
+from datetime import date, time
+
+import eridanus.dashboard.blueprint as dashboard_blueprint
+from eridanus.dashboard.services import DashboardService
+from eridanus.models import PushUp, Run
+from eridanus.repository import PushUpsRepository, RunRepository, StatisticsRepository
+from eridanus.statistics.rollups import _merged, accumulate, bucket, bucket_start, last_buckets
+
+
+def _run(day, distance, duration=30, calories=300):
+    return Run(usernickname="u", activity_date=day, activity_time=time(7, 0),
+               distance=distance, duration=duration, calories=calories)
+
+
+def test_buckets_follow_iso_weeks():
+    # 2024-12-30 is the Monday of the first ISO week of 2025.
+    assert bucket(date(2024, 12, 30), "week") == "2025-W01"
+    assert bucket(date(2024, 12, 30), "month") == "2024-12"
+    assert bucket(date(2024, 12, 30), "year") == "2024"
+    assert bucket_start("2025-W01") == date(2024, 12, 30)
+    assert bucket_start("2024-02") == date(2024, 2, 1)
+    assert last_buckets("week", 3, date(2025, 1, 8)) == ["2024-W52", "2025-W01", "2025-W02"]
+    assert last_buckets("month", 3, date(2025, 1, 31)) == ["2024-11", "2024-12", "2025-01"]
+    assert last_buckets("year", 2, date(2025, 6, 1)) == ["2024", "2025"]
+
+
+def test_add_and_remove_are_exact():
+    rollups = {}
+    accumulate(rollups, "u", _run(date(2024, 12, 30), 5.0))
+    accumulate(rollups, "u", _run(date(2025, 1, 2), 10.0))
+    accumulate(rollups, "u", PushUp(usernickname="u", activity_date=date(2025, 1, 2), count=40))
+
+    running_2025 = rollups[("u", "running", 2025)]
+    assert running_2025["2025-W01"]["count"] == 2
+    assert running_2025["2025-W01"]["distance"] == 15.0
+    assert running_2025["2025-01"]["distance"] == 10.0
+    assert rollups[("u", "running", 2024)]["2024-12"]["distance"] == 5.0
+    assert rollups[("u", "pushups", 2025)]["2025"]["repetitions"] == 40
+
+    deltas = {}
+    accumulate(deltas, "u", _run(date(2025, 1, 2), 10.0), -1)
+    merged = _merged(running_2025, deltas[("u", "running", 2025)])
+    assert merged["2025-W01"]["count"] == 1
+    # The month and the year are left without runs.
+    assert "2025-01" not in merged and "2025" not in merged
+
+
+def test_period_stats_compare_the_last_two_buckets():
+    class FakeRepository:
+        def rollups(self, username, kind, labels):
+            totals = {label: {"count": 0, "distance": 0.0, "duration": 0, "calories": 0,
+                              "repetitions": 0} for label in labels}
+            totals["2025-02"].update(count=4, distance=20.0)
+            totals["2025-03"].update(count=5, distance=30.0)
+            return totals
+
+    stats = DashboardService(FakeRepository()).period_stats(
+        "u", "running", "month", count=3, today=date(2025, 3, 15))
+    assert [item["bucket"] for item in stats["buckets"]] == ["2025-01", "2025-02", "2025-03"]
+    assert stats["buckets"][0]["start"] == "2025-01-01"
+    assert stats["change"]["distance"] == 50.0
+    assert stats["change"]["calories"] is None
+
+
+def test_period_routes(client, monkeypatch):
+    class FakeDashboardService:
+        def period_stats(self, username, kind, period, count=None):
+            if kind != "running":
+                raise ValueError(f"Unknown activity '{kind}'.")
+            totals = {"count": 1, "distance": 5.0, "duration": 30, "calories": 300, "repetitions": 0}
+            current = dict(totals, bucket="2025-03", start="2025-03-01")
+            previous = dict(totals, bucket="2025-02", start="2025-02-01")
+            return {"kind": kind, "period": period, "buckets": [previous, current],
+                    "current": current, "previous": previous,
+                    "change": {field: 0.0 for field in totals}}
+
+    monkeypatch.setattr(dashboard_blueprint, "DashboardService", FakeDashboardService)
+    assert client.get("/dashboard/running/month/").status_code == 200
+    assert client.get("/dashboard/swimming/month/").status_code == 404
+
+
+def test_rollups_follow_writes(datastore_emulator):
+    username = "__pytest_rollups__"
+    runs, pushups = RunRepository(), PushUpsRepository()
+    labels = ["2025-W01", "2025-01", "2025"]
+    run = runs.create({"usernickname": username, "activity_date": date(2025, 1, 2),
+                       "activity_time": time(7, 0), "duration": 30, "distance": 5.0,
+                       "calories": 300})
+    pushup = pushups.create({"usernickname": username, "activity_date": date(2025, 1, 3),
+                             "activity_time": time(8, 0), "duration": 5, "count": 50,
+                             "calories": 40})
+    try:
+        repository = StatisticsRepository()
+        totals = repository.rollups(username, "running", labels)
+        assert [totals[label]["distance"] for label in labels] == [5.0, 5.0, 5.0]
+        assert repository.rollups(username, "pushups", ["2025"])["2025"]["repetitions"] == 50
+
+        runs.update({"id": run.key.id(), "usernickname": username, "activity_date": date(2025, 2, 2),
+                     "activity_time": time(7, 0), "duration": 30, "distance": 8.0, "calories": 300})
+        totals = repository.rollups(username, "running", labels + ["2025-02"])
+        assert totals["2025-01"]["count"] == 0
+        assert totals["2025-02"]["distance"] == 8.0
+        assert totals["2025"]["count"] == 1
+
+        rebuilt = repository.rebuild_rollups(username)
+        assert {entity.key.id() for entity in rebuilt} == {f"{username}:running:2025",
+                                                          f"{username}:pushups:2025"}
+    finally:
+        runs.delete(run.key.id())
+        pushups.delete(pushup.key.id())
@@ -1,30 +1,200 @@
 import eridanus.activities.pushups.blueprint as pushups_blueprint
 import eridanus.activities.jump_rope.blueprint as jump_rope_blueprint
+import eridanus.api.resources.dashboard as dashboard_resource
 import eridanus.dashboard.blueprint as dashboard_blueprint
 
 
+def _empty_page(username, cursor=None, page_size=None):
+    return {"items": [], "next_cursor": None}
+
+
 def test_home_redirects(client):
     response = client.get("/")
     assert response.status_code in (301, 302)
 
 
+def _dashboard_stats():
+    running = {
+        "avg_calories": 300.0, "avg_speed": 10.0, "avg_distance": 5.0, "avg_time": 30.0,
+        "count": 2, "date_last_run": "2025-01-02", "days_from_last_run": 1,
+        "max_calories": 350, "max_distance": 6.0, "max_speed": 11.0, "max_time": 33,
+        "total_distance": 10.0, "total_time": 60, "total_calories": 600,
+    }
+    weighing = {
+        "avg": 80.0, "avg_last20": 80.0, "count": 2, "growth_rate_last20": -0.5,
+        "last_weight": 79.6, "max": 80.4, "min": 79.6,
+        "trend": "",
+        "weight_trend": {"smoothed": 79.8, "kg_per_week": -0.4},
+    }
+    pushups = {
+        "avg_repetitions": 40.0, "avg_time": 3.5, "count": 2, "date_last": "2025-01-02",
+        "days_from_last": 1, "max_rate": 15.0, "max_repetitions": 50, "max_time": 5,
+        "rate_per_minute": 11.4, "total_calories": 60, "total_repetitions": 80, "total_time": 7,
+    }
+    return {
+        "bmi": {"bmi": 24.0, "status": "Normal"},
+        "activities": {"running": running, "pushups": pushups, "crunches": {}, "jump_rope": {}},
+        "weighing": weighing,
+        "objectives": {"weight": 82.5, "weight_date": "2025-03-01"},
+    }
+
+
 def test_dashboard_route_ok(client, monkeypatch):
     class FakeDashboardService:
-        def home_stats(self, username):
-            return {"ok": True}
+        def data_version(self, username):
+            return 1
+
+        def cached_home_stats(self, username, version):
+            return _dashboard_stats()
 
     monkeypatch.setattr(dashboard_blueprint, "DashboardService", FakeDashboardService)
     response = client.get("/dashboard/")
     assert response.status_code == 200
+    assert "-0.40</span> kg/week" in response.get_data(as_text=True)
+
+
+class _FakeDashboardService:
+    version = 1
+    computed = 0
+
+    def data_version(self, username):
+        return self.version
+
+    def cached_home_stats(self, username, version):
+        _FakeDashboardService.computed += 1
+        return _dashboard_stats()
+
+
+def test_dashboard_answers_304_until_the_data_changes(client, monkeypatch):
+    monkeypatch.setattr(dashboard_blueprint, "DashboardService", _FakeDashboardService)
+    monkeypatch.setattr(_FakeDashboardService, "computed", 0)
+
+    response = client.get("/dashboard/")
+    assert response.status_code == 200
+    tag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    response = client.get("/dashboard/", headers={"If-None-Match": tag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == tag
+    assert _FakeDashboardService.computed == 1
+
+    monkeypatch.setattr(_FakeDashboardService, "version", 2)
+    response = client.get("/dashboard/", headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != tag
+
+
+def test_api_stats_answer_304(client, monkeypatch):
+    monkeypatch.setattr(dashboard_resource, "DashboardService", _FakeDashboardService)
+    response = client.get("/api/v1/stats/")
+    assert response.status_code == 200
+    tag = response.headers["ETag"]
+    # The page and the JSON have tags of their own.
+    monkeypatch.setattr(dashboard_blueprint, "DashboardService", _FakeDashboardService)
+    assert client.get("/dashboard/").headers["ETag"] != tag
+    assert client.get("/api/v1/stats/", headers={"If-None-Match": tag}).status_code == 304
 
 
 def test_pushups_list_ok(client, monkeypatch):
-    monkeypatch.setattr(pushups_blueprint.service, "fetch_all", lambda username: [])
+    monkeypatch.setattr(pushups_blueprint.service, "fetch_all", _empty_page)
     response = client.get("/activities/pushups/")
     assert response.status_code == 200
 
 
 def test_jump_rope_list_ok(client, monkeypatch):
-    monkeypatch.setattr(jump_rope_blueprint.service, "fetch_all", lambda username: [])
+    monkeypatch.setattr(jump_rope_blueprint.service, "fetch_all", _empty_page)
     response = client.get("/activities/jump_rope/")
     assert response.status_code == 200
+
+
+def test_requests_without_datastore_open_no_context(client, monkeypatch):
+    import eridanus.datastore as datastore
+
+    def fail():
+        raise AssertionError("ndb context opened")
+
+    monkeypatch.setattr(datastore, "open_context", fail)
+    assert client.get("/").status_code in (301, 302)
+    monkeypatch.setattr(pushups_blueprint.service, "fetch_all", _empty_page)
+    assert client.get("/activities/pushups/").status_code == 200
+
+
+def test_unauthorized_request_opens_no_context(client, monkeypatch):
+    import main
+    import eridanus.datastore as datastore
+
+    def fail():
+        raise AssertionError("ndb context opened")
+
+    monkeypatch.setattr(datastore, "open_context", fail)
+    monkeypatch.setattr(main, "allowed_user_email", "someone-else@example.com")
+    assert client.get("/dashboard/").status_code == 401
+
+
+def test_list_pages_link_to_the_next_page(client, monkeypatch):
+    pages = {}
+
+    def fetch_all(username, cursor=None, page_size=None):
+        pages["cursor"] = cursor
+        return {"items": [], "next_cursor": "next-page"}
+
+    monkeypatch.setattr(pushups_blueprint.service, "fetch_all", fetch_all)
+    response = client.get("/activities/pushups/?cursor=this-page")
+    assert response.status_code == 200
+    assert pages["cursor"] == "this-page"
+    assert b"cursor=next-page" in response.data
+
+
+def test_page_sizes_are_bounded():
+    from eridanus.services import MAX_PAGE_SIZE
+    service = pushups_blueprint.service
+    assert service.page_size(100000) == MAX_PAGE_SIZE
+    assert service.page_size(-5) == 1
+    assert service.page_size(None) == service.page_size(0) > 1
+
+
+def test_export_streams_a_zip(client, monkeypatch):
+    import eridanus.admin.blueprint as admin_blueprint
+    from io import BytesIO
+    from zipfile import ZipFile
+    from eridanus.utils.zipstream import stream_zip
+
+    class FakeExportDataService:
+        def export_zip(self, username, format):
+            return stream_zip([("run.csv", iter([b"a,b\r\n"]))])
+
+    monkeypatch.setattr(admin_blueprint, "ExportDataService", FakeExportDataService)
+    response = client.get("/admin/export/csv/")
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert ZipFile(BytesIO(response.data)).read("run.csv") == b"a,b\r\n"
+
+
+def test_import_is_submitted_by_post_only(client, monkeypatch):
+    import eridanus.admin.blueprint as admin_blueprint
+    submitted = []
+    monkeypatch.setattr(admin_blueprint.jobs, "submit", lambda *args: submitted.append(args))
+    monkeypatch.setattr(admin_blueprint, "_submitted", lambda job: ("", 202))
+
+    assert client.get("/admin/import/eridanus_data").status_code == 405
+    assert submitted == []
+    assert client.post("/admin/import/eridanus_data").status_code == 202
+    assert submitted == [("import", "dev", {"folder": "eridanus_data"})]
+
+
+def test_rebuild_stats_is_for_the_allowed_user_only(client, monkeypatch):
+    import eridanus.admin.blueprint as admin_blueprint
+    rebuilt = []
+
+    class FakeStatisticsRepository:
+        def rebuild_user_stats(self, username):
+            rebuilt.append(username)
+
+    monkeypatch.setattr(admin_blueprint, "StatisticsRepository", FakeStatisticsRepository)
+    monkeypatch.setattr(admin_blueprint.Configuration, "ALLOWED_USER_EMAIL", "someone@example.com")
+    assert client.post("/admin/rebuild_stats").status_code == 403
+    assert rebuilt == []
+    monkeypatch.setattr(admin_blueprint.Configuration, "ALLOWED_USER_EMAIL", "dev@example.com")
+    assert client.post("/admin/rebuild_stats").status_code == 200
+    assert rebuilt == ["dev"]
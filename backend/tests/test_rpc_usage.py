@@ -0,0 +1,129 @@
+from datetime import date, time
+
+import pytest
+from google.cloud.datastore_v1.types import datastore as datastore_pb2
+from google.cloud.datastore_v1.types import entity as entity_pb2
+from google.cloud.datastore_v1.types import query as query_pb2
+
+from eridanus import rpc_usage
+from eridanus.datastore import ChannelPool
+from eridanus.repository import RunRepository
+
+
+def _key(identifier):
+    return entity_pb2.Key(partition_id=entity_pb2.PartitionId(project_id="test"),
+                          path=[entity_pb2.Key.PathElement(kind="Run", id=identifier)])
+
+
+def _lookup(*identifiers):
+    return datastore_pb2.LookupRequest(project_id="test", keys=[_key(i) for i in identifiers])
+
+
+def _found(*identifiers):
+    return datastore_pb2.LookupResponse(
+        found=[query_pb2.EntityResult(entity=entity_pb2.Entity(key=_key(i))) for i in identifiers])
+
+
+class _Future:
+    def __init__(self, response=None, error=None):
+        self.response = response
+        self.error = error
+
+    def add_done_callback(self, callback):
+        callback(self)
+
+    def exception(self):
+        return self.error
+
+    def result(self):
+        return self.response
+
+
+class _Channel:
+    """Answers every call with the response it was given."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def unary_unary(self, method, request_serializer=None, response_deserializer=None):
+        channel = self
+
+        class Callable:
+            def future(self, request, *args, **kwargs):
+                return _Future(channel.response)
+
+            def __call__(self, request, *args, **kwargs):
+                return channel.response
+        return Callable()
+
+
+def test_usage_counts_calls_entities_and_bytes():
+    with rpc_usage.track() as outer:
+        with rpc_usage.track() as inner:
+            inner.record_call("Lookup", _lookup(1, 2, 3), _Future(_found(1, 2)))
+            inner.record_call("Commit", datastore_pb2.CommitRequest(), _Future(error=RuntimeError()))
+        outer.record_call("RunQuery", datastore_pb2.RunQueryRequest())
+    assert rpc_usage.current() is None
+
+    counters = inner.to_dict()
+    assert counters["datastore_calls"] == {"Lookup": 1, "Commit": 1}
+    assert counters["datastore_entities_read"] == 2
+    assert counters["datastore_errors"] == 1
+    assert counters["datastore_bytes_sent"] == datastore_pb2.LookupRequest.pb(_lookup(1, 2, 3)).ByteSize()
+    assert counters["datastore_bytes_received"] == datastore_pb2.LookupResponse.pb(_found(1, 2)).ByteSize()
+    # The outer usage sees the calls of the inner one too.
+    assert outer.to_dict()["datastore_calls"] == {"Lookup": 1, "Commit": 1, "RunQuery": 1}
+
+
+def test_channel_pool_records_calls_in_the_current_usage():
+    pool = ChannelPool([_Channel(_found(1))])
+    lookup = pool.unary_unary("/google.datastore.v1.Datastore/Lookup")
+    lookup.future(_lookup(1))
+    with rpc_usage.track() as usage:
+        lookup.future(_lookup(1))
+        lookup(_lookup(1))
+    assert usage.calls == {"Lookup": 2}
+    assert usage.entities_read == 2
+
+
+def test_single_entity_calls_in_a_loop_are_reported():
+    usage = rpc_usage.RpcUsage()
+    for identifier in range(12):
+        usage.record_call("Lookup", _lookup(identifier))
+    usage.record_call("Lookup", _lookup(1, 2))
+    assert usage.repeated() == {"Lookup": 12}
+    assert usage.repeated(threshold=13) == {}
+
+
+def test_budget_fails_when_exceeded(rpc_budget):
+    with rpc_budget(2, Lookup=1):
+        rpc_usage.current().record_call("Lookup", _lookup(1))
+        rpc_usage.current().record_call("RunQuery", datastore_pb2.RunQueryRequest())
+
+    with pytest.raises(rpc_usage.RpcBudgetExceeded, match="2 Lookup calls \\(budget 1\\)"):
+        with rpc_budget(Lookup=1):
+            rpc_usage.current().record_call("Lookup", _lookup(1))
+            rpc_usage.current().record_call("Lookup", _lookup(2))
+
+
+def test_route_budgets(datastore_emulator, client, rpc_budget):
+    runs = RunRepository()
+    # The transaction, one lookup for every listener, the id and the commit.
+    with rpc_budget(4, Lookup=1, Commit=1):
+        run = runs.create({"usernickname": "dev", "activity_date": date(2025, 1, 1),
+                           "activity_time": time(7, 0), "duration": 30, "distance": 5.0})
+    try:
+        # One transaction: the entity and the derived data in one commit.
+        with rpc_budget(4, Lookup=2, Commit=1, RunQuery=0):
+            runs.update({"id": run.key.id(), "distance": 6.0})
+
+        client.get("/dashboard/")
+        # The data version and the snapshot, nothing is aggregated.
+        with rpc_budget(2, RunQuery=0):
+            response = client.get("/dashboard/")
+        with rpc_budget(1):
+            assert client.get("/dashboard/", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+        with rpc_budget(3, RunQuery=1):
+            client.get("/activities/running/")
+    finally:
+        runs.delete(run.key.id())
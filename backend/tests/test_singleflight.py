@@ -0,0 +1,175 @@
+import threading
+import time
+from datetime import date
+
+import pytest
+
+from eridanus import singleflight
+from eridanus.dashboard.services import DashboardService
+from eridanus.singleflight import SingleFlight
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+def _start(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def _join(threads):
+    for thread in threads:
+        thread.join(5.0)
+        assert not thread.is_alive()
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    executions = []
+    results = []
+
+    def compute():
+        executions.append(threading.get_ident())
+        release.wait(5.0)
+        return {"value": 42}
+
+    threads = _start(8, lambda: results.append(flight.do(("u", "stats", 1), compute)))
+    # Every caller is either running the computation or waiting for it.
+    _wait_for(lambda: flight.snapshot()["calls"] == 8)
+    release.set()
+    _join(threads)
+
+    assert len(executions) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert flight.snapshot() == {"calls": 8, "executions": 1, "coalesced": 7, "errors": 0, "in_flight": 0}
+
+
+def test_an_error_reaches_every_waiter_and_is_not_kept():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        release.wait(5.0)
+        raise ValueError("boom")
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except ValueError as exc:
+            errors.append(exc)
+
+    threads = _start(4, call)
+    _wait_for(lambda: flight.snapshot()["calls"] == 4)
+    release.set()
+    _join(threads)
+
+    assert len(errors) == 4
+    assert flight.snapshot()["errors"] == 1
+    # The next call runs the function again.
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_different_keys_and_later_calls_run_separately():
+    flight = SingleFlight()
+    both_running = threading.Barrier(2, timeout=5.0)
+
+    def compute(version):
+        # Deadlocks unless both keys run at the same time.
+        both_running.wait()
+        return version
+
+    results = {}
+    threads = [threading.Thread(target=lambda v=v: results.update({v: flight.do(("u", v), compute, v)}))
+               for v in (1, 2)]
+    for thread in threads:
+        thread.start()
+    _join(threads)
+    assert results == {1: 1, 2: 2}
+
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.snapshot()["coalesced"] == 0
+
+
+def test_counters_add_up_under_contention():
+    flight = SingleFlight()
+    executions = {}
+    lock = threading.Lock()
+
+    def compute(key):
+        with lock:
+            executions[key] = executions.get(key, 0) + 1
+        time.sleep(0.001)
+        return key
+
+    def call(index):
+        for round_ in range(50):
+            key = (index + round_) % 3
+            assert flight.do(key, compute, key) == key
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(12)]
+    for thread in threads:
+        thread.start()
+    _join(threads)
+
+    counters = flight.snapshot()
+    assert counters["calls"] == 12 * 50
+    assert counters["executions"] + counters["coalesced"] == counters["calls"]
+    assert counters["executions"] == sum(executions.values())
+    assert counters["in_flight"] == 0
+
+
+def test_a_forked_process_gets_its_own_group(monkeypatch):
+    group = singleflight.get_single_flight()
+    assert singleflight.get_single_flight() is group
+    monkeypatch.setattr(singleflight, "_group_pid", -1)
+    assert singleflight.get_single_flight() is not group
+
+
+class _Repository:
+    def __init__(self):
+        self.saved = []
+
+    def dashboard_snapshot(self, username):
+        return None
+
+    def save_dashboard_snapshot(self, username, version, day, stats):
+        self.saved.append(version)
+
+
+@pytest.mark.parametrize("versions, computed", [((3, 3, 3, 3), 1), ((3, 4, 3, 4), 2)])
+def test_dashboard_requests_for_the_same_version_compute_once(monkeypatch, versions, computed):
+    monkeypatch.setattr(singleflight, "_group", SingleFlight())
+    monkeypatch.setattr(singleflight, "_group_pid", singleflight.os.getpid())
+    repository = _Repository()
+    service = DashboardService(repository)
+    release = threading.Event()
+    calls = []
+
+    def home_stats(username):
+        calls.append(username)
+        release.wait(5.0)
+        return {"user": username}
+
+    monkeypatch.setattr(service, "home_stats", home_stats)
+    results = []
+    threads = [threading.Thread(target=lambda v=v: results.append(
+        service.cached_home_stats("u", v, today=date(2025, 1, 1)))) for v in versions]
+    for thread in threads:
+        thread.start()
+    _wait_for(lambda: singleflight.single_flight_metrics()["calls"] == len(versions))
+    release.set()
+    _join(threads)
+
+    assert len(calls) == computed
+    assert sorted(repository.saved) == sorted(set(versions))
+    assert results == [{"user": "u"}] * len(versions)
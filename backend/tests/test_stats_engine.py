@@ -0,0 +1,85 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+from google.cloud import ndb
+
+from eridanus.models import PushUp, Run, Weight
+from eridanus.statistics.engine import ActivityColumns, RunColumns, WeightColumns
+from eridanus.statistics.user_stats import ActivityTotals, RunningTotals, WeighingTotals
+
+
+def _maybe(rng, value):
+    return None if rng.random() < 0.1 else value
+
+
+def _runs(rng, count):
+    start = date(2020, 1, 1)
+    return [Run(activity_date=_maybe(rng, start + timedelta(days=rng.randrange(2000))),
+                distance=_maybe(rng, round(rng.uniform(1, 20), 2)),
+                duration=_maybe(rng, rng.choice([0, rng.randrange(10, 120)])),
+                calories=_maybe(rng, rng.randrange(100, 1200)),
+                speed=None if rng.random() < 0.6 else round(rng.uniform(6, 16), 2))
+            for _ in range(count)]
+
+
+def _weighings(rng, count):
+    start = date(2020, 1, 1)
+    return [Weight(key=ndb.Key(Weight, i + 1, project="test", namespace="", database=""),
+                   weighing_date=_maybe(rng, start + timedelta(days=rng.randrange(60))),
+                   weight=_maybe(rng, round(rng.uniform(70, 90), 1)))
+            for i in range(count)]
+
+
+def _pushups(rng, count):
+    start = date(2020, 1, 1)
+    return [PushUp(activity_date=_maybe(rng, start + timedelta(days=rng.randrange(2000))),
+                   count=_maybe(rng, rng.randrange(5, 100)),
+                   duration=_maybe(rng, rng.choice([0, rng.randrange(1, 20)])),
+                   calories=_maybe(rng, rng.randrange(10, 200)))
+            for _ in range(count)]
+
+
+def _approx(expected):
+    return {key: _approx(value) if isinstance(value, dict)
+            else pytest.approx(value) if isinstance(value, float) else value
+            for key, value in expected.items()}
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_run_totals_match_incremental_totals(seed):
+    runs = _runs(random.Random(seed), 500)
+    incremental = RunningTotals()
+    for run in runs:
+        incremental.add(run)
+    assert RunColumns.from_runs(runs).totals() == _approx(incremental.to_dict())
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_weight_totals_match_incremental_totals(seed):
+    # The trend is only kept incrementally for weighings in date order.
+    weighings = sorted(_weighings(random.Random(seed), 300), key=lambda item: item.weighing_date or date.min)
+    incremental = WeighingTotals()
+    for weighing in weighings:
+        incremental.add(weighing)
+    assert WeightColumns.from_weighings(weighings).totals() == _approx(incremental.to_dict())
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_activity_totals_match_incremental_totals(seed):
+    pushups = _pushups(random.Random(seed), 500)
+    incremental = ActivityTotals()
+    for pushup in pushups:
+        incremental.add(pushup)
+    assert ActivityColumns.from_activities(pushups).totals() == _approx(incremental.to_dict())
+
+
+def test_empty_histories():
+    assert RunColumns.from_runs([]).totals() == RunningTotals().to_dict()
+    assert ActivityColumns.from_activities([]).totals() == ActivityTotals().to_dict()
+    assert WeightColumns.from_weighings([]).totals() == WeighingTotals().to_dict()
+
+
+def test_projected_runs_derive_speed():
+    runs = [Run(projection=("distance", "duration"), distance=10.0, duration=60)]
+    assert RunColumns.from_runs(runs).totals()["max_speed"] == 10.0
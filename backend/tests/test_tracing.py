@@ -0,0 +1,178 @@
+import contextlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from google.cloud import ndb
+
+import eridanus.dashboard.blueprint as dashboard_blueprint
+from eridanus import datastore, tracing
+
+
+@pytest.fixture()
+def traced(monkeypatch):
+    monkeypatch.setenv("TRACING", "1")
+    monkeypatch.setenv("TRACING_EXPORTER", "")
+    tracing.reset_exporter()
+    yield
+    tracing.finish_trace()
+    tracing.reset_exporter()
+
+
+class _Repository:
+    @datastore.uses_datastore
+    def read(self, identifier):
+        with tracing.span("inner", "code", identifier=identifier):
+            return identifier
+
+
+class _AsyncRepository:
+    def __init__(self):
+        self.future = ndb.Future()
+
+    @datastore.uses_datastore
+    def read_async(self, identifier):
+        return self.future
+
+
+def test_disabled_tracing_does_nothing(monkeypatch):
+    monkeypatch.delenv("TRACING", raising=False)
+    assert tracing.start_trace("request") is None
+    assert not tracing.active()
+    with tracing.span("anything") as span:
+        assert span is None
+    assert tracing.finish_trace() is None
+
+
+def test_spans_nest_under_the_request(traced, monkeypatch):
+    monkeypatch.setattr(datastore, "datastore_context", contextlib.nullcontext)
+
+    @tracing.traced()
+    def service():
+        return _Repository().read(7) + _Repository().read(8)
+
+    trace = tracing.start_trace("request")
+    assert service() == 15
+    assert tracing.finish_trace() is trace
+    assert not tracing.active()
+
+    names = [(span["name"], span["depth"]) for span in trace.summary()["spans"]]
+    assert names == [("test_spans_nest_under_the_request.<locals>.service", 1),
+                     ("_Repository.read", 2), ("inner", 3), ("_Repository.read", 2), ("inner", 3)]
+    header = trace.server_timing()
+    assert header.startswith("total;dur=")
+    assert '_Repository.read;dur=' in header and 'desc="x2"' in header
+
+
+def test_async_spans_end_when_their_future_resolves(traced, monkeypatch):
+    monkeypatch.setattr(datastore, "datastore_context", contextlib.nullcontext)
+    repository = _AsyncRepository()
+
+    trace = tracing.start_trace("request")
+    future = repository.read_async(7)
+    with tracing.span("sibling"):
+        pass
+    span = trace.spans[1]
+    assert span.end is None
+    time.sleep(0.02)
+    future.set_result(7)
+    assert span.end is not None and span.duration_ms >= 20
+    tracing.finish_trace()
+    names = [(span["name"], span["depth"]) for span in trace.summary()["spans"]]
+    assert names == [("_AsyncRepository.read_async", 1), ("sibling", 1)]
+
+
+def test_otlp_export_keeps_the_parents(traced, tmp_path):
+    trace = tracing.start_trace("request", traceparent="00-" + "a" * 32 + "-" + "b" * 16 + "-01")
+    with tracing.span("outer"):
+        with pytest.raises(ValueError):
+            with tracing.span("failing"):
+                raise ValueError("boom")
+    tracing.finish_trace()
+
+    exporter = tracing.BatchExporter(tracing.FileExporter(str(tmp_path / "traces.jsonl")))
+    exporter.submit(trace)
+    exporter.submit(trace)
+    exporter.flush()
+    lines = (tmp_path / "traces.jsonl").read_text().splitlines()
+    spans = [span for line in lines
+             for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]][:3]
+
+    root, outer, failing = spans
+    assert {span["traceId"] for span in spans} == {"a" * 32}
+    assert root["parentSpanId"] == "b" * 16 and root["kind"] == tracing.SPAN_KIND_SERVER
+    assert outer["parentSpanId"] == root["spanId"]
+    assert failing["parentSpanId"] == outer["spanId"]
+    assert failing["status"]["code"] == 2
+    assert int(root["startTimeUnixNano"]) <= int(outer["startTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+    assert exporter.exported == 2
+
+
+def test_otlp_http_exporter_posts_json():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append((self.path, self.headers["Content-Type"],
+                             json.loads(self.rfile.read(int(self.headers["Content-Length"])))))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    try:
+        tracing.OtlpHttpExporter(f"http://127.0.0.1:{server.server_port}/v1/traces").export({"resourceSpans": []})
+    finally:
+        thread.join(5.0)
+        server.server_close()
+    assert received == [("/v1/traces", "application/json", {"resourceSpans": []})]
+
+
+def test_requests_carry_server_timing_and_log_the_spans(traced, client, monkeypatch, caplog):
+    class FakeDashboardService:
+        @tracing.traced()
+        def heatmap(self, username, year=None):
+            return {"year": 2025, "start": "2024-12-30", "weeks": [], "current_streak": 0,
+                    "longest_streak": 0, "days_since_last": None, "active_days": 0, "year_active_days": 0}
+
+    monkeypatch.setattr(dashboard_blueprint, "DashboardService", FakeDashboardService)
+    with caplog.at_level(logging.INFO, logger="main"):
+        response = client.get("/dashboard/calendar/")
+    assert response.status_code == 200
+    header = response.headers["Server-Timing"]
+    assert "FakeDashboardService.heatmap;dur=" in header
+    # Server-Timing names are tokens.
+    assert "render_dashboard_calendar.html;dur=" in header
+
+    record = [record for record in caplog.records if record.getMessage() == "request completed"][-1]
+    assert [span["category"] for span in record.spans] == ["service", "template"]
+    assert len(record.trace_id) == 32
+
+
+def test_untraced_requests_have_no_header(client, monkeypatch):
+    monkeypatch.setenv("TRACING", "0")
+    assert "Server-Timing" not in client.get("/").headers
+
+
+def test_failed_templates_end_their_span(traced, app, monkeypatch):
+    from flask import render_template_string
+
+    @app.route("/__pytest_broken__")
+    def broken():
+        return render_template_string("{{ missing.attribute }}")
+
+    app.config["PROPAGATE_EXCEPTIONS"] = False
+    traces, start_trace = [], tracing.start_trace
+    monkeypatch.setattr(tracing, "start_trace", lambda *args, **kwargs: traces.append(start_trace(*args, **kwargs)))
+    assert app.test_client().get("/__pytest_broken__").status_code == 500
+    rendering = [span for span in traces[0].spans if span.category == "template"]
+    assert len(rendering) == 1 and rendering[0].end is not None
+    assert rendering[0].error.startswith("UndefinedError")
+    assert not tracing.active()
@@ -0,0 +1,61 @@
+from datetime import date, timedelta
+
+import pytest
+
+from eridanus.models import Weight
+from eridanus.statistics.trend import REGRESSION_WINDOW, WeightTrend
+from eridanus.statistics.user_stats import WeighingTotals
+
+
+def _weighing(day, weight):
+    return Weight(usernickname="u", weighing_date=day, weight=weight)
+
+
+def test_slope_of_a_steady_loss():
+    trend = WeightTrend()
+    start = date(2025, 1, 1)
+    for day in range(60):
+        assert trend.add(_weighing(start + timedelta(days=day), 100.0 - 0.1 * day))
+
+    assert len(trend.window) == REGRESSION_WINDOW
+    assert trend.slope_per_week == pytest.approx(-0.7)
+    # The smoothed weight lags behind the last weighing of a falling series.
+    assert 94.1 < trend.smoothed < 95.5
+    target = trend.projected_date(90.0)
+    # About 51 days after the last weighing, at 0.1 kg a day from 95.06 kg.
+    assert target == start + timedelta(days=110)
+    assert trend.projected_date(110.0) is None
+
+
+def test_sums_match_a_fit_of_the_window():
+    trend = WeightTrend()
+    weights = [80.0, 80.4, 79.9, 81.2, 80.7, 80.1, 79.5, 79.8, 80.9, 79.2] * 5
+    for day, weight in enumerate(weights):
+        trend.add(_weighing(date(2025, 1, 1) + timedelta(days=day * 2), weight))
+
+    xs = [x for x, _ in trend.window]
+    ys = [y for _, y in trend.window]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    expected = (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+                / sum((x - mean_x) ** 2 for x in xs))
+    assert trend.slope == pytest.approx(expected)
+
+
+def test_round_trip_and_irregular_weighings():
+    trend = WeightTrend()
+    trend.add(_weighing(date(2025, 1, 1), 90.0))
+    assert trend.slope is None
+    # Two weeks apart, the new weighing counts three quarters.
+    trend.add(_weighing(date(2025, 1, 15), 86.0))
+    assert trend.smoothed == pytest.approx(87.0)
+    restored = WeightTrend(trend.to_dict())
+    assert restored.to_dict() == trend.to_dict()
+    assert restored.slope_per_week == pytest.approx(-2.0)
+
+
+def test_out_of_order_and_removed_weighings_need_a_rebuild():
+    totals = WeighingTotals()
+    assert totals.add(_weighing(date(2025, 1, 10), 80.0)) is True
+    assert totals.add(_weighing(date(2025, 1, 5), 81.0)) is False
+    assert totals.add(Weight(usernickname="u", weighing_date=date(2025, 1, 1))) is True
+    assert WeighingTotals(totals.to_dict()).remove(_weighing(date(2025, 1, 10), 80.5)) is False
@@ -0,0 +1,134 @@
+from datetime import date, time
+
+from eridanus.models import Crunch, JumpRope, PushUp, Run, Weight
+from eridanus.repository import StatisticsRepository
+from eridanus.statistics.user_stats import COUNTABLE, ActivityTotals, RunningTotals, WeighingTotals, run_speed
+
+
+def _run(day, duration, distance, calories, speed=None):
+    return Run(usernickname="u", activity_date=date(2025, 1, day), activity_time=time(7, 0),
+               duration=duration, distance=distance, calories=calories, speed=speed)
+
+
+def test_running_totals_add_and_remove():
+    runs = [_run(1, 30, 5.0, 300, 10.0), _run(2, 60, 12.0, 700), _run(3, 40, 6.0, None)]
+    totals = RunningTotals()
+    for run in runs:
+        totals.add(run)
+
+    assert totals.count == 3
+    assert totals.total_distance == 23.0
+    assert totals.total_calories == 1000
+    assert totals.speed_count == 3
+    assert totals.max_speed == 12.0
+    assert totals.date_last_run == date(2025, 1, 3)
+
+    # Removing a run which holds no record keeps the totals exact.
+    assert totals.remove(_run(1, 30, 5.0, 300, 10.0)) is True
+    assert totals.count == 2
+    assert totals.total_distance == 18.0
+
+    # Removing the longest run means the maxima must be rebuilt.
+    assert totals.remove(_run(2, 60, 12.0, 700)) is False
+
+
+def test_running_totals_round_trip():
+    totals = RunningTotals()
+    totals.add(_run(5, 30, 5.0, 300))
+    restored = RunningTotals(totals.to_dict())
+    assert restored.to_dict() == totals.to_dict()
+    assert restored.date_last_run == date(2025, 1, 5)
+
+
+def test_weighing_totals_keeps_last_20():
+    totals = WeighingTotals()
+    for day in range(1, 26):
+        totals.add(Weight(usernickname="u", weight=70.0 + day, weighing_date=date(2025, 1, day)))
+
+    assert totals.count == 25
+    assert len(totals.recent) == 20
+    assert totals.last_weight == 95.0
+    assert totals.min == 71.0
+    assert totals.max == 95.0
+
+
+def test_summaries_match_previous_formulas():
+    runs = [_run(1, 30, 5.0, 300, 10.0), _run(2, 60, 12.0, 700)]
+    totals = RunningTotals()
+    for run in runs:
+        totals.add(run)
+
+    class Stats:
+        running = totals.to_dict()
+        weighing = {}
+
+    summary = StatisticsRepository().running_summary(Stats)
+    assert summary["avg_calories"] == 500.0
+    assert summary["avg_speed"] == 11.0
+    assert summary["avg_distance"] == 8.5
+    assert summary["max_time"] == 60
+    assert summary["date_last_run"] == date(2025, 1, 2)
+    assert StatisticsRepository().weighing_summary(Stats) == {}
+
+
+def test_run_speed_of_projected_runs():
+    projected = Run(projection=("distance", "duration"), distance=10.0, duration=60)
+    assert run_speed(projected) == 10.0
+    assert run_speed(_run(1, 30, 5.0, 300, 12.5)) == 12.5
+
+
+def test_countable_kinds_come_from_the_models():
+    assert COUNTABLE == {"pushups": PushUp, "crunches": Crunch, "jump_rope": JumpRope}
+
+
+def test_activity_totals_and_summary():
+    sessions = [PushUp(usernickname="u", activity_date=date(2025, 1, 1), count=30, duration=2, calories=20),
+                PushUp(usernickname="u", activity_date=date(2025, 1, 3), count=50, duration=5, calories=40),
+                PushUp(usernickname="u", activity_date=date(2025, 1, 2), count=20, duration=None)]
+    totals = ActivityTotals()
+    for session in sessions:
+        totals.add(session)
+
+    assert totals.total_repetitions == 100
+    assert totals.max_repetitions == 50
+    assert totals.max_rate == 15.0
+    assert totals.date_last == date(2025, 1, 3)
+
+    class Stats:
+        activities = {"pushups": totals.to_dict()}
+
+    summary = StatisticsRepository().activity_summary(Stats, "pushups")
+    assert summary["count"] == 3
+    # Only the timed sessions count for the rate: 80 repetitions in 7 minutes.
+    assert summary["rate_per_minute"] == 80 / 7
+    assert summary["avg_repetitions"] == 100 / 3
+    assert StatisticsRepository().activity_summary(Stats, "crunches") == {}
+
+    # The untimed session holds no record, the fastest one does.
+    assert totals.remove(sessions[2]) is True
+    assert totals.remove(sessions[0]) is False
+
+
+def test_rebuild_matches_writes_for_stored_speeds(datastore_emulator):
+    from eridanus.activities.services import RunningService
+    from eridanus.repository import RunRepository
+
+    username = "__pytest_stored_speed__"
+    runs, repository = RunRepository(), StatisticsRepository()
+    created = [runs.create({"usernickname": username, "activity_date": date(2025, 1, 1),
+                            "activity_time": time(7, 0), "duration": 60, "distance": 12.0, "calories": 600})]
+    try:
+        repository.user_stats(username)
+        # An imported speed which is not distance over duration (10 km/h).
+        created.append(runs.create({"usernickname": username, "activity_date": date(2025, 1, 2),
+                                    "activity_time": time(7, 0), "duration": 60, "distance": 10.0,
+                                    "calories": 500, "speed": 15.0}))
+        incremental = repository.user_stats(username)
+        assert not incremental.stale
+        rebuilt = repository.rebuild_user_stats(username)
+        assert rebuilt.running == incremental.running
+        assert rebuilt.running["max_speed"] == 15.0
+        assert [item["speed"] for item in RunningService().fetch_all(username)["items"]] == [15.0, 12.0]
+    finally:
+        for run in created:
+            runs.delete(run.key.id())
@@ -0,0 +1,29 @@
+from io import BytesIO
+from zipfile import ZipFile
+
+from eridanus.utils.zipstream import stream_zip
+
+
+def test_stream_zip_round_trip():
+    rows = [("%d,row\r\n" % i).encode("utf-8") for i in range(1000)]
+    data = b"".join(stream_zip([("run.csv", iter(rows)), ("weight.csv", iter([b"w\r\n"]))]))
+
+    archive = ZipFile(BytesIO(data))
+    assert archive.namelist() == ["run.csv", "weight.csv"]
+    assert archive.read("run.csv") == b"".join(rows)
+    assert archive.read("weight.csv") == b"w\r\n"
+    assert archive.getinfo("run.csv").create_system == 0
+
+
+def test_stream_zip_is_lazy():
+    consumed = []
+
+    def chunks():
+        for i in range(3):
+            consumed.append(i)
+            yield b"x" * 10
+
+    stream = stream_zip([("run.csv", chunks())])
+    first = next(stream)
+    assert first.startswith(b"PK\x03\x04")
+    assert consumed == []